@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Benchmark the butler operations exercised by the obs_test unit tests,
+optionally comparing with a baseline.
+"""
+import argparse
+import sys
+
+from lsst.obs.test import compareResults, makeButlerOperations, readResults, runBenchmarks, writeResults
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--input", help="data repository with raws (default=data/input)")
+    parser.add_argument("-n", "--repeat", type=int, default=20, help="timed calls per operation (default=20)")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed calls per operation (default=2)")
+    parser.add_argument("--only", nargs="+", help="operations to run (default=all)")
+    parser.add_argument("-o", "--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare with; exit with status 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed fractional slowdown relative to the baseline (default=0.2)")
+    parser.add_argument("--statistic", default="p50", help="statistic to compare, e.g. p50, p90, mean "
+                        "(default=p50)")
+    args = parser.parse_args()
+
+    operations = makeButlerOperations(inputDir=args.input)
+    results = runBenchmarks(operations, repeat=args.repeat, warmup=args.warmup, names=args.only)
+
+    print("%-16s %10s %10s %10s %12s %10s" % ("operation", "p50 ms", "p90 ms", "p99 ms", "calls/sec",
+                                              "peak MB"))
+    for name, result in results.items():
+        summary = result.toDict()
+        if summary["error"] is not None:
+            print("%-16s failed: %s" % (name, summary["error"]))
+            continue
+        print("%-16s %10.3f %10.3f %10.3f %12.1f %10.1f" % (
+            name, summary["p50"]*1e3, summary["p90"]*1e3, summary["p99"]*1e3, summary["throughput"],
+            summary["peakRss"]/2**20))
+
+    if args.output:
+        writeResults(args.output, results, metadata=dict(input=args.input, repeat=args.repeat))
+    if args.baseline:
+        regressions = compareResults(results, readResults(args.baseline), threshold=args.threshold,
+                                     statistic=args.statistic)
+        for name, old, new, ratio in regressions:
+            print("REGRESSION %s: %s %.3f ms -> %.3f ms (x%.2f)" % (
+                name, args.statistic, old*1e3, new*1e3, ratio))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Measure registry lookups per second for the queries TestMapper issues.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+import lsst.daf.persistence as dafPersist
+from lsst.obs.test import PooledSqliteRegistry
+
+# (lookupProperties, reference, dataId keys) of the queries made by
+# lsst.obs.base.Mapping.lookup for raw-like datasets
+Queries = (
+    (["filter", "taiObs", "expTime"], "raw_visit", ("visit",)),
+    (["taiObs", "expTime"], ["raw"], ("visit", "filter")),
+    (["visit"], ["raw"], ("filter",)),
+)
+
+
+def makeDataIds(registryPath, num, seed):
+    """Make a random list of (visit, filter) data IDs found in a registry.
+    """
+    conn = sqlite3.connect(registryPath)
+    try:
+        rows = conn.execute("SELECT visit, filter FROM raw_visit").fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        raise RuntimeError("Registry %r has no visits" % (registryPath,))
+    rng = random.Random(seed)
+    return [dict(zip(("visit", "filter"), rng.choice(rows))) for i in range(num)]
+
+
+def timeLookups(registry, dataIdList):
+    """Return lookups per second for each query in `Queries`.
+    """
+    rates = []
+    for properties, reference, keys in Queries:
+        lookupIdList = [{key: dataId[key] for key in keys} for dataId in dataIdList]
+        t0 = time.perf_counter()
+        for lookupId in lookupIdList:
+            registry.lookup(properties, reference, lookupId)
+        rates.append(len(lookupIdList) / (time.perf_counter() - t0))
+    return rates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("repo", help="data repository containing registry.sqlite3, e.g. data/input")
+    parser.add_argument("-n", "--num", type=int, default=10000, help="number of data IDs (default=10000)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for choosing data IDs")
+    args = parser.parse_args()
+
+    registryPath = os.path.join(args.repo, "registry.sqlite3")
+    dataIdList = makeDataIds(registryPath, args.num, args.seed)
+    registries = (("SqliteRegistry", dafPersist.SqliteRegistry(registryPath)),
+                  ("PooledSqliteRegistry", PooledSqliteRegistry(registryPath)))
+
+    print("%-22s %s" % ("lookups/sec", " ".join("%12s" % ("+".join(q[2]),) for q in Queries)))
+    for name, registry in registries:
+        rates = timeLookups(registry, dataIdList)
+        print("%-22s %s" % (name, " ".join("%12.0f" % (rate,) for rate in rates)))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Convert PropertySet metadata files between YAML (YamlStorage) and the
+binary format of BinaryPropertySetStorage, optionally timing both formats.
+
+Files ending in ".yaml" are converted to ".psbin" and vice versa; the
+converted file is written next to the original.
+"""
+import argparse
+import os
+
+import yaml
+
+from lsst.obs.test import packPropertySet, unpackPropertySet, timeOperation
+
+
+def readMetadata(path):
+    """Read a YAML or binary metadata file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".psbin"):
+        return unpackPropertySet(data)
+    return yaml.load(data, Loader=yaml.UnsafeLoader)
+
+
+def benchmark(metadata, repeat):
+    """Time writing and reading a container in both formats.
+
+    Returns
+    -------
+    results : `dict` [`str`, `BenchmarkResult`]
+        Results of ``yamlDump``, ``yamlLoad``, ``binaryPack`` and
+        ``binaryUnpack``.
+    """
+    yamlData = yaml.dump(metadata)
+    binaryData = packPropertySet(metadata)
+    operations = {
+        "yamlDump": lambda: yaml.dump(metadata),
+        "yamlLoad": lambda: yaml.load(yamlData, Loader=yaml.UnsafeLoader),
+        "binaryPack": lambda: packPropertySet(metadata),
+        "binaryUnpack": lambda: unpackPropertySet(binaryData),
+    }
+    return {name: timeOperation(name, func, repeat=repeat) for name, func in operations.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="+", help="metadata files (.yaml or .psbin)")
+    parser.add_argument("--benchmark", action="store_true", help="time reading and writing each format")
+    parser.add_argument("--no-convert", dest="convert", action="store_false",
+                        help="do not write converted files")
+    parser.add_argument("-n", "--repeat", type=int, default=20, help="timed calls per operation (default=20)")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        base, ext = os.path.splitext(path)
+        if ext not in (".yaml", ".psbin"):
+            parser.error("%s: unsupported extension %r" % (path, ext))
+        metadata = readMetadata(path)
+        if args.convert:
+            if ext == ".yaml":
+                outPath = base + ".psbin"
+                with open(outPath, "wb") as f:
+                    f.write(packPropertySet(metadata))
+            else:
+                outPath = base + ".yaml"
+                with open(outPath, "w") as f:
+                    yaml.dump(metadata, f)
+            print("%s -> %s (%d -> %d bytes)" %
+                  (path, outPath, os.path.getsize(path), os.path.getsize(outPath)))
+        if args.benchmark:
+            results = benchmark(metadata, args.repeat)
+            p50 = {name: result.getStatistic("p50") for name, result in results.items()}
+            print("%s: dump %.3f ms yaml, %.3f ms binary (x%.1f); "
+                  "load %.3f ms yaml, %.3f ms binary (x%.1f)" %
+                  (path, p50["yamlDump"]*1e3, p50["binaryPack"]*1e3, p50["yamlDump"]/p50["binaryPack"],
+                   p50["yamlLoad"]*1e3, p50["binaryUnpack"]*1e3, p50["yamlLoad"]/p50["binaryUnpack"]))
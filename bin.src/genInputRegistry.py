@@ -28,13 +28,13 @@ import shutil
 import sqlite3
 import sys
 
-import lsst.daf.base as dafBase
 from lsst.afw.fits import readMetadata
+from lsst.obs.test import createRawTables, finalizeRawRegistry, makeRawRow
 
 DefaultOutputRegistry = "registry.sqlite3"
 
 
-def process(dirList, inputRegistry=None, outputRegistry="registry.sqlite3"):
+def process(dirList, inputRegistry=None, outputRegistry="registry.sqlite3", journalMode="wal"):
     print("process(dirList=%s)" % (dirList,))
     if os.path.exists(outputRegistry):
         sys.stderr.write("Output registry %r exists; will not overwrite.\n" % (outputRegistry,))
@@ -46,18 +46,12 @@ def process(dirList, inputRegistry=None, outputRegistry="registry.sqlite3"):
         shutil.copy(inputRegistry, outputRegistry)
 
     conn = sqlite3.connect(outputRegistry)
+    conn.execute("PRAGMA journal_mode=WAL")
 
     done = {}
     if inputRegistry is None:
         # Create tables in new output registry.
-        cmd = """CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT,
-            visit INT, filter TEXT, taiObs TEXT, expTime DOUBLE)"""
-        conn.execute(cmd)
-        cmd = "CREATE TABLE raw_skyTile (id INTEGER, skyTile INTEGER)"
-        conn.execute(cmd)
-        conn.execute("""CREATE TABLE raw_visit (visit INT, filter TEXT,
-            taiObs TEXT, expTime DOUBLE, UNIQUE(visit))""")
-        conn.commit()
+        createRawTables(conn)
     else:
         cmd = """SELECT visit || '_f' || filter || FROM raw"""
         for row in conn.execute(cmd):
@@ -71,15 +65,7 @@ def process(dirList, inputRegistry=None, outputRegistry="registry.sqlite3"):
             processRawDir(rawDir, conn, done)
     finally:
         print("Cleaning up...")
-        conn.execute("DELETE FROM raw_visit")
-        conn.commit()
-        conn.execute("""INSERT INTO raw_visit
-                SELECT DISTINCT visit, filter, taiObs, expTime FROM raw""")
-        conn.commit()
-        conn.execute("""CREATE UNIQUE INDEX uq_raw ON raw
-                (visit)""")
-        conn.execute("CREATE INDEX ix_skyTile_id ON raw_skyTile (id)")
-        conn.execute("CREATE INDEX ix_skyTile_tile ON raw_skyTile (skyTile)")
+        finalizeRawRegistry(conn, journalMode=journalMode)
         conn.close()
     print("wrote registry file %r" % (outputRegistry,))
 
@@ -103,13 +89,9 @@ def processRawDir(rawDir, conn, done):
             continue
 
         md = readMetadata(fitsPath)
-        expTime = md.getScalar("EXPTIME")
-        mjdObs = md.getScalar("MJD-OBS")
-        taiObs = dafBase.DateTime(mjdObs, dafBase.DateTime.MJD,
-                                  dafBase.DateTime.TAI).toString(dafBase.DateTime.UTC)[:-1]
         conn.execute("""INSERT INTO raw VALUES
             (NULL, ?, ?, ?, ?)""",
-                     (visit, filterName, taiObs, expTime))
+                     makeRawRow(visit, filterName, md))
 
         conn.commit()
 
@@ -125,5 +107,8 @@ if __name__ == "__main__":
     parser.add_argument("-i", "--input", help="input registry")
     parser.add_argument("-o", "--output", default=DefaultOutputRegistry,
                         help="output registry (default=%s)" % (DefaultOutputRegistry,))
+    parser.add_argument("--journal-mode", default="wal", choices=("wal", "delete"),
+                        help="SQLite journal mode of the output registry; use 'delete' for a registry "
+                             "that will be read from a read-only directory (default=wal)")
     args = parser.parse_args()
-    process(args.dir, args.input, args.output)
+    process(args.dir, args.input, args.output, journalMode=args.journal_mode)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Register obs_test calibrations, reading headers in parallel and
+computing validity ranges in one pass.
+"""
+import argparse
+import os
+
+from lsst.obs.test import ingestCalibs
+from lsst.obs.test.calibIngest import DefaultValidity
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("calib", help="calibration repository; calibRegistry.sqlite3 is created or updated")
+    parser.add_argument("files", nargs="+", help="calibration files, already at their template location")
+    parser.add_argument("--calibType", help="calibration type of all files (default: OBSTYPE header)")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="number of processes to read headers")
+    parser.add_argument("--validity", type=int, default=DefaultValidity,
+                        help="validity (days) of calibrations not valid until superseded (default=%s)" %
+                             (DefaultValidity,))
+    parser.add_argument("--no-increment-valid-end", dest="incrementValidEnd", action="store_false",
+                        help="end validity ranges split at a midpoint on the midpoint, not the day after")
+    args = parser.parse_args()
+
+    result = ingestCalibs(os.path.join(args.calib, "calibRegistry.sqlite3"), args.files,
+                          calibType=args.calibType, numProcesses=args.processes, validity=args.validity,
+                          incrementValidEnd=args.incrementValidEnd)
+    print("registered %d calibrations" % (result.numIngested,))
+    for stage, elapsed in result.timings.items():
+        print("%-16s %8.3f sec" % (stage, elapsed))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Make an obs_test data repository with many synthetic visits, for scaling
+benchmarks.
+"""
+import argparse
+
+from lsst.obs.test import makeSyntheticRepo
+from lsst.obs.test.syntheticRepo import PixelModes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("root", help="directory of the new repository")
+    parser.add_argument("-n", "--visits", type=int, default=1000, help="number of visits (default=1000)")
+    parser.add_argument("--filters", nargs="+", default=["g", "r"], help="filters (default=g r)")
+    parser.add_argument("--calibs", type=int, default=10,
+                        help="number of calibrations of each type and filter (default=10)")
+    parser.add_argument("--pixels", default="none", choices=PixelModes,
+                        help="raw files to make: none, hard links to the shipped raws, or tiny raws with "
+                             "per-visit headers (default=none)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default=0)")
+    parser.add_argument("--journal-mode", default="wal", choices=("wal", "delete"),
+                        help="SQLite journal mode of the registries (default=wal)")
+    args = parser.parse_args()
+
+    result = makeSyntheticRepo(args.root, args.visits, filters=args.filters, numCalibs=args.calibs,
+                               pixels=args.pixels, seed=args.seed, journalMode=args.journal_mode)
+    print("made %s with %d visits and %d calibrations" % (result.root, result.numVisits, result.numCalibs))
+    for stage, elapsed in result.timings.items():
+        print("%-16s %8.3f sec" % (stage, elapsed))
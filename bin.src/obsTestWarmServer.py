@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Run command-line tasks in workers forked from a pre-warmed server.
+
+Start a server, which imports the stack and builds the obs_test camera once:
+
+    obsTestWarmServer.py serve /tmp/obs_test.sock &
+
+then run tasks through it, e.g.:
+
+    obsTestWarmServer.py run /tmp/obs_test.sock lsst.pipe.tasks.processCcd.ProcessCcdTask \\
+        data/input --output /tmp/out --id visit=1
+"""
+import time
+
+StartTime = time.perf_counter()
+
+import argparse  # noqa: E402
+import array  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import socket  # noqa: E402
+import sys  # noqa: E402
+
+
+def serve(socketPath, allowedTasks=None):
+    from lsst.obs.test import WarmServer
+
+    server = WarmServer(socketPath, startTime=StartTime, allowedTasks=allowedTasks)
+    print("ready in %.2f sec; listening on %s" % (server.startupTime, socketPath), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("ran %d jobs; saved about %.1f sec of startup" % (server.numJobs, server.startupSaved))
+        server.server_close()
+
+
+def run(socketPath, taskName, taskArgs):
+    # Same protocol as lsst.obs.test.runWarmTask, without importing the
+    # stack, so that the client itself starts quickly.
+    payload = json.dumps(dict(task=taskName, args=taskArgs, cwd=os.getcwd())) + "\n"
+    sys.stdout.flush()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socketPath)
+        sock.sendmsg([payload.encode()], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [1, 2]))])
+        with sock.makefile("rb") as f:
+            response = json.loads(f.readline().decode())
+    if response["error"]:
+        sys.stderr.write(response["error"])
+    sys.stderr.write("%s: exit status %d in %.2f sec; startup saved %.2f sec\n" % (
+        taskName, response["exitStatus"], response["elapsed"], response["startupSaved"]))
+    return response["exitStatus"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    serveParser = subparsers.add_parser("serve", help="start a server")
+    serveParser.add_argument("socket", help="path of the Unix socket to create")
+    serveParser.add_argument("--allow", action="append", metavar="TASK",
+                             help="fully qualified name of a task that may be run (repeatable); "
+                                  "any task if not given")
+    runParser = subparsers.add_parser("run", help="run a task in a worker of a server")
+    runParser.add_argument("socket", help="path of the server's Unix socket")
+    runParser.add_argument("task", help="fully qualified name of a CmdLineTask class")
+    runParser.add_argument("args", nargs=argparse.REMAINDER, help="arguments for the task")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.socket, args.allow)
+    elif args.command == "run":
+        sys.exit(run(args.socket, args.task, args.args))
+    else:
+        parser.print_help()
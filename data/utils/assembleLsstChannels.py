@@ -72,12 +72,10 @@ def updateMetadata(metadata, **kwargs):
             metadata.set(key, value)
 
 
-def assembleImage(dirPath, **kwargs):
+def assembleExposure(dirPath, **kwargs):
     """Make one image by combining half of amplifiers C00, C01, C10, C11
     of lsstSim data.
 
-    The new image shall be written to a fixed location on disk.
-
     Parameters
     ----------
     dirpath : `str`
@@ -85,6 +83,11 @@ def assembleImage(dirPath, **kwargs):
     kwargs : `str` to `str`
         Default values for output header keywords. The keyword(s) provided
         in the input image always takes precedence.
+
+    Returns
+    -------
+    exposure : `lsst.afw.image.ExposureF`
+        The assembled image.
     """
     inExposure = openChannelImage(dirPath, 0, 0)
     fullInDim = inExposure.getDimensions()
@@ -124,8 +127,16 @@ def assembleImage(dirPath, **kwargs):
             outSubBBox = afwGeom.Box2I(afwGeom.Point2I(xStart, yStart), subDim)
             outMIView = outMI.Factory(outMI, outSubBBox)
             outMIView[:] = inMIView
+    return outExposure
+
 
-    outExposure.writeFits(OutFileName)
+def assembleImage(dirPath, **kwargs):
+    """Make one image by combining half of amplifiers C00, C01, C10, C11
+    of lsstSim data and write it to `OutFileName`.
+
+    Parameters are as for `assembleExposure`.
+    """
+    assembleExposure(dirPath, **kwargs).writeFits(OutFileName)
     print("wrote assembled data as %r" % (OutFileName,))
 
 
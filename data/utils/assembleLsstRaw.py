@@ -56,8 +56,13 @@ def openChannelImage(dirPath, x, y):
     return afwImage.DecoratedImageU(inDecoImagePath)
 
 
-def assembleImage(dirPath):
+def assembleRaw(dirPath):
     """Make one image by combining half of amplifiers C00, C01, C10, C11 of lsstSim data
+
+    Returns
+    -------
+    decoImage : `lsst.afw.image.DecoratedImageU`
+        The assembled raw image and its header.
     """
     # views and assembly operations require a masked image, not a DecoratedImage
     inDecoImage = openChannelImage(dirPath, 0, 0)
@@ -91,8 +96,14 @@ def assembleImage(dirPath):
             outImage = outDecoImage.getImage()
             outView = outImage.Factory(outImage, outSubBBox)
             outView[:] = inView
+    return outDecoImage
+
 
-    outDecoImage.writeFits(OutFileName)
+def assembleImage(dirPath):
+    """Make one image by combining half of amplifiers C00, C01, C10, C11 of lsstSim data
+    and write it to `OutFileName`
+    """
+    assembleRaw(dirPath).writeFits(OutFileName)
     print("wrote assembled data as %r" % (OutFileName,))
 
 
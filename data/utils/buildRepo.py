@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Build the obs_test input repository from lsstSim data in one pipelined
+command.
+
+This runs the recipe in data/ReadMe.md (assembleLsstChannels.py for the
+bias and flats, assembleLsstRaw.py for each visit, genInputRegistry.py,
+defectsFromBias.py and ingestion of the calibrations) as a graph of stages
+that run concurrently and hand images to each other in memory. Stages
+whose inputs have not changed since the last build are skipped.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+import lsst.afw.image as afwImage
+from lsst.obs.test import BuildPipeline, createRawTables, finalizeRawRegistry, makeRawRow
+
+from assembleLsstChannels import assembleExposure
+from assembleLsstRaw import assembleRaw
+
+try:
+    from lsst.pipe.tasks.ingestCuratedCalibs import IngestCuratedCalibsTask
+except ImportError:
+    IngestCuratedCalibsTask = None
+
+CalibDate = "1999-01-17T05:22:00"
+"""DATE-OBS of the bias and flats."""
+
+Calibs = (
+    # stage name, lsstSim directory, header keywords, repository path
+    ("bias", "bias/v0/R22/S00", dict(OBSTYPE="bias"), "bias/bias.fits.gz"),
+    ("flat_g", "flat/v2-fg/R22/S00", dict(OBSTYPE="flat"), "flat/flat_fg.fits.gz"),
+    ("flat_r", "flat/v2-fr/R22/S00", dict(OBSTYPE="flat"), "flat/flat_fr.fits.gz"),
+)
+"""Calibration images."""
+
+Visits = (
+    (1, "g", "raw/v890104911-fg/E000/R22/S00"),
+    (2, "g", "raw/v890106021-fg/E000/R22/S00"),
+    (3, "r", "raw/v890880321-fr/E000/R22/S00"),
+)
+"""obs_test visit, filter and lsstSim directory of each raw image."""
+
+DefectsFileName = os.path.join("0", "19700101T000000")
+"""Path of the defects file, without extension, relative to the curated
+defects directory.
+"""
+
+
+def writeFitsAtomic(image, path):
+    """Write an image to a FITS file that appears only when complete."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tempPath = os.path.join(os.path.dirname(path), ".tmp-" + os.path.basename(path))
+    image.writeFits(tempPath)
+    os.replace(tempPath, path)
+
+
+def makeCalibStage(pipeline, name, inDir, keywords, outPath):
+    def run():
+        exposure = assembleExposure(inDir, **keywords)
+        writeFitsAtomic(exposure, outPath)
+        return exposure
+
+    pipeline.addStage(name, run, inputs=[inDir], outputs=[outPath],
+                      load=lambda: afwImage.ExposureF(outPath),
+                      parameters=dict(keywords=sorted(keywords.items()), outPath=outPath))
+
+
+def makeRawStage(pipeline, name, inDir, outPath):
+    def run():
+        decoImage = assembleRaw(inDir)
+        writeFitsAtomic(decoImage, outPath)
+        return decoImage
+
+    pipeline.addStage(name, run, inputs=[inDir], outputs=[outPath],
+                      load=lambda: afwImage.DecoratedImageU(outPath), parameters=dict(outPath=outPath))
+
+
+def makeCalibRegistry(repo, defectsDir):
+    """Make the calibration registry of a repository by ingesting the
+    curated defects, as ``ingestCuratedCalibs.py`` does in data/ReadMe.md.
+
+    The registry is made afresh by `IngestCuratedCalibsTask`, so it has the
+    tables pipe_tasks creates for a new registry (bias, dark, flat, fringe,
+    sky and defects) and a single defects entry, like the checked-in
+    registry. The bias and flats are not registered: the mapper finds them
+    by their templates.
+
+    Parameters
+    ----------
+    repo : `str`
+        Repository, containing ``_mapper``.
+    defectsDir : `str`
+        Directory of the curated defects.
+    """
+    calibRegistryPath = os.path.join(repo, "calibRegistry.sqlite3")
+    if os.path.exists(calibRegistryPath):
+        os.unlink(calibRegistryPath)
+    IngestCuratedCalibsTask.parseAndRun(args=[repo, defectsDir, "--calib", repo])
+
+
+def makePipeline(lsstSimDir, repo, defectsDir, numThreads=4, journalMode="delete"):
+    """Make the pipeline that builds an obs_test repository.
+
+    Parameters
+    ----------
+    lsstSimDir : `str`
+        Root of the lsstSim data (containing ``raw``, ``bias`` and
+        ``flat``).
+    repo : `str`
+        Repository to build.
+    defectsDir : `str`
+        Directory for the curated defects made from the bias.
+    numThreads : `int`, optional
+        Number of stages to run at once.
+    journalMode : `str`, optional
+        SQLite journal mode of the registries.
+
+    Returns
+    -------
+    pipeline : `lsst.obs.test.BuildPipeline`
+        The pipeline.
+    """
+    os.makedirs(repo, exist_ok=True)
+    pipeline = BuildPipeline(os.path.join(repo, ".buildState.json"), numThreads=numThreads)
+
+    def writeMapper():
+        with open(os.path.join(repo, "_mapper"), "w") as f:
+            f.write("lsst.obs.test.TestMapper\n")
+
+    pipeline.addStage("mapper", writeMapper, outputs=[os.path.join(repo, "_mapper")])
+
+    for name, inDir, keywords, outPath in Calibs:
+        keywords = dict(keywords, **{"DATE-OBS": CalibDate})
+        makeCalibStage(pipeline, name, os.path.join(lsstSimDir, inDir), keywords, os.path.join(repo, outPath))
+
+    rawNames = []
+    for visit, filterName, inDir in Visits:
+        name = "raw_v%d" % (visit,)
+        rawNames.append(name)
+        makeRawStage(pipeline, name, os.path.join(lsstSimDir, inDir),
+                     os.path.join(repo, "raw", "raw_v%d_f%s.fits.gz" % (visit, filterName)))
+
+    registryPath = os.path.join(repo, "registry.sqlite3")
+
+    def makeRegistry(*rawImages):
+        tempPath = registryPath + ".tmp"
+        if os.path.exists(tempPath):
+            os.unlink(tempPath)
+        conn = sqlite3.connect(tempPath)
+        try:
+            createRawTables(conn)
+            conn.executemany("INSERT INTO raw VALUES (NULL, ?, ?, ?, ?)",
+                             [makeRawRow(visit, filterName, rawImage.getMetadata())
+                              for (visit, filterName, _), rawImage in zip(Visits, rawImages)])
+            conn.commit()
+            finalizeRawRegistry(conn, journalMode=journalMode)
+        finally:
+            conn.close()
+        os.replace(tempPath, registryPath)
+
+    pipeline.addStage("registry", makeRegistry, dependencies=rawNames, outputs=[registryPath],
+                      parameters=dict(journalMode=journalMode))
+
+    def makeDefects(bias):
+        from defectsFromBias import makeDefects
+        path = os.path.join(defectsDir, DefectsFileName)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return makeDefects(bias.getMaskedImage()).writeText(path)
+
+    pipeline.addStage("defects", makeDefects, dependencies=["bias"], outputs=[defectsDir])
+
+    if IngestCuratedCalibsTask is not None:
+        calibRegistryPath = os.path.join(repo, "calibRegistry.sqlite3")
+
+        def ingestCurated():
+            makeCalibRegistry(repo, defectsDir)
+
+        pipeline.addStage("calibRegistry", ingestCurated, after=["mapper", "defects"],
+                          outputs=[calibRegistryPath])
+    else:
+        print("pipe_tasks is not set up; not rebuilding the calibration registry", file=sys.stderr)
+    return pipeline
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("lsstSimDir", help="root of the lsstSim data, containing raw, bias and flat")
+    parser.add_argument("repo", help="repository to build, e.g. data/input")
+    parser.add_argument("--defects-dir", help="directory for the curated defects "
+                        "(default=$OBS_TEST_DATA_DIR/test/defects if set, else <repo>/curated/defects)")
+    parser.add_argument("-j", "--threads", type=int, default=4, help="number of stages to run at once")
+    parser.add_argument("--journal-mode", default="delete", choices=("wal", "delete"),
+                        help="SQLite journal mode of the registries (default=delete)")
+    parser.add_argument("--force", action="store_true", help="run every stage, even if up to date")
+    args = parser.parse_args()
+
+    defectsDir = args.defects_dir
+    if defectsDir is None:
+        if "OBS_TEST_DATA_DIR" in os.environ:
+            defectsDir = os.path.join(os.environ["OBS_TEST_DATA_DIR"], "test", "defects")
+        else:
+            defectsDir = os.path.join(args.repo, "curated", "defects")
+    pipeline = makePipeline(args.lsstSimDir, args.repo, defectsDir, numThreads=args.threads,
+                            journalMode=args.journal_mode)
+    result = pipeline.run(force=args.force)
+    print(BuildPipeline.formatTimings(result.timings))
+    print("total %.3f sec" % (result.elapsed,))
@@ -35,6 +35,30 @@ detectorSerial = "0000011"
 """Detector serial code"""
 
 
+def makeDefects(biasMI):
+    """Make defects from the BAD mask plane of a test camera bias frame.
+
+    Parameters
+    ----------
+    biasMI : `lsst.afw.image.MaskedImageF`
+        Bias frame.
+
+    Returns
+    -------
+    defects : `lsst.ip.isr.Defects`
+        Defects, with the metadata needed to ingest them as curated
+        calibrations.
+    """
+    defectList = Defects.fromMask(biasMI, "BAD")
+    valid_start = dateutil.parser.parse('19700101T000000')
+    md = defectList.getMetadata()
+    md['INSTRUME'] = 'test'
+    md['DETECTOR'] = detectorName
+    md['CALIBDATE'] = valid_start.isoformat()
+    md['FILTER'] = None
+    return defectList
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description=f"""Construct a defects file from the mask plane of a test camera bias frame.
@@ -46,13 +70,7 @@ Output is written to the current directory as file {DefectsPath}, which must not
     args = parser.parse_args()
 
     biasMI = afwImage.MaskedImageF(args.bias)
-    defectList = Defects.fromMask(biasMI, "BAD")
-    valid_start = dateutil.parser.parse('19700101T000000')
-    md = defectList.getMetadata()
-    md['INSTRUME'] = 'test'
-    md['DETECTOR'] = detectorName
-    md['CALIBDATE'] = valid_start.isoformat()
-    md['FILTER'] = None
+    defectList = makeDefects(biasMI)
     defect_file = defectList.writeText(DefectsPath)
     print("wrote defects file %r" % (DefectsPath,))
 
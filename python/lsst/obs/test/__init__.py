@@ -19,8 +19,55 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import importlib
+
+# Modules that register storage formatters, or that TestMapper imports
 from .version import *
 from .testConfig import *
+from .calibValidity import *
+from .registry import *
+from .registrySnapshot import *
+from .exposureRecord import *
+from .configStorage import *
+from .fitsWriter import *
+from .writeBehind import *
+from .figureStorage import *
+from .listingCache import *
+from .propertySetStorage import *
+from .metadataStore import *
+from .headerCache import *
+from .streamingWriter import *
 from .testMapper import *
 from .makeTestRawVisitInfo import *
 from .dualRawImage import *
+
+# Optional subsystems, imported when one of their names is first used, so
+# they add nothing to the import time of command-line tasks.
+_lazyModules = {
+    "calibIngest": ["readCalibHeader", "computeValidity", "ingestCalibs"],
+    "configCache": ["ConfigLoadCache", "loadConfig", "getDefaultConfigCacheDir", "hashFile",
+                    "getConfigStructure", "diffConfig", "applyConfigDelta"],
+    "argumentParser": ["ObsTestDataIdContainer", "ObsTestArgumentParser"],
+    "syntheticRepo": ["makeSyntheticRepo"],
+    "buildPipeline": ["BuildStage", "BuildPipeline", "hashPath"],
+    "benchmark": ["BenchmarkResult", "timeOperation", "runBenchmarks", "writeResults", "readResults",
+                  "compareResults", "makeButlerOperations", "makeCompressionOperations",
+                  "CompressionSettings"],
+    "taskRunner": ["StreamingTaskRunner", "WarmButlerTaskRunner", "DynamicTaskRunner", "SpilledResultList",
+                   "iterTaskResults"],
+    "warmServer": ["WarmServer", "runWarmTask"],
+}
+_lazyNames = {name: moduleName for moduleName, names in _lazyModules.items() for name in names}
+
+
+def __getattr__(name):
+    moduleName = _lazyNames.get(name)
+    if moduleName is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module("." + moduleName, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazyNames))
@@ -0,0 +1,410 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["ObsTestDataIdContainer", "ObsTestArgumentParser"]
+
+import os
+import re
+
+import numpy as np
+
+import lsst.log as lsstLog
+import lsst.daf.persistence as dafPersist
+import lsst.pipe.base as pipeBase
+import lsst.utils
+from lsst.pipe.base.argumentParser import ConfigFileAction, IdValueAction
+from .configCache import ConfigLoadCache
+from .listingCache import getButlerRepositories
+
+_rangeRe = re.compile(r"^(\d+)\.\.(\d+)(?::(\d+))?$")
+
+
+class _IdProduct:
+    """The cross product of the values of each key of one ``--id``
+    argument, held as one array of values per key.
+
+    Parameters
+    ----------
+    keys : `list` of `str`
+        Data ID keys, in command-line order.
+    values : `list` of `numpy.ndarray`
+        Values of each key, in command-line order; duplicates are removed.
+    """
+
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = [_uniqueInOrder(v) for v in values]
+
+    def __len__(self):
+        return int(np.prod([len(v) for v in self.values]))
+
+    def toDicts(self):
+        """Return the cross product as a `list` of `dict`, in the order of
+        `itertools.product`.
+        """
+        grids = np.meshgrid(*self.values, indexing="ij") if self.values else []
+        columns = [grid.ravel().tolist() for grid in grids]
+        return [dict(zip(self.keys, row)) for row in zip(*columns)]
+
+
+def _uniqueInOrder(values):
+    """Remove duplicates from an array, keeping the first occurrence of
+    each value in its original position.
+    """
+    _, first = np.unique(values, return_index=True)
+    return values[np.sort(first)]
+
+
+def _rankIn(values, column):
+    """Return the position in ``values`` of each element of ``column``, or
+    -1 where it is not in ``values``.
+    """
+    if values.dtype != object:
+        # Only compare columns of the same kind: casting (e.g. float to
+        # int) could make unequal values match.
+        typedColumn = np.array(column.tolist())
+        if typedColumn.dtype.kind == values.dtype.kind:
+            order = np.argsort(values, kind="stable")
+            sortedValues = values[order]
+            pos = np.searchsorted(sortedValues, typedColumn).clip(0, len(values) - 1)
+            return np.where(sortedValues[pos] == typedColumn, order[pos], -1)
+    positions = {value: i for i, value in enumerate(values.tolist())}
+    return np.fromiter((positions.get(value, -1) for value in column.tolist()), dtype=np.int64,
+                       count=len(column))
+
+
+class _ArrayIdValueAction(IdValueAction):
+    """argparse action for ``--id`` that keeps the values of each key as an
+    array instead of expanding their cross product into dicts, if the data
+    ID container is an `ObsTestDataIdContainer`.
+
+    Ranges ``first..last[:step]`` become `numpy.arange`; other values are
+    kept as strings until `ObsTestDataIdContainer.castDataIds`.
+    """
+
+    def __call__(self, parser, namespace, values, option_string):
+        if namespace.config is None:
+            return
+        ident = getattr(namespace, option_string.lstrip("-"))
+        if not isinstance(ident, ObsTestDataIdContainer):
+            return IdValueAction.__call__(self, parser, namespace, values, option_string)
+        keys = []
+        arrays = []
+        for nameValue in values:
+            name, sep, valueStr = nameValue.partition("=")
+            if not valueStr:
+                parser.error("%s value %s must be in form name=value" % (option_string, nameValue))
+            if name in keys:
+                parser.error("%s appears multiple times in one ID argument: %s" % (name, option_string))
+            pieces = []
+            for v in valueStr.split("^"):
+                mat = _rangeRe.search(v)
+                if mat:
+                    first = int(mat.group(1))
+                    last = int(mat.group(2))
+                    step = int(mat.group(3) or 1)
+                    pieces.append(np.arange(first, last + 1, step, dtype=np.int64))
+                else:
+                    pieces.append(np.array([v], dtype=object))
+            if all(piece.dtype != object for piece in pieces):
+                array = np.concatenate(pieces)
+            else:
+                array = np.concatenate([piece.astype(str).astype(object) for piece in pieces])
+            keys.append(name)
+            arrays.append(array)
+        ident.idProducts.append(_IdProduct(keys, arrays))
+
+
+class ObsTestDataIdContainer(pipeBase.DataIdContainer):
+    """A data ID container that expands ``--id`` values in bulk.
+
+    `lsst.pipe.base.DataIdContainer` expands ``--id visit=1..1000000`` into
+    one dict per data ID and queries the registry once for each. This
+    container, filled by `ObsTestArgumentParser`, keeps the values of each
+    key as an array (`_IdProduct`) and finds the data references with one
+    `lsst.daf.persistence.Butler.queryMetadata` call: a registry row matches
+    the cross product if each of its values is in the values given for that
+    key (`numpy.isin`), so the cross product is never built. Duplicate
+    values are dropped and references are returned in the order of the
+    cross product, as the base class does; references whose dataset does
+    not exist are dropped, as by `lsst.daf.persistence.searchDataRefs`,
+    with one bulk check (`TestMapper.datasetsExist`).
+
+    ``idList`` is built from the arrays only if it is accessed.
+
+    Parameters
+    ----------
+    level : `str`, optional
+        The lowest hierarchy level to descend to for this dataset type.
+    """
+
+    def __init__(self, level=None):
+        self.idProducts = []
+        pipeBase.DataIdContainer.__init__(self, level=level)
+
+    @property
+    def idList(self):
+        """Data IDs (`list` of `dict`); expanded from ``idProducts`` on first
+        access.
+        """
+        for product in self.idProducts:
+            self._idList += product.toDicts()
+        self.idProducts = []
+        return self._idList
+
+    @idList.setter
+    def idList(self, value):
+        self._idList = value
+        self.idProducts = []
+
+    def castDataIds(self, butler):
+        """Validate data IDs and cast them to the correct type (modify
+        ``idProducts`` and ``idList`` in place).
+
+        Parameters
+        ----------
+        butler : `lsst.daf.persistence.Butler`
+            Data butler.
+
+        Raises
+        ------
+        KeyError
+            Raised if the keys of the dataset type cannot be found.
+        TypeError
+            Raised if a value cannot be cast to the type of its key.
+        """
+        if self.datasetType is None:
+            raise RuntimeError("Must call setDatasetType first")
+        try:
+            idKeyTypeDict = butler.getKeys(datasetType=self.datasetType, level=self.level)
+        except KeyError as e:
+            msg = "Cannot get keys for datasetType %s at level %s" % (self.datasetType, self.level)
+            raise KeyError(msg) from e
+
+        def getKeyType(key):
+            keyType = idKeyTypeDict.get(key)
+            if keyType is None:
+                # OK, assume that it's a valid key and guess that it's a string
+                keyType = str
+                lsstLog.Log.getDefaultLogger().warn("Unexpected ID %s; guessing type is \"%s\"" %
+                                                    (key, "str" if keyType == str else keyType))
+                idKeyTypeDict[key] = keyType
+            return keyType
+
+        for product in self.idProducts:
+            for i, (key, values) in enumerate(zip(product.keys, product.values)):
+                keyType = getKeyType(key)
+                try:
+                    if keyType is int:
+                        values = values.astype(np.int64)
+                    elif keyType is float:
+                        values = values.astype(np.float64)
+                    elif keyType is str:
+                        values = values.astype(str).astype(object)
+                    else:
+                        values = np.array([keyType(v) for v in values.tolist()], dtype=object)
+                except (TypeError, ValueError):
+                    raise TypeError("Cannot cast values %s to %s for ID key %r" % (values, keyType, key))
+                product.values[i] = _uniqueInOrder(values)
+        for dataDict in self._idList:
+            for key, strVal in dataDict.items():
+                keyType = getKeyType(key)
+                if keyType != str:
+                    try:
+                        castVal = keyType(strVal)
+                    except Exception:
+                        raise TypeError("Cannot cast value %r to %s for ID key %r" % (strVal, keyType, key,))
+                    dataDict[key] = castVal
+
+    def makeDataRefList(self, namespace):
+        """Compute ``refList`` based on ``idProducts`` and ``idList``, in the
+        order of the ``--id`` arguments.
+
+        Parameters
+        ----------
+        namespace : `argparse.Namespace`
+            Results of parsing command-line; ``butler`` and ``log`` are
+            used.
+        """
+        if self.datasetType is None:
+            raise RuntimeError("Must call setDatasetType first")
+        butler = namespace.butler
+        # Data IDs already in idList were given before the products left
+        parts = [(dataId, None) for dataId in self._idList]
+        for product in self.idProducts:
+            refList = self._findDataRefs(butler, product)
+            if refList is None:
+                # Keys the registry cannot answer in bulk
+                parts += [(dataId, None) for dataId in product.toDicts()]
+            else:
+                parts.append((dict(zip(product.keys, (v.tolist() for v in product.values))), refList))
+        # References are in the order of the --id arguments
+        for dataId, refList in parts:
+            if refList is None:
+                refList = dafPersist.searchDataRefs(butler, datasetType=self.datasetType, level=self.level,
+                                                    dataId=dataId)
+            if not refList:
+                namespace.log.warn("No data found for dataId=%s", dataId)
+                continue
+            self.refList += refList
+
+    def _findDataRefs(self, butler, product):
+        """Find the data references matching a cross product of values with
+        one registry query.
+
+        Returns
+        -------
+        refList : `list` of `lsst.daf.persistence.ButlerDataRef` or `None`
+            Data references in cross product order, or `None` if they
+            cannot be found in bulk.
+        """
+        keyDict = butler.getKeys(datasetType=self.datasetType, level=self.level)
+        if keyDict is None or not set(product.keys) <= set(keyDict):
+            return None
+        fmt = list(keyDict)
+        fixedId = {key: values[0].item() if hasattr(values[0], "item") else values[0]
+                   for key, values in zip(product.keys, product.values) if len(values) == 1}
+        try:
+            rows = butler.queryMetadata(self.datasetType, fmt, fixedId)
+        except Exception:
+            return None
+        if len(fmt) == 1:
+            rows = [(row,) for row in rows]
+        if not rows:
+            return []
+        columns = {key: np.array(column, dtype=object) for key, column in zip(fmt, zip(*rows))}
+
+        match = np.ones(len(rows), dtype=bool)
+        ranks = []
+        for key, values in zip(product.keys, product.values):
+            rank = _rankIn(values, columns[key])
+            match &= rank >= 0
+            ranks.append(rank)
+        matched = np.flatnonzero(match)
+        # Cross product order: first key slowest, then registry order
+        sortKeys = [matched] + [rank[matched] for rank in reversed(ranks)]
+        matched = matched[np.lexsort(sortKeys)]
+        if len(matched) == 0:
+            return []
+
+        firstId = dict(zip(fmt, rows[matched[0]]))
+        butlerSubset = butler.subset(datasetType=self.datasetType, level=self.level, dataId=firstId)
+        refList = [dafPersist.ButlerDataRef(butlerSubset, dict(zip(fmt, rows[index])))
+                   for index in matched.tolist()]
+        return [dataRef for dataRef, exists in zip(refList, self._datasetsExist(butler, refList)) if exists]
+
+    def _datasetsExist(self, butler, refList):
+        """Check whether the datasets of data references exist, as
+        `lsst.daf.persistence.searchDataRefs` does, in bulk if the butler
+        has a `TestMapper` (see `TestMapper.datasetsExist`).
+        """
+        mapper, roots = getButlerRepositories(butler)
+        if hasattr(mapper, "datasetsExist"):
+            try:
+                return mapper.datasetsExist(self.datasetType, [dataRef.dataId for dataRef in refList],
+                                            roots=roots)
+            except TypeError:
+                # Not a single file, e.g. a composite
+                pass
+        return [dataRef.datasetExists(datasetType=self.datasetType) for dataRef in refList]
+
+
+class _CachedConfigFileAction(ConfigFileAction):
+    """argparse action for ``--configfile`` that loads the files through
+    the `ConfigLoadCache` of an `ObsTestArgumentParser`.
+    """
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        cache = getattr(parser, "configLoadCache", None)
+        if cache is None or namespace.config is None:
+            return ConfigFileAction.__call__(self, parser, namespace, values, option_string)
+        for configfile in values:
+            try:
+                cache.load(namespace.config, configfile)
+            except Exception as e:
+                parser.error("cannot load config file %r: %s" % (configfile, e))
+
+
+class ObsTestArgumentParser(pipeBase.ArgumentParser):
+    """An argument parser whose data ID arguments are expanded in bulk.
+
+    ``add_id_argument`` uses `ObsTestDataIdContainer` by default, and ID
+    arguments with such a container keep their values as arrays, so
+    ``--id visit=1..1000000`` is parsed without building a million dicts.
+    Return one from ``_makeArgumentParser`` of a command-line task to use
+    it.
+
+    Config override files (the obs package overrides and ``--configfile``)
+    are loaded through a `ConfigLoadCache`, ``configLoadCache``, unless
+    ``useConfigCache`` is `False`; other loads of configs are unaffected.
+    """
+
+    useConfigCache = True
+    """Load config override files through a `ConfigLoadCache`?"""
+
+    configCacheDir = None
+    """Directory of the config cache; see `getDefaultConfigCacheDir`."""
+
+    configLoadCache = None
+    """`ConfigLoadCache` of the last call of `parse_args`, or `None`."""
+
+    def parse_args(self, config, args=None, log=None, override=None):
+        """Parse arguments for a command-line task; see
+        `lsst.pipe.base.ArgumentParser.parse_args`.
+        """
+        self.configLoadCache = ConfigLoadCache(self.configCacheDir) if self.useConfigCache else None
+        return pipeBase.ArgumentParser.parse_args(self, config, args=args, log=log, override=override)
+
+    def _applyInitialOverrides(self, namespace):
+        """Load the config override files of the obs package, as the base
+        class does, through ``configLoadCache``.
+        """
+        if self.configLoadCache is None:
+            return pipeBase.ArgumentParser._applyInitialOverrides(self, namespace)
+        obsPkgDir = lsst.utils.getPackageDir(namespace.obsPkg)
+        fileName = self._name + ".py"
+        for filePath in (
+            os.path.join(obsPkgDir, "config", fileName),
+            os.path.join(obsPkgDir, "config", namespace.camera, fileName),
+        ):
+            if os.path.exists(filePath):
+                namespace.log.info("Loading config overrride file %r", filePath)
+                self.configLoadCache.load(namespace.config, filePath)
+            else:
+                namespace.log.debug("Config override file does not exist: %r", filePath)
+
+    def add_id_argument(self, name, datasetType, help, level=None, doMakeDataRefList=True,
+                        ContainerClass=ObsTestDataIdContainer):
+        """Add a data ID argument; see
+        `lsst.pipe.base.ArgumentParser.add_id_argument`.
+
+        ``ContainerClass`` defaults to `ObsTestDataIdContainer`.
+        """
+        pipeBase.ArgumentParser.add_id_argument(self, name, datasetType, help, level=level,
+                                                doMakeDataRefList=doMakeDataRefList,
+                                                ContainerClass=ContainerClass)
+
+    def add_argument(self, *args, **kwargs):
+        if kwargs.get("action") is IdValueAction:
+            kwargs["action"] = _ArrayIdValueAction
+        elif kwargs.get("action") is ConfigFileAction:
+            kwargs["action"] = _CachedConfigFileAction
+        return pipeBase.ArgumentParser.add_argument(self, *args, **kwargs)
@@ -0,0 +1,373 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["BenchmarkResult", "timeOperation", "runBenchmarks", "writeResults", "readResults",
+           "compareResults", "makeButlerOperations", "makeCompressionOperations", "CompressionSettings"]
+
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+import lsst.daf.persistence as dafPersist
+import lsst.utils
+from .fitsWriter import compressFits
+
+Percentiles = (50, 90, 99)
+"""Latency percentiles recorded for each operation."""
+
+CompressionSettings = {
+    "none": dict(compression="none"),
+    "gzip1": dict(compression="gzip", level=1, threads=1),
+    "gzip6": dict(compression="gzip", level=6, threads=1),
+    "gzip9": dict(compression="gzip", level=9, threads=1),
+    "gzip1_parallel": dict(compression="gzip", level=1, threads=0),
+    "gzip6_parallel": dict(compression="gzip", level=6, threads=0),
+}
+"""``writeOptions`` compression settings timed by
+`makeCompressionOperations`, by name.
+"""
+
+
+def _resetPeakRss():
+    """Reset the peak resident set size of this process, if the operating
+    system allows it (Linux >= 4.0).
+
+    Returns
+    -------
+    reset : `bool`
+        `True` if the peak was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _getPeakRss():
+    """Return the peak resident set size (bytes) of this process."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return maxRss if sys.platform == "darwin" else maxRss*1024
+
+
+class BenchmarkResult:
+    """Timing and memory use of one benchmarked operation.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the operation.
+    latencies : sequence of `float`
+        Time (sec) of each call.
+    peakRss : `int`
+        Peak resident set size (bytes) while the operation ran; if the peak
+        could not be reset first it includes earlier operations.
+    error : `str`, optional
+        Description of the exception raised by the operation, if any.
+    """
+
+    def __init__(self, name, latencies, peakRss, error=None):
+        self.name = name
+        self.latencies = np.asarray(latencies, dtype=float)
+        self.peakRss = peakRss
+        self.error = error
+
+    def __repr__(self):
+        return "BenchmarkResult(%r, numCalls=%d, p50=%.3g, error=%r)" % (
+            self.name, len(self.latencies), self.getStatistic("p50"), self.error)
+
+    def getStatistic(self, statistic):
+        """Return a statistic of the latencies.
+
+        Parameters
+        ----------
+        statistic : `str`
+            "mean", "min", "max" or "p<N>" for the Nth percentile, e.g. "p90".
+
+        Returns
+        -------
+        value : `float`
+            The statistic (sec), or NaN if there are no successful calls.
+        """
+        if len(self.latencies) == 0:
+            return float("nan")
+        if statistic.startswith("p"):
+            return float(np.percentile(self.latencies, float(statistic[1:])))
+        return float(getattr(np, statistic)(self.latencies))
+
+    def toDict(self):
+        """Return a JSON-compatible summary of the result.
+
+        Returns
+        -------
+        summary : `dict`
+            ``numCalls``, ``mean``, ``min``, ``max``, ``p50``, ``p90``,
+            ``p99`` (sec), ``throughput`` (calls/sec), ``peakRss`` (bytes)
+            and ``error``.
+        """
+        summary = dict(numCalls=len(self.latencies))
+        for statistic in ["mean", "min", "max"] + ["p%d" % (p,) for p in Percentiles]:
+            summary[statistic] = self.getStatistic(statistic)
+        total = float(self.latencies.sum())
+        summary["throughput"] = len(self.latencies)/total if total > 0 else float("nan")
+        summary["peakRss"] = self.peakRss
+        summary["error"] = self.error
+        return summary
+
+
+def timeOperation(name, func, repeat=20, warmup=2):
+    """Time repeated calls of a function.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the operation.
+    func : callable
+        Function to call with no arguments.
+    repeat : `int`, optional
+        Number of timed calls.
+    warmup : `int`, optional
+        Number of untimed calls made first, to fill caches.
+
+    Returns
+    -------
+    result : `BenchmarkResult`
+        Latencies and peak memory use; if ``func`` raises, the latencies
+        of the calls that succeeded and the error.
+    """
+    _resetPeakRss()
+    latencies = []
+    error = None
+    try:
+        for i in range(warmup):
+            func()
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - t0)
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    return BenchmarkResult(name, latencies, _getPeakRss(), error=error)
+
+
+def runBenchmarks(operations, repeat=20, warmup=2, names=None):
+    """Time a set of operations.
+
+    Parameters
+    ----------
+    operations : `dict` [`str`, callable]
+        Functions to time, by name.
+    repeat : `int`, optional
+        Number of timed calls of each operation.
+    warmup : `int`, optional
+        Number of untimed calls of each operation made first.
+    names : iterable of `str`, optional
+        Names of the operations to run; all if `None`.
+
+    Returns
+    -------
+    results : `dict` [`str`, `BenchmarkResult`]
+        Results, by operation name.
+    """
+    if names is not None:
+        unknown = set(names) - set(operations)
+        if unknown:
+            raise ValueError("Unknown operations %s; must be in %s" % (sorted(unknown), list(operations)))
+    results = {}
+    for name, func in operations.items():
+        if names is None or name in names:
+            results[name] = timeOperation(name, func, repeat=repeat, warmup=warmup)
+    return results
+
+
+def _jsonNumber(value):
+    """Return a float as is if it is finite, else `None` (JSON null)."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def writeResults(path, results, metadata=None):
+    """Write benchmark results as JSON.
+
+    Statistics that are not finite (e.g. NaN for an operation with no
+    successful calls) are written as null, so the file is strict JSON;
+    `readResults` reads them back as NaN.
+
+    Parameters
+    ----------
+    path : `str`
+        Output file.
+    results : `dict` [`str`, `BenchmarkResult`]
+        Results, by operation name.
+    metadata : `dict`, optional
+        Additional information to record, e.g. the repository used.
+    """
+    info = dict(time=time.strftime("%Y-%m-%dT%H:%M:%S"), host=platform.node(),
+                python=platform.python_version())
+    if metadata:
+        info.update(metadata)
+    summaries = {name: {key: _jsonNumber(value) for key, value in result.toDict().items()}
+                 for name, result in results.items()}
+    data = dict(metadata=info, results=summaries)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True, allow_nan=False)
+
+
+def readResults(path):
+    """Read benchmark results written by `writeResults`.
+
+    Returns
+    -------
+    results : `dict` [`str`, `dict`]
+        Summary of each operation (see `BenchmarkResult.toDict`), by name;
+        statistics written as null are NaN.
+    """
+    with open(path) as f:
+        results = json.load(f)["results"]
+    statistics = ["mean", "min", "max", "throughput"] + ["p%d" % (p,) for p in Percentiles]
+    for summary in results.values():
+        for statistic in statistics:
+            if statistic in summary and summary[statistic] is None:
+                summary[statistic] = float("nan")
+    return results
+
+
+def compareResults(results, baseline, threshold=0.2, statistic="p50"):
+    """Find operations that are slower than a baseline.
+
+    Parameters
+    ----------
+    results : `dict` [`str`, `BenchmarkResult` or `dict`]
+        New results, by operation name.
+    baseline : `dict` [`str`, `dict`]
+        Baseline results as returned by `readResults`.
+    threshold : `float`, optional
+        Allowed fractional increase of ``statistic``, e.g. 0.2 for 20%.
+    statistic : `str`, optional
+        Statistic to compare, e.g. "p50", "p90" or "mean".
+
+    Returns
+    -------
+    regressions : `list` of `tuple`
+        ``(name, baselineValue, newValue, ratio)`` for each operation
+        present in both whose statistic grew by more than ``threshold``,
+        or which failed only in ``results``.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        summary = result.toDict() if isinstance(result, BenchmarkResult) else result
+        old = baseline[name]
+        if summary["error"] is not None:
+            if old["error"] is None:
+                regressions.append((name, old[statistic], float("nan"), float("inf")))
+            continue
+        if old["error"] is not None or not old[statistic] > 0:
+            continue
+        ratio = summary[statistic]/old[statistic]
+        if ratio > 1 + threshold:
+            regressions.append((name, old[statistic], summary[statistic], ratio))
+    return regressions
+
+
+def makeButlerOperations(inputDir=None, calexpDir=None, dataId=None):
+    """Make the butler operations exercised by the obs_test unit tests.
+
+    Parameters
+    ----------
+    inputDir : `str`, optional
+        Data repository with raws; defaults to ``data/input``.
+    calexpDir : `str`, optional
+        Data repository with a calexp; defaults to
+        ``data/calexpMetadataObjectsTest``.
+    dataId : `dict`, optional
+        Data ID of the raw to read; defaults to visit 1, filter g.
+
+    Returns
+    -------
+    operations : `dict` [`str`, callable]
+        Functions that each perform one butler operation, by name:
+        ``raw``, ``raw_md``, ``ccdExposureId``, ``queryMetadata``,
+        ``rawAndFlat`` and ``calexp_wcs``.
+    """
+    dataDir = os.path.join(lsst.utils.getPackageDir("obs_test"), "data")
+    if inputDir is None:
+        inputDir = os.path.join(dataDir, "input")
+    if calexpDir is None:
+        calexpDir = os.path.join(dataDir, "calexpMetadataObjectsTest")
+    if dataId is None:
+        dataId = dict(visit=1, filter="g")
+    butler = dafPersist.Butler(inputs=inputDir)
+    calexpButler = dafPersist.Butler(inputs=calexpDir)
+    return {
+        "raw": lambda: butler.get("raw", dataId=dataId),
+        "raw_md": lambda: butler.get("raw_md", dataId=dataId),
+        "ccdExposureId": lambda: butler.get("ccdExposureId", dataId=dataId),
+        "queryMetadata": lambda: butler.queryMetadata("raw", ["visit", "filter"]),
+        "rawAndFlat": lambda: butler.get("rawAndFlat", dataId=dataId),
+        "calexp_wcs": lambda: calexpButler.get("calexp_wcs", immediate=True),
+    }
+
+
+def makeCompressionOperations(data, settings=None):
+    """Make operations that compress a FITS file as `TestMapper` does when
+    writing it.
+
+    Parameters
+    ----------
+    data : `bytes`
+        Uncompressed FITS file.
+    settings : `dict` [`str`, `dict`], optional
+        Compression settings (``compression``, ``level`` and ``threads``,
+        as in the ``writeOptions`` of the policy), by name; defaults to
+        `CompressionSettings`.
+
+    Returns
+    -------
+    operations : `dict` [`str`, callable]
+        Functions that each compress ``data`` with one setting and return
+        the result, by name. The throughput in bytes/sec is
+        ``len(data)`` times the ``throughput`` of the `BenchmarkResult`.
+    """
+    if settings is None:
+        settings = CompressionSettings
+
+    def makeOperation(setting):
+        return lambda: compressFits(data, **setting)
+
+    return {name: makeOperation(setting) for name, setting in settings.items()}
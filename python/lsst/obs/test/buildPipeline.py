@@ -0,0 +1,340 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["BuildStage", "BuildPipeline", "hashPath"]
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from lsst.pipe.base import Struct
+
+
+def hashPath(path):
+    """Return the SHA-256 of the contents of a file or directory tree.
+
+    Parameters
+    ----------
+    path : `str`
+        File or directory; files in a directory are hashed in sorted
+        order of their relative paths, which are hashed too.
+
+    Returns
+    -------
+    digest : `str`
+        Hex digest, or "missing" if ``path`` does not exist.
+    """
+    if not os.path.exists(path):
+        return "missing"
+    if os.path.isdir(path):
+        paths = []
+        for dirPath, dirNames, fileNames in os.walk(path):
+            dirNames.sort()
+            paths += [os.path.join(dirPath, fileName) for fileName in sorted(fileNames)]
+    else:
+        paths = [path]
+    digest = hashlib.sha256()
+    for filePath in paths:
+        digest.update(os.path.relpath(filePath, path).encode() + b"\0")
+        with open(filePath, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _hashCode(func):
+    """Return a hash of the code of a function, so editing a stage
+    invalidates it.
+    """
+    code = getattr(func, "__code__", None)
+    if code is None:
+        return repr(func)
+    return hashlib.sha256(code.co_code + repr(code.co_consts).encode()).hexdigest()
+
+
+class BuildStage:
+    """A stage of a `BuildPipeline`.
+
+    Parameters
+    ----------
+    name : `str`
+        Unique name of the stage.
+    run : callable
+        Function that does the work: called with the results of the
+        ``dependencies``, in order, and returns the result of the stage,
+        which is handed to dependent stages in memory.
+    dependencies : `list` of `str`, optional
+        Names of stages whose results ``run`` needs.
+    after : `list` of `str`, optional
+        Names of stages that must finish first, e.g. because ``run`` reads
+        their outputs, but whose results are not needed.
+    inputs : `list` of `str`, optional
+        Files or directories read by ``run``; the stage is rerun if their
+        contents change.
+    outputs : `list` of `str`, optional
+        Files or directories written by ``run``; the stage is rerun if any
+        is missing or has changed since it was written.
+    load : callable, optional
+        Function that returns the result of the stage from its
+        ``outputs``, called with no arguments; used instead of ``run``
+        when the stage is up to date but a dependent stage must run. If
+        `None` the stage is run in that case.
+    parameters : `dict`, optional
+        Other values that affect the result; the stage is rerun if their
+        ``repr`` changes.
+    """
+
+    def __init__(self, name, run, dependencies=(), after=(), inputs=(), outputs=(), load=None,
+                 parameters=None):
+        self.name = name
+        self.run = run
+        self.dependencies = list(dependencies)
+        self.after = list(after)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.load = load
+        self.parameters = dict(parameters or {})
+
+    def __repr__(self):
+        return "BuildStage(%r)" % (self.name,)
+
+
+class BuildPipeline:
+    """Run a graph of build stages concurrently, skipping stages whose
+    inputs have not changed.
+
+    Stages run in a thread pool as soon as the stages they depend on have
+    finished, and receive their results in memory rather than through
+    intermediate files. The key of a stage is a hash of its code, its
+    ``parameters``, the contents of its ``inputs`` and the keys of the
+    stages it depends on or runs after; a stage whose key and ``outputs`` are unchanged
+    since its last successful run is skipped, or loaded from its outputs
+    if a dependent stage must run.
+
+    Parameters
+    ----------
+    stateFile : `str`
+        JSON file recording the key and output hashes of each stage after
+        it runs.
+    numThreads : `int`, optional
+        Number of stages to run at once.
+    """
+
+    def __init__(self, stateFile, numThreads=4):
+        self.stateFile = stateFile
+        self.numThreads = numThreads
+        self.stages = {}
+
+    def addStage(self, name, run, **kwargs):
+        """Add a stage; arguments are as for `BuildStage`.
+
+        Returns
+        -------
+        stage : `BuildStage`
+            The new stage.
+        """
+        if name in self.stages:
+            raise ValueError("Duplicate stage %r" % (name,))
+        stage = BuildStage(name, run, **kwargs)
+        self.stages[name] = stage
+        return stage
+
+    def getOrder(self):
+        """Return the stage names in an order in which each follows its
+        dependencies.
+
+        Raises
+        ------
+        ValueError
+            Raised if a dependency is unknown or the stages form a cycle.
+        """
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("Build stages form a cycle: %s" % (" -> ".join(path + [name]),))
+            if name not in self.stages:
+                raise ValueError("Unknown build stage %r (needed by %r)" % (name, path[-1]))
+            state[name] = "visiting"
+            for dependency in self.stages[name].dependencies + self.stages[name].after:
+                visit(dependency, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    def _readState(self):
+        try:
+            with open(self.stateFile) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _writeState(self, state):
+        directory = os.path.dirname(os.path.abspath(self.stateFile))
+        os.makedirs(directory, exist_ok=True)
+        fd, tempPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tempPath, self.stateFile)
+
+    def computeKeys(self):
+        """Return the key of each stage (`dict` of `str`)."""
+        keys = {}
+        for name in self.getOrder():
+            stage = self.stages[name]
+            digest = hashlib.sha256()
+            for item in ([name, _hashCode(stage.run), repr(sorted(stage.parameters.items()))]
+                         + [hashPath(path) for path in stage.inputs]
+                         + [keys[dependency] for dependency in stage.dependencies + stage.after]):
+                digest.update(item.encode() + b"\0")
+            keys[name] = digest.hexdigest()
+        return keys
+
+    def run(self, force=False):
+        """Run the stages that are out of date.
+
+        Parameters
+        ----------
+        force : `bool`, optional
+            Run every stage, even if it is up to date.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Result struct with components:
+
+            - ``results``: result of each stage that was run or loaded
+              (`dict`).
+            - ``timings``: for each stage, in order of completion, a
+              `lsst.pipe.base.Struct` with ``name``, ``status`` ("run",
+              "loaded" or "skipped") and ``elapsed`` wall time (sec)
+              (`list`).
+            - ``elapsed``: total wall time (sec) (`float`).
+
+        Raises
+        ------
+        Exception
+            The first exception raised by a stage; stages that finished
+            before it are recorded as up to date.
+        """
+        startTime = time.perf_counter()
+        order = self.getOrder()
+        keys = self.computeKeys()
+        state = self._readState()
+
+        def isUpToDate(name):
+            entry = state.get(name)
+            if force or entry is None or entry.get("key") != keys[name]:
+                return False
+            return all(hashPath(path) == entry.get("outputs", {}).get(path)
+                       for path in self.stages[name].outputs)
+
+        # Decide what to run, and what to load because something that
+        # depends on it must run.
+        action = {name: "skipped" if isUpToDate(name) else "run" for name in order}
+        changed = True
+        while changed:
+            changed = False
+            for name in order:
+                if action[name] != "run":
+                    continue
+                for dependency in self.stages[name].dependencies:
+                    if action[dependency] == "skipped":
+                        action[dependency] = "loaded" if self.stages[dependency].load is not None else "run"
+                        changed = True
+
+        results = {}
+        timings = []
+
+        def execute(name):
+            stage = self.stages[name]
+            t0 = time.perf_counter()
+            if action[name] == "loaded":
+                result = stage.load()
+            else:
+                result = stage.run(*[results[dependency] for dependency in stage.dependencies])
+            return result, time.perf_counter() - t0
+
+        for name in order:
+            if action[name] == "skipped":
+                timings.append(Struct(name=name, status="skipped", elapsed=0.0))
+        pending = [name for name in order if action[name] != "skipped"]
+        done = {name for name in order if action[name] == "skipped"}
+        running = {}
+        error = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.numThreads) as executor:
+            while (pending or running) and error is None:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if all(dependency in done for dependency in stage.dependencies + stage.after):
+                        pending.remove(name)
+                        running[executor.submit(execute, name)] = name
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name], elapsed = future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                        continue
+                    done.add(name)
+                    timings.append(Struct(name=name, status=action[name], elapsed=elapsed))
+                    if action[name] == "run":
+                        state[name] = dict(key=keys[name], outputs={path: hashPath(path)
+                                                                    for path in self.stages[name].outputs})
+            if error is not None:
+                for future in running:
+                    future.cancel()
+                concurrent.futures.wait(running)
+        self._writeState(state)
+        if error is not None:
+            raise error
+        return Struct(results=results, timings=timings, elapsed=time.perf_counter() - startTime)
+
+    @staticmethod
+    def formatTimings(timings):
+        """Format the timings returned by `run` as a table.
+
+        Parameters
+        ----------
+        timings : `list` of `lsst.pipe.base.Struct`
+            ``timings`` returned by `run`.
+
+        Returns
+        -------
+        text : `str`
+            One line per stage.
+        """
+        width = max([len(timing.name) for timing in timings] + [5])
+        lines = ["%-*s %-8s %9s" % (width, "stage", "status", "sec")]
+        lines += ["%-*s %-8s %9.3f" % (width, timing.name, timing.status, timing.elapsed)
+                  for timing in timings]
+        return "\n".join(lines)
@@ -0,0 +1,290 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["readCalibHeader", "computeValidity", "ingestCalibs"]
+
+import concurrent.futures
+import datetime
+import sqlite3
+import time
+
+import numpy as np
+
+from lsst.afw.fits import readMetadata
+from lsst.pipe.base import Struct
+from .calibValidity import isoToMjd, MjdEpochOrdinal
+
+ValidityUntilSuperseded = ("bias", "flat", "defects")
+"""Calibration types valid until superseded; matches
+``config.register.validityUntilSuperseded`` in ``config/ingestCalibs.py``.
+"""
+
+DefaultValidity = 999
+"""Validity (days) either side of ``calibDate`` for other calibration types,
+as used by ``lsst.pipe.tasks.IngestCalibsTask``.
+"""
+
+EndOfValidity = "2037-12-31"
+"""End of validity of the most recent calibration of a superseded type."""
+
+
+def readCalibHeader(path, calibType=None):
+    """Read the registry information for a calibration from its header.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the calibration FITS file.
+    calibType : `str`, optional
+        Calibration type; if `None` it is taken from ``OBSTYPE``.
+
+    Returns
+    -------
+    info : `tuple`
+        ``(path, calibType, filter, calibDate, ccd)``, where ``calibDate`` is
+        ``CALIBDATE`` if present, else the date part of ``DATE-OBS``,
+        ``filter`` is ``FILTER`` (or "None") and ``ccd`` is ``DETECTOR``
+        (or 0).
+    """
+    md = readMetadata(path)
+    if calibType is None:
+        calibType = md.getScalar("OBSTYPE").strip().lower()
+    if md.exists("CALIBDATE"):
+        calibDate = md.getScalar("CALIBDATE")
+    else:
+        calibDate = md.getScalar("DATE-OBS").split("T")[0]
+    filterName = str(md.getScalar("FILTER")).strip() if md.exists("FILTER") else "None"
+    ccd = int(md.getScalar("DETECTOR")) if md.exists("DETECTOR") else 0
+    return (path, calibType, filterName, calibDate, ccd)
+
+
+def computeValidity(calibDates, untilSuperseded, validity=DefaultValidity, incrementValidEnd=True):
+    """Compute validity ranges for the calibrations of one type, filter and
+    detector.
+
+    Parameters
+    ----------
+    calibDates : sequence of `str`
+        ISO-8601 calibration dates, in any order; only the date is used.
+    untilSuperseded : `bool`
+        If `True` each calibration is valid from its date until the date of
+        the next calibration; otherwise it is valid for ``validity`` days
+        either side of its date, split at the midpoint where neighbours
+        overlap.
+    validity : `int`, optional
+        Validity (days) for calibrations that are not valid until
+        superseded.
+    incrementValidEnd : `bool`, optional
+        End the validity of a calibration split at a midpoint on the day
+        after the midpoint, as ``config.incrementValidEnd`` of
+        ``lsst.pipe.tasks.IngestCalibsTask`` does by default. Validity
+        dates are compared with observation date-times, so a range ending
+        at (midnight of) the midpoint does not cover observations made
+        during that day, and neither does the next range, which starts
+        the day after.
+
+    Returns
+    -------
+    validStart, validEnd : `list` of `str`
+        ISO-8601 dates of the start and end of validity for each entry of
+        ``calibDates``.
+
+    Notes
+    -----
+    This gives the same ranges as
+    ``lsst.pipe.tasks.IngestCalibsTask.fixSubsetValidity`` with the same
+    ``incrementValidEnd``, computed for all dates at once rather than date
+    by date.
+    """
+    days = np.floor([isoToMjd(date) for date in calibDates]).astype(np.int64)
+    dates, inverse = np.unique(days, return_inverse=True)
+    if untilSuperseded:
+        starts = dates.copy()
+        ends = np.append(dates[1:], int(isoToMjd(EndOfValidity)))
+    else:
+        starts = dates - validity
+        ends = dates + validity
+        midpoints = dates[:-1] + (dates[1:] - dates[:-1])//2
+        overlap = ends[:-1] > midpoints
+        ends[:-1][overlap] = midpoints[overlap] + (1 if incrementValidEnd else 0)
+        starts[1:][overlap] = midpoints[overlap] + 1
+
+    def toIso(mjdDays):
+        return [datetime.date.fromordinal(day + MjdEpochOrdinal).isoformat() for day in mjdDays.tolist()]
+
+    return toIso(starts[inverse]), toIso(ends[inverse])
+
+
+def _createCalibTable(conn, table):
+    conn.execute("""CREATE TABLE IF NOT EXISTS %s (id integer primary key autoincrement,
+        calibDate text, validStart text, validEnd text, filter text, ccd int,
+        unique(filter, calibDate, ccd))""" % (table,))
+    conn.execute("CREATE TABLE IF NOT EXISTS %s_visit (calibDate text, unique(calibDate))" % (table,))
+
+
+def _checkUniqueKeys(conn, table, rows):
+    """Check that distinct calibrations do not collide on a unique
+    constraint of an existing table.
+
+    Tables made by ``lsst.pipe.tasks.IngestCuratedCalibsTask`` (such as
+    those of ``data/input/calibRegistry.sqlite3``) are unique on
+    ``calibDate`` alone, and older tables on ``(filter, calibDate)``, so
+    ``INSERT OR IGNORE`` would silently drop a calibration of a second
+    filter or detector with the same date.
+
+    Parameters
+    ----------
+    conn : `sqlite3.Connection`
+        Connection to the registry.
+    table : `str`
+        Calibration table.
+    rows : `list` of `tuple`
+        ``(calibDate, filter, ccd)`` of the rows to insert.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if rows with different ``(calibDate, filter, ccd)`` share
+        the values of a unique constraint.
+    """
+    columns = {"calibDate": 0, "filter": 1, "ccd": 2}
+    for indexRow in conn.execute("PRAGMA index_list(%s)" % (table,)).fetchall():
+        if not indexRow[2]:
+            continue
+        key = [info[2] for info in conn.execute('PRAGMA index_info("%s")' % (indexRow[1],))]
+        if set(columns) <= set(key) or not all(column in columns for column in key):
+            continue
+        existing = conn.execute("SELECT calibDate, filter, ccd FROM %s" % (table,)).fetchall()
+        rowsByKey = {}
+        for row in existing + list(rows):
+            values = tuple(row[columns[column]] for column in key)
+            # NULLs never collide on a unique constraint
+            if None not in values:
+                rowsByKey.setdefault(values, set()).add(tuple(row))
+        collisions = {values: keyRows for values, keyRows in rowsByKey.items() if len(keyRows) > 1}
+        if collisions:
+            values, keyRows = sorted(collisions.items())[0]
+            raise RuntimeError("Table %s is unique on (%s), so calibrations %s (calibDate, filter, ccd) "
+                               "with %s = %s cannot all be registered; recreate the table with "
+                               "unique(filter, calibDate, ccd)" %
+                               (table, ", ".join(key), sorted(keyRows), ", ".join(key),
+                                ", ".join(str(value) for value in values)))
+
+
+def ingestCalibs(registryPath, pathList, calibType=None, numProcesses=1, validity=DefaultValidity,
+                 validityUntilSuperseded=ValidityUntilSuperseded, incrementValidEnd=True):
+    """Register calibrations in a calibration registry.
+
+    Headers are read in parallel, then the validity ranges of every
+    affected (calibration type, filter, detector) are computed in one pass
+    over the old and new entries, and the registry is updated in one
+    transaction.
+    Calibrations are identified by ``(calibDate, filter, ccd)``;
+    registering one again changes nothing.
+
+    Parameters
+    ----------
+    registryPath : `str`
+        Path to the calibration registry; created if it does not exist.
+    pathList : `list` of `str`
+        Calibration files. They are registered in place; copy them to the
+        location given by the mapper template first.
+    calibType : `str`, optional
+        Calibration type of all files; if `None` it is read from each
+        ``OBSTYPE`` header.
+    numProcesses : `int`, optional
+        Number of processes to read headers with.
+    validity : `int`, optional
+        Validity (days) for calibration types that are not valid until
+        superseded.
+    validityUntilSuperseded : iterable of `str`, optional
+        Calibration types that are valid until superseded.
+    incrementValidEnd : `bool`, optional
+        See `computeValidity`.
+
+    Returns
+    -------
+    result : `lsst.pipe.base.Struct`
+        Result struct with components:
+
+        - ``numIngested``: number of calibrations registered (`int`).
+        - ``timings``: elapsed time (sec) of each stage: ``readHeaders``,
+          ``insert``, ``computeValidity`` and ``update`` (`dict`).
+
+    Raises
+    ------
+    RuntimeError
+        Raised if an existing table has a unique constraint that would
+        drop calibrations of one of several filters or detectors with the
+        same date; nothing is registered.
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    calibTypes = [calibType]*len(pathList)
+    if numProcesses > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=numProcesses) as pool:
+            chunksize = max(1, len(pathList) // (4*numProcesses))
+            infoList = list(pool.map(readCalibHeader, pathList, calibTypes, chunksize=chunksize))
+    else:
+        infoList = list(map(readCalibHeader, pathList, calibTypes))
+    timings["readHeaders"] = time.perf_counter() - t0
+
+    newRows = {}
+    for path, table, filterName, calibDate, ccd in infoList:
+        newRows.setdefault(table, []).append((calibDate, filterName, ccd))
+
+    timings.update(insert=0.0, computeValidity=0.0, update=0.0)
+    conn = sqlite3.connect(registryPath, isolation_level=None)
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            for table, rows in newRows.items():
+                t0 = time.perf_counter()
+                _createCalibTable(conn, table)
+                _checkUniqueKeys(conn, table, rows)
+                conn.executemany("INSERT OR IGNORE INTO %s (calibDate, filter, ccd) VALUES (?, ?, ?)"
+                                 % (table,), rows)
+                conn.execute("INSERT OR IGNORE INTO %s_visit SELECT DISTINCT calibDate FROM %s"
+                             % (table, table))
+                filters = sorted({row[1] for row in rows})
+                groups = {}
+                for rowId, calibDate, filterName, ccd in conn.execute(
+                        "SELECT id, calibDate, filter, ccd FROM %s WHERE filter IN (%s)"
+                        % (table, ", ".join("?"*len(filters))), filters):
+                    groups.setdefault((filterName, ccd), []).append((rowId, calibDate))
+                timings["insert"] += time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                updates = []
+                for groupRows in groups.values():
+                    rowIds, calibDates = zip(*groupRows)
+                    validStart, validEnd = computeValidity(calibDates, table in validityUntilSuperseded,
+                                                           validity=validity,
+                                                           incrementValidEnd=incrementValidEnd)
+                    updates += zip(validStart, validEnd, rowIds)
+                timings["computeValidity"] += time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                conn.executemany("UPDATE %s SET validStart=?, validEnd=? WHERE id=?" % (table,), updates)
+                timings["update"] += time.perf_counter() - t0
+    finally:
+        conn.close()
+    return Struct(numIngested=len(infoList), timings=timings)
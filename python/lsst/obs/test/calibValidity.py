@@ -0,0 +1,225 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["isoToMjd", "CalibValidityIndex"]
+
+import datetime
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+import numpy as np
+
+MjdEpochOrdinal = datetime.date(1858, 11, 17).toordinal()
+"""Proleptic Gregorian ordinal of MJD 0."""
+
+
+def isoToMjd(isoDate):
+    """Convert an ISO-8601 date or date-time string to MJD.
+
+    Parameters
+    ----------
+    isoDate : `str`
+        Date such as "1970-01-01", "1970-01-01T00:00:00" or
+        "1999-01-17T04:52:34.895201920" (up to nanosecond precision);
+        no time zone or time scale conversion is done.
+
+    Returns
+    -------
+    mjd : `float`
+        Modified Julian Date, or NaN if ``isoDate`` is `None` or not
+        a date.
+    """
+    if not isoDate:
+        return float("nan")
+    dateStr, _, timeStr = isoDate.replace(" ", "T", 1).partition("T")
+    try:
+        mjd = float(datetime.date.fromisoformat(dateStr).toordinal() - MjdEpochOrdinal)
+        if timeStr:
+            hour, _, rest = timeStr.partition(":")
+            minute, _, sec = rest.partition(":")
+            mjd += (int(hour) * 3600 + int(minute or 0) * 60 + float(sec or 0)) / 86400.0
+    except ValueError:
+        return float("nan")
+    return mjd
+
+
+class _ValidityGroup:
+    """Validity intervals of one calibration type and filter, sorted by
+    start date.
+
+    The number of intervals containing a date is the number starting on or
+    before it less the number ending before it, so dates are looked up with
+    two binary searches whether or not the intervals overlap or touch.
+    Where exactly one interval contains a date, it is the interval with
+    the latest end among those starting on or before the date.
+    """
+
+    def __init__(self, starts, ends, calibDates):
+        # Intervals with a missing or reversed range contain no date.
+        valid = starts <= ends
+        order = np.argsort(starts[valid], kind="stable")
+        self.starts = starts[valid][order]
+        self.ends = ends[valid][order]
+        self.calibDates = calibDates[valid][order]
+        self.sortedEnds = np.sort(self.ends)
+        # Position of the latest-ending interval among the first i + 1.
+        isLatestEnd = self.ends == np.maximum.accumulate(self.ends)
+        self.latestEnd = np.maximum.accumulate(np.where(isLatestEnd, np.arange(len(self.ends)), 0))
+
+    def search(self, mjd):
+        """Return the index of the unique interval containing each date,
+        or -1 where there is no unique interval.
+        """
+        mjd = np.asarray(mjd, dtype=float)
+        if len(self.starts) == 0:
+            return np.full(mjd.shape, -1, dtype=np.int64)
+        numStarted = np.searchsorted(self.starts, mjd, side="right")
+        numEnded = np.searchsorted(self.sortedEnds, mjd, side="left")
+        unique = (numStarted - numEnded == 1) & (numStarted > 0)
+        return np.where(unique, self.latestEnd[np.maximum(numStarted - 1, 0)], -1)
+
+
+class CalibValidityIndex:
+    """In-memory index of calibration validity ranges.
+
+    Validity ranges are held as MJD (not as the ISO-8601 text stored in
+    the calibration registry) in arrays sorted by start date, one per
+    (calibration type, filter), so finding the calibration for many
+    observation dates takes vectorized binary searches, in time and memory
+    proportional to the number of dates and ranges, whether the ranges are
+    disjoint, touch or overlap.
+
+    Parameters
+    ----------
+    rows : `dict` [`str`, `list` of `tuple`]
+        For each calibration type (registry table), the rows
+        ``(calibDate, validStart, validEnd, filter)``.
+    """
+
+    def __init__(self, rows):
+        self._rows = {calibType: list(tableRows) for calibType, tableRows in rows.items()}
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fromRegistry(cls, location, calibTypes=None):
+        """Build the index from a calibration registry.
+
+        Parameters
+        ----------
+        location : `str`
+            Path to the calibration registry.
+        calibTypes : iterable of `str`, optional
+            Calibration types (tables) to index; defaults to every table
+            with ``validStart`` and ``validEnd`` columns.
+
+        Returns
+        -------
+        index : `CalibValidityIndex`
+            The index.
+        """
+        uri = "file:%s?mode=ro" % (urllib.parse.quote(os.path.abspath(location)),)
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            if calibTypes is None:
+                calibTypes = []
+                tableNames = [row[0] for row in
+                              conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+                for table in tableNames:
+                    columns = {row[1] for row in conn.execute("PRAGMA table_info(%s)" % (table,))}
+                    if {"calibDate", "validStart", "validEnd", "filter"} <= columns:
+                        calibTypes.append(table)
+            rows = {}
+            for calibType in calibTypes:
+                rows[calibType] = conn.execute(
+                    "SELECT calibDate, validStart, validEnd, filter FROM %s" % (calibType,)).fetchall()
+        finally:
+            conn.close()
+        return cls(rows)
+
+    @property
+    def calibTypes(self):
+        """Indexed calibration types (`list` of `str`)."""
+        return list(self._rows)
+
+    def _getGroup(self, calibType, filter):
+        key = (calibType, filter)
+        group = self._groups.get(key)
+        if group is None:
+            with self._lock:
+                group = self._groups.get(key)
+                if group is None:
+                    rows = [row for row in self._rows[calibType] if filter is None or row[3] == filter]
+                    group = _ValidityGroup(
+                        starts=np.array([isoToMjd(row[1]) for row in rows], dtype=float),
+                        ends=np.array([isoToMjd(row[2]) for row in rows], dtype=float),
+                        calibDates=np.array([row[0] for row in rows], dtype=object),
+                    )
+                    self._groups[key] = group
+        return group
+
+    def lookup(self, calibType, mjd, filter=None):
+        """Find the calibration valid at one date.
+
+        Parameters
+        ----------
+        calibType : `str`
+            Calibration type, e.g. "flat".
+        mjd : `float` or `str`
+            Observation date, as MJD or ISO-8601 string.
+        filter : `str`, optional
+            Filter name; `None` to search calibrations of all filters.
+
+        Returns
+        -------
+        calibDate : `str` or `None`
+            ``calibDate`` of the calibration, or `None` if no unique
+            calibration is valid at ``mjd``.
+        """
+        return self.lookupMany(calibType, [mjd], filter=filter)[0]
+
+    def lookupMany(self, calibType, mjdList, filter=None):
+        """Find the calibrations valid at many dates.
+
+        Parameters
+        ----------
+        calibType : `str`
+            Calibration type, e.g. "flat".
+        mjdList : sequence of `float` or `str`
+            Observation dates, as MJD or ISO-8601 strings.
+        filter : `str`, optional
+            Filter name; `None` to search calibrations of all filters.
+
+        Returns
+        -------
+        calibDates : `numpy.ndarray` of `str`
+            ``calibDate`` of the calibration valid at each date, or `None`
+            where no unique calibration is valid.
+        """
+        mjd = np.array([isoToMjd(v) if isinstance(v, str) else v for v in mjdList], dtype=float)
+        group = self._getGroup(calibType, filter)
+        index = group.search(mjd)
+        result = np.full(len(mjd), None, dtype=object)
+        found = index >= 0
+        result[found] = group.calibDates[index[found]]
+        return result
@@ -0,0 +1,353 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["ConfigLoadCache", "loadConfig", "getDefaultConfigCacheDir", "hashFile", "getConfigStructure",
+           "diffConfig", "applyConfigDelta"]
+
+import hashlib
+import os
+import pickle
+import stat
+import sys
+import tempfile
+
+import lsst.pex.config as pexConfig
+from lsst.pex.config.configChoiceField import ConfigInstanceDict
+from lsst.pex.config.configurableField import ConfigurableInstance
+
+CacheVersion = 2
+"""Version of the cache entry format; part of every key."""
+
+
+def getDefaultConfigCacheDir():
+    """Return the default directory for `ConfigLoadCache`.
+
+    Returns
+    -------
+    cacheDir : `str`
+        ``$OBS_TEST_CONFIG_CACHE`` if set, else a directory private to
+        the user in the temporary directory, so the cache is discarded
+        with other temporary files.
+    """
+    cacheDir = os.environ.get("OBS_TEST_CONFIG_CACHE")
+    if not cacheDir:
+        cacheDir = os.path.join(tempfile.gettempdir(), "obs_test-config-%d" % (os.getuid(),))
+    return cacheDir
+
+
+def hashFile(path):
+    """Return the SHA-256 (hex) of the contents of a file."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def getConfigStructure(config, prefix=""):
+    """Return the classes and retarget targets of every subconfig, which a
+    value delta cannot reproduce if they change.
+
+    Parameters
+    ----------
+    config : `lsst.pex.config.Config`
+        The config.
+    prefix : `str`, optional
+        Name of ``config`` in the keys of the result.
+
+    Returns
+    -------
+    structure : `dict`
+        Class of each subconfig and target of each configurable field,
+        keyed by field path.
+    """
+    structure = {prefix: type(config)}
+    for name in config._fields:
+        value = getattr(config, name)
+        path = prefix + "." + name
+        if isinstance(value, ConfigurableInstance):
+            structure[path + ":target"] = value.target
+            value = value.value
+        if isinstance(value, pexConfig.Config):
+            structure.update(getConfigStructure(value, path))
+        elif isinstance(value, ConfigInstanceDict):
+            for choice, choiceConfig in value.items():
+                structure.update(getConfigStructure(choiceConfig, "%s[%s]" % (path, choice)))
+    return structure
+
+
+def diffConfig(config, before, after):
+    """Return the field values of ``after`` that differ from ``before``,
+    nested like ``config``.
+
+    Parameters
+    ----------
+    config : `lsst.pex.config.Config`
+        Config giving the structure of ``before`` and ``after``.
+    before, after : `dict`
+        Results of `lsst.pex.config.Config.toDict`.
+
+    Returns
+    -------
+    delta : `dict`
+        Changed field values; subconfigs are nested `dict`, and
+        `lsst.pex.config.ConfigChoiceField` values have ``values`` and
+        ``name`` or ``names`` keys, as in ``toDict``.
+    """
+    delta = {}
+    for name in config._fields:
+        old = before.get(name)
+        new = after.get(name)
+        value = getattr(config, name)
+        if isinstance(value, ConfigurableInstance):
+            value = value.value
+        if isinstance(value, pexConfig.Config) and isinstance(old, dict) and isinstance(new, dict):
+            subDelta = diffConfig(value, old, new)
+            if subDelta:
+                delta[name] = subDelta
+        elif isinstance(value, ConfigInstanceDict) and isinstance(old, dict) and isinstance(new, dict):
+            subDelta = {}
+            values = {}
+            for choice, choiceConfig in value.items():
+                oldChoice = old["values"].get(choice)
+                if oldChoice is None:
+                    oldChoice = type(choiceConfig)().toDict()
+                choiceDelta = diffConfig(choiceConfig, oldChoice, new["values"][choice])
+                if choiceDelta:
+                    values[choice] = choiceDelta
+            if values:
+                subDelta["values"] = values
+            for key in ("name", "names"):
+                if key in new and new[key] != old.get(key):
+                    subDelta[key] = new[key]
+            if subDelta:
+                delta[name] = subDelta
+        elif new != old:
+            delta[name] = new
+    return delta
+
+
+def applyConfigDelta(config, delta, label="assignment"):
+    """Set the field values in a delta made by `diffConfig`.
+
+    Parameters
+    ----------
+    config : `lsst.pex.config.Config`
+        Config to modify.
+    delta : `dict`
+        Field values to set.
+    label : `str`, optional
+        Label of the assignments in the history of the config.
+    """
+    for name, value in delta.items():
+        current = getattr(config, name)
+        if isinstance(current, ConfigurableInstance):
+            current = current.value
+        if isinstance(current, pexConfig.Config):
+            applyConfigDelta(current, value, label=label)
+        elif isinstance(current, ConfigInstanceDict):
+            for choice, choiceDelta in value.get("values", {}).items():
+                applyConfigDelta(current[choice], choiceDelta, label=label)
+            if "name" in value:
+                current.name = value["name"]
+            if "names" in value:
+                current.names = value["names"]
+        else:
+            config.__setattr__(name, value, label=label)
+
+
+def _loadRecordingChain(config, filename, root):
+    """Load a config override file, returning the paths of the files it
+    executed, including itself and the files it loaded.
+
+    The files are found with a trace function on the calling thread only,
+    for the duration of the load, which sees the module code of each file
+    `lsst.pex.config.Config.load` executes; any trace function already
+    set (e.g. by a debugger or coverage) keeps running.
+    """
+    chain = [os.path.abspath(filename)]
+    previous = sys.gettrace()
+
+    def trace(frame, event, arg):
+        if event == "call" and frame.f_code.co_name == "<module>":
+            chain.append(os.path.abspath(frame.f_code.co_filename))
+        return previous(frame, event, arg) if previous is not None else None
+
+    sys.settrace(trace)
+    try:
+        config.load(filename, root=root)
+    finally:
+        sys.settrace(previous)
+    return [path for path in dict.fromkeys(chain) if os.path.isfile(path)]
+
+
+class ConfigLoadCache:
+    """A persistent cache of the result of loading config override files.
+
+    Override files such as ``config/processCcd.py`` load others
+    (``config.isr.load(...)``), so starting a task executes a chain of
+    Python files. The first time a file is loaded into a config in a
+    given state by `load`, this cache records every file in the chain and
+    stores the field values the chain changed; after that, as long as no
+    file in the chain has changed (by SHA-256 of its contents), the values
+    are set directly and no file is executed.
+
+    Only loads made through `load` (as `ObsTestArgumentParser` does for
+    the obs package overrides and ``--configfile``) use the cache;
+    `lsst.pex.config.Config.load` itself is unchanged.
+
+    Parameters
+    ----------
+    cacheDir : `str`, optional
+        Directory holding the cache; `getDefaultConfigCacheDir` if `None`.
+        It is created private to the user; if it exists but is not owned
+        by the user, or others may write to it, nothing is cached.
+
+    Notes
+    -----
+    An entry is keyed by the path of the top-level file, the ``root``
+    name, the config class and the field values of the config before
+    loading. A chain is not cached (it is simply executed each time) if it
+    retargets a subtask or replaces a subconfig with another class, if a
+    changed value cannot be pickled, or if setting the changed values on a
+    config in the original state does not reproduce the loaded config
+    exactly. Modules the override files import are tracked only if they
+    are first imported by the chain. Values set from the cache are
+    recorded in the history of the config with the label
+    ``"load <file> (cached)"``.
+    """
+
+    def __init__(self, cacheDir=None):
+        self.cacheDir = cacheDir if cacheDir is not None else getDefaultConfigCacheDir()
+        self.numHits = 0
+        self.numMisses = 0
+        self._usable = None
+
+    def _isUsable(self):
+        """Return whether the cache directory exists, is owned by this
+        user and cannot be written by others, creating it if needed.
+        """
+        if self._usable is None:
+            try:
+                os.makedirs(self.cacheDir, mode=0o700, exist_ok=True)
+                info = os.lstat(self.cacheDir)
+                self._usable = stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() \
+                    and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+            except OSError:
+                self._usable = False
+        return self._usable
+
+    def _getEntryPath(self, config, filename, root, before):
+        key = "\0".join([str(CacheVersion), os.path.abspath(filename), root,
+                         type(config).__module__, type(config).__qualname__, repr(before)])
+        return os.path.join(self.cacheDir, hashlib.sha256(key.encode()).hexdigest() + ".pickle")
+
+    def load(self, config, filename, root="config"):
+        """Load a config override file into a config, using the cache if
+        possible.
+
+        Parameters
+        ----------
+        config : `lsst.pex.config.Config`
+            Config to modify.
+        filename : `str`
+            Config override file.
+        root : `str`, optional
+            Name of the config in the file.
+
+        Returns
+        -------
+        cached : `bool`
+            `True` if the values were taken from the cache, `False` if the
+            file was executed.
+        """
+        if not self._isUsable():
+            self.numMisses += 1
+            config.load(filename, root=root)
+            return False
+        before = config.toDict()
+        entryPath = self._getEntryPath(config, filename, root, before)
+        entry = None
+        try:
+            with open(entryPath, "rb") as f:
+                entry = pickle.load(f)
+            if not all(hashFile(path) == digest for path, digest in entry["files"]):
+                entry = None
+        except (OSError, EOFError, pickle.PickleError, KeyError, TypeError, ValueError, AttributeError):
+            entry = None
+        if entry is not None:
+            applyConfigDelta(config, entry["delta"], label="load %s (cached)" % (filename,))
+            self.numHits += 1
+            return True
+
+        self.numMisses += 1
+        structure = getConfigStructure(config)
+        chain = _loadRecordingChain(config, filename, root)
+        try:
+            self._store(entryPath, config, before, structure, chain)
+        except Exception:
+            # Not cacheable; the file will be executed next time, too
+            pass
+        return False
+
+    def _store(self, entryPath, config, before, structure, chain):
+        """Store the delta made by loading a chain of files, if it
+        reproduces the loaded config.
+        """
+        if getConfigStructure(config) != structure:
+            return
+        after = config.toDict()
+        delta = diffConfig(config, before, after)
+        check = type(config)()
+        applyConfigDelta(check, diffConfig(check, check.toDict(), before))
+        applyConfigDelta(check, delta)
+        if check.toDict() != after:
+            return
+        files = [(path, hashFile(path)) for path in chain]
+        data = pickle.dumps({"files": files, "delta": delta}, protocol=pickle.HIGHEST_PROTOCOL)
+        fd, tempPath = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tempPath, entryPath)
+        except Exception:
+            os.unlink(tempPath)
+            raise
+
+
+def loadConfig(config, filename, root="config", cacheDir=None):
+    """Load a config override file into a config through a
+    `ConfigLoadCache`.
+
+    Parameters
+    ----------
+    config : `lsst.pex.config.Config`
+        Config to modify.
+    filename : `str`
+        Config override file.
+    root : `str`, optional
+        Name of the config in the file.
+    cacheDir : `str`, optional
+        Cache directory; `getDefaultConfigCacheDir` if `None`.
+
+    Returns
+    -------
+    cached : `bool`
+        `True` if the values were taken from the cache.
+    """
+    return ConfigLoadCache(cacheDir).load(config, filename, root=root)
@@ -0,0 +1,202 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["configFingerprint", "readConfigFingerprint", "readFingerprintConfigStorage",
+           "writeFingerprintConfigStorage"]
+
+import hashlib
+import os
+import pickle
+
+import lsst.daf.persistence as dafPersist
+from lsst.daf.persistence.safeFileIo import SafeFilename
+from lsst.utils import doImport
+from .fitsWriter import _writeAtomic
+from .writeBehind import getFinalPath
+
+FingerprintSuffix = ".sha256"
+"""Suffix of the file holding the fingerprint of a persisted config."""
+
+SnapshotSuffix = ".snapshot"
+"""Suffix of the binary snapshot of a persisted config."""
+
+
+def configFingerprint(config):
+    """Return a canonical hash of a config.
+
+    Parameters
+    ----------
+    config : `lsst.pex.config.Config`
+        The config.
+
+    Returns
+    -------
+    fingerprint : `str`
+        SHA-256 (hex) of the config class and all field values; equal
+        configs of the same class have equal fingerprints.
+    """
+    text = "%s.%s\0%r" % (type(config).__module__, type(config).__qualname__, config.toDict())
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _readSidecar(filename):
+    """Return ``(fingerprint, sourceHash)`` from the fingerprint file of a
+    persisted config, or `None`.
+    """
+    try:
+        with open(filename + FingerprintSuffix) as f:
+            fingerprint, sourceHash = f.read().split()
+    except (OSError, ValueError):
+        return None
+    return fingerprint, sourceHash
+
+
+def readConfigFingerprint(filename):
+    """Return the fingerprint of a config persisted by
+    `writeFingerprintConfigStorage`.
+
+    Parameters
+    ----------
+    filename : `str`
+        Path to the persisted config (``.py``) file.
+
+    Returns
+    -------
+    fingerprint : `str` or `None`
+        `configFingerprint` of the persisted config, or `None` if there is
+        no fingerprint or the file has changed since it was written.
+    """
+    from .configCache import hashFile
+    stored = _readSidecar(filename)
+    if stored is None or not os.path.exists(filename) or hashFile(filename) != stored[1]:
+        return None
+    return stored[0]
+
+
+def _makeSnapshot(config, sourceHash):
+    """Return the snapshot of a config as bytes, or `None` if the config
+    cannot be rebuilt from field values alone (e.g. a subtask has been
+    retargeted).
+    """
+    from .configCache import applyConfigDelta, diffConfig, getConfigStructure
+    ConfigClass = type(config)
+    after = config.toDict()
+    delta = diffConfig(config, ConfigClass().toDict(), after)
+    check = ConfigClass()
+    applyConfigDelta(check, delta)
+    if check.toDict() != after or getConfigStructure(check) != getConfigStructure(config):
+        return None
+    return pickle.dumps({"class": "%s.%s" % (ConfigClass.__module__, ConfigClass.__qualname__),
+                         "sourceHash": sourceHash, "delta": delta}, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _readSnapshot(filename, pythonType):
+    """Rebuild a config from its snapshot, or return `None` if there is no
+    valid snapshot for the current contents of ``filename``.
+    """
+    from .configCache import applyConfigDelta, hashFile
+    try:
+        with open(filename + SnapshotSuffix, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, EOFError, pickle.PickleError, AttributeError, ImportError):
+        return None
+    if snapshot.get("class") != "%s.%s" % (pythonType.__module__, pythonType.__qualname__):
+        return None
+    if hashFile(filename) != snapshot.get("sourceHash"):
+        return None
+    config = pythonType()
+    applyConfigDelta(config, snapshot["delta"])
+    return config
+
+
+def readFingerprintConfigStorage(butlerLocation):
+    """Read a config written by `writeFingerprintConfigStorage`.
+
+    The config is rebuilt from its binary snapshot if the ``.py`` file is
+    unchanged since it was written, else by executing the ``.py`` file,
+    as for ``ConfigStorage``.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location of the config.
+
+    Returns
+    -------
+    results : `list` of `lsst.pex.config.Config`
+        The config at each location.
+    """
+    results = []
+    for locationString in butlerLocation.locationList:
+        locStringWithRoot = os.path.join(butlerLocation.storage.root, locationString)
+        filename = dafPersist.LogicalLocation(locStringWithRoot, butlerLocation.additionalData).locString()
+        if not os.path.exists(filename):
+            raise RuntimeError("No such config file: " + filename)
+        pythonType = butlerLocation.getPythonType()
+        if isinstance(pythonType, str):
+            pythonType = doImport(pythonType)
+        config = _readSnapshot(filename, pythonType)
+        if config is None:
+            config = pythonType()
+            config.load(filename)
+        results.append(config)
+    return results
+
+
+def writeFingerprintConfigStorage(butlerLocation, obj):
+    """Write a config as ``ConfigStorage`` does, with a fingerprint and a
+    binary snapshot.
+
+    If the file already holds a config with the same fingerprint it is
+    left untouched; when writing through `writeAtomic` (e.g. with
+    ``writeBehind``) the file compared is the one being replaced.
+    Otherwise the ``.py`` file is written, then the snapshot
+    (``.py.snapshot``) and the fingerprint (``.py.sha256``, the
+    `configFingerprint` and the SHA-256 of the ``.py`` file), which are
+    ignored if the ``.py`` file is later changed by other means.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location for the config.
+    obj : `lsst.pex.config.Config`
+        The config to write.
+    """
+    from .configCache import hashFile
+    filename = os.path.join(butlerLocation.storage.root, butlerLocation.getLocations()[0])
+    fingerprint = configFingerprint(obj)
+    if readConfigFingerprint(getFinalPath(filename)) == fingerprint:
+        return
+    with SafeFilename(filename) as outputPath:
+        obj.save(outputPath)
+    sourceHash = hashFile(filename)
+    snapshot = _makeSnapshot(obj, sourceHash)
+    if snapshot is not None:
+        _writeAtomic(filename + SnapshotSuffix, snapshot)
+    else:
+        for path in (filename, getFinalPath(filename)):
+            if os.path.exists(path + SnapshotSuffix):
+                os.unlink(path + SnapshotSuffix)
+    _writeAtomic(filename + FingerprintSuffix, ("%s %s\n" % (fingerprint, sourceHash)).encode())
+
+
+dafPersist.PosixStorage.registerFormatters("FingerprintConfigStorage", readFingerprintConfigStorage,
+                                           writeFingerprintConfigStorage)
@@ -0,0 +1,130 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["ExposureRecord", "expandExposureDataIds"]
+
+import numpy as np
+
+
+class ExposureRecord:
+    """Compact description of one registered exposure.
+
+    Parameters
+    ----------
+    visit : `int`
+        Visit number.
+    filter : `str`
+        Filter name.
+    taiObs : `str`
+        ISO-8601 TAI date of the observation.
+    expTime : `float`
+        Exposure time (sec).
+    extra : `dict`, optional
+        Keys of the data ID that are not registry columns; compared by
+        ``==`` but not hashed, so values need not be hashable.
+    """
+    __slots__ = ("visit", "filter", "taiObs", "expTime", "extra")
+
+    def __init__(self, visit, filter, taiObs, expTime, extra=None):
+        self.visit = visit
+        self.filter = filter
+        self.taiObs = taiObs
+        self.expTime = expTime
+        self.extra = extra
+
+    def __repr__(self):
+        return "ExposureRecord(visit=%r, filter=%r, taiObs=%r, expTime=%r)" % (
+            self.visit, self.filter, self.taiObs, self.expTime)
+
+    def __eq__(self, other):
+        if not isinstance(other, ExposureRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __hash__(self):
+        return hash((self.visit, self.filter, self.taiObs, self.expTime))
+
+    def toDict(self):
+        """Return the data ID of the exposure.
+
+        Returns
+        -------
+        dataId : `dict`
+            ``visit`` and ``filter``, plus any extra keys.
+        """
+        dataId = dict(visit=self.visit, filter=self.filter)
+        if self.extra:
+            dataId.update(self.extra)
+        return dataId
+
+
+def expandExposureDataIds(visitRows, dataIdList):
+    """Match partial data IDs against the rows of the ``raw_visit`` table.
+
+    Parameters
+    ----------
+    visitRows : `list` of `tuple`
+        ``(visit, filter, taiObs, expTime)`` for every registered visit.
+    dataIdList : `list` of `dict`
+        Partial data IDs; each may constrain any of ``visit``, ``filter``,
+        ``taiObs`` and ``expTime``, and other keys are passed through.
+
+    Returns
+    -------
+    records : `list` of `list` of `ExposureRecord`
+        For each data ID of ``dataIdList``, in order, a record for each
+        matching exposure: one at most for a data ID with ``visit``,
+        possibly several for one without, none for one that matches no
+        exposure.
+
+    Notes
+    -----
+    Data IDs that give ``visit`` are matched together with one binary
+    search of the sorted visit numbers; the others are matched by filter.
+    """
+    columns = ("visit", "filter", "taiObs", "expTime")
+    rows = sorted(visitRows)
+    visits = np.array([row[0] for row in rows], dtype=np.int64)
+    byFilter = {}
+    for i, row in enumerate(rows):
+        byFilter.setdefault(row[1], []).append(i)
+
+    withVisit = [i for i, dataId in enumerate(dataIdList) if dataId.get("visit") is not None]
+    rowIndex = {}
+    if withVisit and len(visits) > 0:
+        wanted = np.array([int(dataIdList[i]["visit"]) for i in withVisit], dtype=np.int64)
+        pos = np.minimum(np.searchsorted(visits, wanted), len(visits) - 1)
+        found = visits[pos] == wanted
+        rowIndex = dict(zip(np.array(withVisit)[found].tolist(), pos[found].tolist()))
+
+    records = []
+    for i, dataId in enumerate(dataIdList):
+        if dataId.get("visit") is not None:
+            candidates = [rowIndex[i]] if i in rowIndex else []
+        elif dataId.get("filter") is not None:
+            candidates = byFilter.get(dataId["filter"], [])
+        else:
+            candidates = range(len(rows))
+        extra = {key: value for key, value in dataId.items() if key not in columns} or None
+        records.append([ExposureRecord(*rows[j], extra=extra) for j in candidates
+                        if all(dataId.get(key) in (None, value)
+                               for key, value in zip(columns[1:], rows[j][1:]))])
+    return records
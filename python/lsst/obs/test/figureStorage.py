@@ -0,0 +1,270 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["FigureSpec", "writeFigureSpecStorage", "renderFigureSpec", "ensureFigures", "flushFigures",
+           "getFigureRenderer", "FigureRenderingModes"]
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+
+import lsst.daf.persistence as dafPersist
+from .fitsWriter import _setDefaultMode, _writeAtomic
+from .writeBehind import WriteBehindQueue
+
+FigureRenderingModes = ("pool", "lazy")
+"""Supported values of ``TestMapper(figureRendering=...)``: render in a
+pool of processes after each put, or when the figure is first read.
+"""
+
+SpecSuffix = ".spec"
+"""Suffix of the pickled figure spec stored next to each figure."""
+
+HashSuffix = ".spechash"
+"""Suffix of the file holding the hash of the spec a figure was rendered
+from.
+"""
+
+NumRenderProcesses = 2
+"""Number of processes of the pool made by `getFigureRenderer`."""
+
+_renderer = None
+_rendererLock = threading.Lock()
+
+
+class _AxesSpec:
+    """Plotting calls on one set of axes of a `FigureSpec`.
+
+    Any public method called on this object is recorded, to be called on
+    the `matplotlib.axes.Axes` when the figure is rendered.
+    """
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return record
+
+
+class FigureSpec:
+    """A figure described by the plotting calls that make it.
+
+    A spec holds only the plot data and the calls, so it is much cheaper
+    to make and to pickle than a `matplotlib.figure.Figure`, and does not
+    need matplotlib until it is rendered.
+
+    Parameters
+    ----------
+    figsize : `tuple` of `float`, optional
+        Figure size (inches).
+    dpi : `float`, optional
+        Resolution (dots per inch).
+
+    Examples
+    --------
+    >>> spec = FigureSpec()
+    >>> axes = spec.addSubplot(1, 1, 1)
+    >>> axes.plot([0, 1], [0, 1], "k")
+    >>> axes.set_xlabel("x")
+    """
+
+    def __init__(self, figsize=None, dpi=None):
+        self.figsize = figsize
+        self.dpi = dpi
+        self.axes = []
+
+    def addSubplot(self, *args, **kwargs):
+        """Add axes, as `matplotlib.figure.Figure.add_subplot` does.
+
+        Returns
+        -------
+        axes : `object`
+            Recorder of the calls to make on the axes, such as ``plot``.
+        """
+        axes = _AxesSpec(args, kwargs)
+        self.axes.append(axes)
+        return axes
+
+    def render(self):
+        """Make the figure.
+
+        Returns
+        -------
+        figure : `matplotlib.figure.Figure`
+            The figure, with an Agg canvas; it is not known to pyplot.
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        figure = Figure(figsize=self.figsize, dpi=self.dpi)
+        FigureCanvasAgg(figure)
+        for axesSpec in self.axes:
+            axes = figure.add_subplot(*axesSpec.args, **axesSpec.kwargs)
+            for name, args, kwargs in axesSpec.calls:
+                getattr(axes, name)(*args, **kwargs)
+        return figure
+
+
+def _readHash(path):
+    try:
+        with open(path + HashSuffix) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def renderFigureSpec(path):
+    """Render the figure spec stored next to a file, unless the file was
+    already rendered from the same spec.
+
+    Parameters
+    ----------
+    path : `str`
+        Path of the image; the spec is read from ``path + SpecSuffix`` and
+        the format is chosen from the extension of ``path``.
+
+    Returns
+    -------
+    rendered : `bool`
+        `True` if the figure was rendered, `False` if it was up to date
+        or there is no spec.
+    """
+    try:
+        with open(path + SpecSuffix, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return False
+    specHash = hashlib.sha256(data).hexdigest()
+    if _readHash(path) == specHash and os.path.exists(path):
+        return False
+    obj = pickle.loads(data)
+    figure = obj.render() if isinstance(obj, FigureSpec) else obj
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    FigureCanvasAgg(figure)
+    fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-",
+                                    suffix=os.path.splitext(path)[1])
+    try:
+        _setDefaultMode(fd)
+    finally:
+        os.close(fd)
+    try:
+        figure.savefig(tempPath)
+        os.replace(tempPath, path)
+    finally:
+        if os.path.exists(tempPath):
+            os.unlink(tempPath)
+        if "matplotlib.pyplot" in sys.modules:
+            # An unpickled pyplot figure is registered with pyplot
+            sys.modules["matplotlib.pyplot"].close(figure)
+    _writeAtomic(path + HashSuffix, specHash.encode())
+    return True
+
+
+def getFigureRenderer():
+    """Return the pool of processes that renders figures.
+
+    Returns
+    -------
+    renderer : `WriteBehindQueue`
+        Queue of renders, made with `NumRenderProcesses` processes the
+        first time it is needed.
+    """
+    global _renderer
+    with _rendererLock:
+        if _renderer is None or _renderer.closed:
+            _renderer = WriteBehindQueue(numThreads=NumRenderProcesses, maxPending=64, useProcesses=True)
+        return _renderer
+
+
+def writeFigureSpecStorage(butlerLocation, obj):
+    """Store a figure as a pickled spec and render it later.
+
+    The spec (the pickled `FigureSpec` or `matplotlib.figure.Figure`) is
+    written next to the image with `SpecSuffix`. The image is rendered
+    with Agg by `renderFigureSpec`, in the pool of `getFigureRenderer` if
+    the ``figureRendering`` entry of the additional data of the location
+    is "pool" (the default), else when it is first read (see
+    `ensureFigures`). Putting a figure whose spec is unchanged renders
+    nothing.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location to write.
+    obj : `FigureSpec` or `matplotlib.figure.Figure`
+        Figure to write.
+    """
+    additionalData = butlerLocation.getAdditionalData()
+    mode = additionalData.getScalar("figureRendering") \
+        if additionalData is not None and additionalData.exists("figureRendering") else "pool"
+    if mode not in FigureRenderingModes:
+        raise ValueError("Unsupported figureRendering %r; must be one of %s" % (mode, FigureRenderingModes))
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    specHash = hashlib.sha256(data).hexdigest()
+    for path in butlerLocation.getLocationsWithRoot():
+        if _readHash(path) == specHash and os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _writeAtomic(path + SpecSuffix, data)
+        if mode == "pool":
+            getFigureRenderer().submitCall([path], renderFigureSpec, path)
+
+
+def ensureFigures(paths):
+    """Make sure figures are rendered from their latest spec.
+
+    Waits for queued renders of the files, then renders any that are
+    missing or out of date.
+
+    Parameters
+    ----------
+    paths : iterable of `str`
+        Paths of the images.
+    """
+    paths = list(paths)
+    if _renderer is not None:
+        _renderer.wait(paths)
+    for path in paths:
+        renderFigureSpec(path)
+
+
+def flushFigures():
+    """Wait for all queued renders.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if any render failed.
+    """
+    if _renderer is not None:
+        _renderer.flush()
+
+
+dafPersist.PosixStorage.registerFormatters("FigureSpecStorage", writeFormatter=writeFigureSpecStorage)
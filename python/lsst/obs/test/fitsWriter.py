@@ -0,0 +1,312 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["gzipCompress", "compressFits", "writeCompressedFitsStorage", "writeDedupFitsStorage",
+           "pruneDedupStore", "DedupDirName", "CompressionTypes"]
+
+import concurrent.futures
+import copy
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+import lsst.daf.persistence as dafPersist
+
+DedupDirName = ".dedup"
+"""Directory, relative to the repository root, of the content-addressed
+store of files written by `writeDedupFitsStorage`.
+"""
+
+CompressionTypes = ("gzip", "none")
+"""Supported values of the ``compression`` write option."""
+
+GzipBlockSize = 1 << 18
+"""Size (bytes) of the blocks compressed independently by `gzipCompress`."""
+
+_GzipHeader = b"\x1f\x8b\x08\x00" + b"\x00\x00\x00\x00" + b"\x00\xff"
+"""gzip header with no file name and zero modification time, so the output
+depends only on the data.
+"""
+
+
+def _compressBlock(blocks, index, level):
+    """Compress one block as raw deflate data, primed with the end of the
+    previous block, as pigz does.
+    """
+    kwargs = {}
+    if index > 0:
+        kwargs["zdict"] = blocks[index - 1][-32768:]
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, **kwargs)
+    last = index == len(blocks) - 1
+    return compressor.compress(blocks[index]) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def gzipCompress(data, level=6, threads=None):
+    """Compress data to gzip format, compressing blocks in parallel.
+
+    Parameters
+    ----------
+    data : `bytes`
+        Data to compress.
+    level : `int`, optional
+        zlib compression level, 1-9.
+    threads : `int`, optional
+        Number of threads; the number of CPUs if `None`.
+
+    Returns
+    -------
+    compressed : `bytes`
+        A single-member gzip file, readable by any gzip reader
+        (including cfitsio). The output depends only on ``data`` and
+        ``level``, not on ``threads``.
+    """
+    blocks = [data[i:i + GzipBlockSize] for i in range(0, len(data), GzipBlockSize)] or [b""]
+    if threads is None:
+        threads = os.cpu_count() or 1
+    threads = max(1, min(threads, len(blocks)))
+    if threads == 1:
+        pieces = [_compressBlock(blocks, i, level) for i in range(len(blocks))]
+    else:
+        # zlib releases the GIL while compressing
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            pieces = list(executor.map(lambda i: _compressBlock(blocks, i, level), range(len(blocks))))
+    trailer = struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return b"".join([_GzipHeader] + pieces + [trailer])
+
+
+def _serializeFits(butlerLocation, obj, directory):
+    """Return the uncompressed FITS file that ``FitsStorage`` would write
+    for an object, as `bytes`.
+    """
+    root = butlerLocation.storage.root
+    fd, tempPath = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".fits")
+    os.close(fd)
+    try:
+        tempLocation = copy.copy(butlerLocation)
+        tempLocation.locationList = [os.path.relpath(tempPath, root)]
+        dafPersist.PosixStorage.getWriteFormatter("FitsStorage")(tempLocation, obj)
+        with open(tempPath, "rb") as f:
+            return f.read()
+    finally:
+        if os.path.exists(tempPath):
+            os.unlink(tempPath)
+
+
+def _readUmask():
+    """Return the file mode creation mask of the process."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    # Not thread safe, but this runs at import
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+_Umask = _readUmask()
+
+
+def _setDefaultMode(fd):
+    """Give a file made by `tempfile.mkstemp` (mode 0600) the mode of a file
+    made by ``open``, as the formatters of
+    `lsst.daf.persistence.PosixStorage` do, so it keeps the usual
+    permissions when renamed into place.
+    """
+    os.fchmod(fd, 0o666 & ~_Umask)
+
+
+def _writeAtomic(path, data):
+    fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        _setDefaultMode(fd)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tempPath, path)
+    except Exception:
+        os.unlink(tempPath)
+        raise
+
+
+def _linkAtomic(source, path):
+    """Make ``path`` a hard link to ``source`` (a copy where hard links are
+    not supported), replacing any existing file.
+    """
+    tempPath = os.path.join(os.path.dirname(path), ".tmp-%d-%s" % (os.getpid(), os.path.basename(path)))
+    if os.path.lexists(tempPath):
+        os.unlink(tempPath)
+    try:
+        os.link(source, tempPath)
+    except OSError:
+        shutil.copyfile(source, tempPath)
+    os.replace(tempPath, path)
+
+
+def compressFits(data, compression="gzip", level=6, threads=None):
+    """Compress a serialized FITS file.
+
+    Parameters
+    ----------
+    data : `bytes`
+        Uncompressed FITS file.
+    compression : `str`, optional
+        One of `CompressionTypes`: "gzip" compresses with `gzipCompress`,
+        "none" returns ``data`` unchanged.
+    level : `int`, optional
+        zlib compression level, 1-9.
+    threads : `int`, optional
+        Number of compression threads; the number of CPUs if `None` or 0.
+
+    Returns
+    -------
+    compressed : `bytes`
+        The file to write.
+    """
+    if compression == "none":
+        return data
+    if compression != "gzip":
+        raise ValueError("Unsupported compression %r; must be one of %s" % (compression, CompressionTypes))
+    return gzipCompress(data, level=level, threads=threads or None)
+
+
+def _getOption(additionalData, name, default):
+    if additionalData is None or not additionalData.exists(name):
+        return default
+    return additionalData.getScalar(name)
+
+
+def _writeFits(butlerLocation, obj, dedup):
+    root = butlerLocation.storage.root
+    additionalData = butlerLocation.getAdditionalData()
+    dedup = _getOption(additionalData, "writeDedup", dedup)
+    level = _getOption(additionalData, "writeLevel", 6)
+    threads = _getOption(additionalData, "writeThreads", None)
+    if dedup:
+        storeDir = os.path.join(root, DedupDirName)
+        os.makedirs(storeDir, exist_ok=True)
+    for location in butlerLocation.getLocations():
+        logLoc = dafPersist.LogicalLocation(location, additionalData)
+        path = os.path.join(root, logLoc.locString())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = _serializeFits(butlerLocation, obj, os.path.dirname(path))
+        isGzipName = path.endswith(".gz")
+        compression = _getOption(additionalData, "writeCompression", "gzip" if isGzipName else "none")
+        if (compression == "gzip") != isGzipName:
+            raise ValueError("Cannot write %s with compression %r" % (path, compression))
+        if not dedup:
+            _writeAtomic(path, compressFits(data, compression, level, threads))
+            continue
+        digest = hashlib.sha256(data)
+        digest.update(b"gzip%d" % (level,) if compression == "gzip" else b"fits")
+        storePath = os.path.join(storeDir, digest.hexdigest() + (".fits.gz" if compression == "gzip"
+                                                                 else ".fits"))
+        if not os.path.exists(storePath):
+            _writeAtomic(storePath, compressFits(data, compression, level, threads))
+        elif os.path.exists(path) and os.path.samefile(storePath, path):
+            continue
+        _linkAtomic(storePath, path)
+
+
+def writeCompressedFitsStorage(butlerLocation, obj):
+    """Write an object as ``FitsStorage`` does, with the compression
+    settings of the dataset.
+
+    The object is serialized to uncompressed FITS, compressed with
+    `compressFits` and written atomically. Settings are read from the
+    additional data of the location, where `TestMapper.map` puts the
+    ``writeOptions`` of the dataset in the policy:
+
+    - ``writeCompression``: one of `CompressionTypes`; defaults to "gzip"
+      if the location ends in ".gz", else "none". It must match the name
+      of the location: a `ValueError` is raised for "none" with a ".gz"
+      name, or "gzip" without one.
+    - ``writeLevel``: zlib compression level, 1-9 (default 6).
+    - ``writeThreads``: number of compression threads; 0 for the number of
+      CPUs (the default). The output does not depend on it.
+    - ``writeDedup``: if true, store each distinct file once, as
+      `writeDedupFitsStorage` does.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location to write.
+    obj : `object`
+        Object with ``writeFits``, e.g. an `lsst.afw.image.Exposure`.
+    """
+    _writeFits(butlerLocation, obj, dedup=False)
+
+
+def writeDedupFitsStorage(butlerLocation, obj):
+    """Write an object as ``FitsStorage`` does, storing each distinct file
+    once.
+
+    The object is serialized to uncompressed FITS and hashed. The file
+    (compressed as described in `writeCompressedFitsStorage`) is kept in a
+    content-addressed store in `DedupDirName` under the repository root
+    and hard-linked to its location, so writing content that is already
+    in the repository, for instance a component written both directly and
+    through a composite, neither compresses nor writes it again. Files are
+    replaced atomically, never modified in place, so linked copies are
+    never changed through each other.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location to write.
+    obj : `object`
+        Object with ``writeFits``, e.g. an `lsst.afw.image.Exposure`.
+    """
+    _writeFits(butlerLocation, obj, dedup=True)
+
+
+def pruneDedupStore(root):
+    """Remove files from the store of `writeDedupFitsStorage` that are no
+    longer linked from the repository.
+
+    Parameters
+    ----------
+    root : `str`
+        Repository root.
+
+    Returns
+    -------
+    numRemoved : `int`
+        Number of files removed.
+    """
+    storeDir = os.path.join(root, DedupDirName)
+    numRemoved = 0
+    if not os.path.isdir(storeDir):
+        return numRemoved
+    for entry in os.scandir(storeDir):
+        if entry.is_file() and entry.stat().st_nlink == 1:
+            os.unlink(entry.path)
+            numRemoved += 1
+    return numRemoved
+
+
+dafPersist.PosixStorage.registerFormatters("CompressedFitsStorage", writeFormatter=writeCompressedFitsStorage)
+dafPersist.PosixStorage.registerFormatters("DedupFitsStorage", writeFormatter=writeDedupFitsStorage)
@@ -0,0 +1,112 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["HeaderCache", "getHeaderCache"]
+
+import collections
+import os
+import threading
+
+from lsst.afw.fits import readMetadata
+from .writeBehind import _stripHdu
+
+
+class HeaderCache:
+    """Least-recently-used cache of parsed FITS headers.
+
+    Headers are keyed by file and HDU and stamped with the modification
+    time and size of the file, so a header is parsed once however many
+    datasets (e.g. ``raw_md`` and ``rawMetadataDirect``) point at the same
+    file, and parsed again when the file changes.
+
+    Parameters
+    ----------
+    maxEntries : `int`, optional
+        Maximum number of headers kept.
+
+    Notes
+    -----
+    Callers get a deep copy of the cached header, never the cached object
+    itself: a `lsst.daf.base.PropertyList` is a C++ object, so a
+    copy-on-write view of it is not possible. Copying is much cheaper than
+    decompressing and parsing the header again.
+    """
+
+    def __init__(self, maxEntries=256):
+        self.maxEntries = maxEntries
+        self.numHits = 0
+        self.numMisses = 0
+        self._headers = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Forget all headers."""
+        with self._lock:
+            self._headers.clear()
+
+    def readMetadata(self, path, hdu=None):
+        """Read a FITS header.
+
+        Parameters
+        ----------
+        path : `str`
+            Path of the file, optionally with a cfitsio HDU specifier such
+            as "[1]".
+        hdu : `int`, optional
+            HDU to read; by default the first HDU with data (or that given
+            in ``path``), as for `lsst.afw.fits.readMetadata`.
+
+        Returns
+        -------
+        metadata : `lsst.daf.base.PropertyList`
+            A copy of the header, which the caller may modify.
+        """
+        st = os.stat(_stripHdu(path))
+        key = (os.path.abspath(path), hdu)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._headers.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._headers.move_to_end(key)
+                self.numHits += 1
+                return entry[1].deepCopy()
+        metadata = readMetadata(path) if hdu is None else readMetadata(path, hdu)
+        with self._lock:
+            self.numMisses += 1
+            self._headers[key] = (stamp, metadata)
+            self._headers.move_to_end(key)
+            while len(self._headers) > self.maxEntries:
+                self._headers.popitem(last=False)
+        return metadata.deepCopy()
+
+
+_headerCache = HeaderCache()
+
+
+def getHeaderCache():
+    """Return the header cache shared by all `TestMapper` instances.
+
+    Returns
+    -------
+    cache : `HeaderCache`
+        The shared cache.
+    """
+    return _headerCache
@@ -0,0 +1,182 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["DirectoryListingCache", "getSearchRoots", "getButlerRepositories"]
+
+import os
+import threading
+import time
+
+MaxParentDepth = 100
+"""Maximum length of a chain of ``_parent`` links followed by
+`getSearchRoots`.
+"""
+
+
+def getSearchRoots(root):
+    """Return a repository root and the roots of its parents.
+
+    Parameters
+    ----------
+    root : `str`
+        Repository root.
+
+    Returns
+    -------
+    roots : `list` of `str`
+        ``root``, then each ``_parent`` link in turn, in the order
+        `lsst.daf.persistence.PosixStorage` searches them.
+    """
+    roots = [root]
+    parent = os.path.join(root, "_parent")
+    while os.path.exists(parent) and len(roots) < MaxParentDepth:
+        roots.append(parent)
+        parent = os.path.join(parent, "_parent")
+    return roots
+
+
+def getButlerRepositories(butler):
+    """Return the mapper and roots of the repositories a butler reads.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.persistence.Butler`
+        Butler, e.g. made with separate ``inputs`` and ``outputs``.
+
+    Returns
+    -------
+    mapper : `lsst.obs.base.CameraMapper`
+        Mapper of the first repository read (the output repository, if it
+        is readable).
+    roots : `list` of `str`
+        Roots of the repositories read, in the order
+        `lsst.daf.persistence.Butler` searches them; each is searched
+        with its ``_parent`` chain.
+    """
+    repos = butler._repos.inputs()
+    return repos[0].repo._mapper, [repoData.cfg.root for repoData in repos]
+
+
+class DirectoryListingCache:
+    """Cache of the names of the files in directories.
+
+    Each directory is listed with one ``scandir`` and the names held in a
+    set. The listing is reused for as long as the modification time of
+    the directory is unchanged, so checking any number of files in it
+    costs one ``stat`` of the directory.
+
+    Parameters
+    ----------
+    racyInterval : `float`, optional
+        A listing is not reused if the directory was modified less than
+        this long (sec) before it was listed, since a later change within
+        the resolution of the file system clock would not change the
+        modification time.
+    """
+
+    def __init__(self, racyInterval=2.0):
+        self.racyInterval = racyInterval
+        self.numScans = 0
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Forget all listings."""
+        with self._lock:
+            self._listings = {}
+
+    def listDirectory(self, directory):
+        """Return the names of the entries of a directory.
+
+        Parameters
+        ----------
+        directory : `str`
+            Path of the directory.
+
+        Returns
+        -------
+        names : `frozenset` of `str`
+            Names of the entries; empty if the directory does not exist.
+        """
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            with self._lock:
+                self._listings.pop(directory, None)
+            return frozenset()
+        listing = self._listings.get(directory)
+        if listing is not None and listing[0] == mtime \
+                and mtime < listing[1] - int(self.racyInterval*1e9):
+            return listing[2]
+        scanTime = time.time_ns()
+        try:
+            with os.scandir(directory) as entries:
+                names = frozenset(entry.name for entry in entries)
+        except (FileNotFoundError, NotADirectoryError):
+            names = frozenset()
+        with self._lock:
+            self._listings[directory] = (mtime, scanTime, names)
+            self.numScans += 1
+        return names
+
+    def exists(self, path):
+        """Return `True` if a file exists.
+
+        Parameters
+        ----------
+        path : `str`
+            Path of the file.
+        """
+        directory, name = os.path.split(os.path.abspath(path))
+        return name in self.listDirectory(directory)
+
+    def findFirst(self, candidateLists):
+        """Find the first existing file of each list of candidates.
+
+        Each directory is checked once per call, however many candidates
+        are in it.
+
+        Parameters
+        ----------
+        candidateLists : iterable of iterable of `str`
+            For each file to find, the paths at which it may be, in order
+            of preference.
+
+        Returns
+        -------
+        paths : `list` of `str` or `None`
+            The first candidate that exists, or `None`, for each list.
+        """
+        listings = {}
+        result = []
+        for candidates in candidateLists:
+            found = None
+            for path in candidates:
+                directory, name = os.path.split(os.path.abspath(path))
+                names = listings.get(directory)
+                if names is None:
+                    names = self.listDirectory(directory)
+                    listings[directory] = names
+                if name in names:
+                    found = path
+                    break
+            result.append(found)
+        return result
@@ -0,0 +1,301 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["MetadataStore", "flattenMetadata", "writeAggregatedYamlStorage", "MetadataStoreName"]
+
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import lsst.daf.base as dafBase
+import lsst.daf.persistence as dafPersist
+
+MetadataStoreName = "metadata.sqlite3"
+"""Name of the metadata store in the root of a repository."""
+
+MetadataPrefix = "metadata."
+"""Prefix of the names of metadata entries that clash with data ID keys."""
+
+EntryTable = "_entries"
+"""Name of the table of metadata entries, shared by all dataset types."""
+
+
+def _quote(name):
+    return '"%s"' % (name.replace('"', '""'),)
+
+
+def _foldCase(name):
+    """Fold a name the way SQLite compares identifiers (ASCII only)."""
+    return name.translate(_AsciiLower)
+
+
+_AsciiLower = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def flattenMetadata(metadata):
+    """Flatten a PropertySet into column values.
+
+    Parameters
+    ----------
+    metadata : `lsst.daf.base.PropertySet`
+        Metadata, e.g. of a task.
+
+    Returns
+    -------
+    values : `dict` [`str`, `object`]
+        Value of each leaf entry, by full (dotted) name. Single values are
+        stored as `int`, `float` or `str`; arrays as JSON text;
+        `lsst.daf.base.DateTime` as ISO-8601 TAI; undefined values as
+        `None`.
+    """
+    values = {}
+    for name in metadata.names(False):
+        if metadata.isPropertySetPtr(name):
+            continue
+        if metadata.isUndefined(name):
+            values[name] = None
+            continue
+        items = metadata.getArray(name)
+        items = [item.toString(dafBase.DateTime.TAI) if isinstance(item, dafBase.DateTime) else item
+                 for item in items]
+        values[name] = items[0] if len(items) == 1 else json.dumps(items)
+    return values
+
+
+class MetadataStore:
+    """Append-only store of flattened metadata in an SQLite file.
+
+    Each `append` adds one row to the table of the dataset type, with the
+    data ID (one column per key) and the time, and one row per metadata
+    entry (e.g. ``test.numProcessed``) to a table of entries shared by all
+    dataset types. Entry names are stored as values, so they may differ
+    only in case and there may be any number of them. Queries return the
+    most recent put of each data ID with one NumPy column per data ID key
+    or entry.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the SQLite file; created if it does not exist.
+    timeout : `float`, optional
+        Time (sec) to wait for other processes writing to the store.
+    """
+
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+
+    def __repr__(self):
+        return "MetadataStore(%r)" % (self.path,)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=wal")
+        return conn
+
+    @staticmethod
+    def _getColumns(conn, table):
+        return [row[1] for row in conn.execute("PRAGMA table_info(%s)" % (_quote(table),))]
+
+    def append(self, datasetType, dataId, metadata):
+        """Add the metadata of one dataset.
+
+        Parameters
+        ----------
+        datasetType : `str`
+            Dataset type; the name of the table.
+        dataId : `dict`
+            Data ID, with `int`, `float` or `str` values.
+        metadata : `lsst.daf.base.PropertySet` or `dict`
+            Metadata, or values from `flattenMetadata`.
+
+        Raises
+        ------
+        ValueError
+            Raised if two data ID keys differ only in case, or a key starts
+            with "_".
+        """
+        values = flattenMetadata(metadata) if not isinstance(metadata, dict) else metadata
+        foldedKeys = {_foldCase(key) for key in dataId}
+        if len(foldedKeys) != len(dataId) or any(key.startswith("_") for key in dataId):
+            raise ValueError("Data ID keys %s of %s clash with each other or with bookkeeping columns" %
+                             (sorted(dataId), datasetType))
+        entries = {}
+        for name, value in values.items():
+            if name in dataId:
+                name = MetadataPrefix + name
+            entries[name] = value
+        row = {"_dataId": json.dumps(dataId, sort_keys=True), "_time": time.time()}
+        row.update(dataId)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE IF NOT EXISTS %s (datasetType TEXT, rowId INTEGER, name TEXT, value, "
+                         "PRIMARY KEY (datasetType, rowId, name)) WITHOUT ROWID" % (_quote(EntryTable),))
+            columns = self._getColumns(conn, datasetType)
+            if not columns:
+                conn.execute("CREATE TABLE %s (_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                             "_dataId TEXT, _time REAL)" % (_quote(datasetType),))
+                conn.execute("CREATE INDEX %s ON %s (_dataId, _id)"
+                             % (_quote("ix_%s_dataId" % (datasetType,)), _quote(datasetType)))
+                columns = ["_id", "_dataId", "_time"]
+            # SQLite column names are not case-sensitive
+            existing = {_foldCase(name) for name in columns}
+            for name in dataId:
+                if _foldCase(name) not in existing:
+                    conn.execute("ALTER TABLE %s ADD COLUMN %s" % (_quote(datasetType), _quote(name)))
+            cursor = conn.execute("INSERT INTO %s (%s) VALUES (%s)" % (
+                _quote(datasetType), ", ".join(_quote(name) for name in row), ", ".join("?"*len(row))),
+                list(row.values()))
+            rowId = cursor.lastrowid
+            conn.executemany("INSERT INTO %s VALUES (?, ?, ?, ?)" % (_quote(EntryTable),),
+                             [(datasetType, rowId, name, value) for name, value in entries.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _getKeyColumns(self, conn, datasetType):
+        return [name for name in self._getColumns(conn, datasetType) if not name.startswith("_")]
+
+    def getColumns(self, datasetType):
+        """Return the columns of a dataset type.
+
+        Returns
+        -------
+        columns : `list` of `str`
+            Data ID keys followed by the names of the metadata entries
+            (not the bookkeeping columns ``_id``, ``_dataId`` and
+            ``_time``); empty if nothing was stored for ``datasetType``.
+        """
+        if not os.path.exists(self.path):
+            return []
+        conn = self._connect()
+        try:
+            keys = self._getKeyColumns(conn, datasetType)
+            if not keys:
+                return []
+            names = [row[0] for row in conn.execute(
+                "SELECT DISTINCT name FROM %s WHERE datasetType = ? ORDER BY name" % (_quote(EntryTable),),
+                (datasetType,))]
+            return keys + names
+        finally:
+            conn.close()
+
+    def query(self, datasetType, columns=None, where=None):
+        """Return the latest metadata of each data ID.
+
+        Parameters
+        ----------
+        datasetType : `str`
+            Dataset type.
+        columns : iterable of `str`, optional
+            Columns (data ID keys or entry names) to return; all if `None`.
+        where : `dict`, optional
+            Required values of columns, such as ``dict(filter="g")``.
+
+        Returns
+        -------
+        result : `dict` [`str`, `numpy.ndarray`]
+            Values of each column, one element per data ID, ordered by the
+            time of the put. Numeric columns are numeric arrays (NaN for
+            missing values where possible); others have ``dtype=object``.
+        """
+        allColumns = self.getColumns(datasetType)
+        if columns is None:
+            columns = allColumns
+        columns = list(columns)
+        unknown = (set(columns) | set(where or {})) - set(allColumns)
+        if unknown:
+            raise KeyError("Unknown columns %s for dataset type %s" % (sorted(unknown), datasetType))
+        table = _quote(datasetType)
+        conn = self._connect()
+        try:
+            keys = set(self._getKeyColumns(conn, datasetType))
+            latest = "SELECT MAX(_id) FROM %s GROUP BY _dataId" % (table,)
+            cmd = "SELECT _id, %s FROM %s WHERE _id IN (%s)" % (
+                ", ".join(_quote(name) for name in keys) or "NULL", table, latest)
+            whereValues = []
+            for name, value in (where or {}).items():
+                if name in keys:
+                    cmd += " AND %s = ?" % (_quote(name),)
+                    whereValues.append(value)
+                else:
+                    cmd += (" AND EXISTS (SELECT 1 FROM %s WHERE datasetType = ? AND rowId = _id "
+                            "AND name = ? AND value = ?)" % (_quote(EntryTable),))
+                    whereValues += [datasetType, name, value]
+            cursor = conn.execute(cmd + " ORDER BY _id", whereValues)
+            keyNames = [desc[0] for desc in cursor.description[1:]]
+            rows = {row[0]: dict(zip(keyNames, row[1:])) for row in cursor}
+            wanted = set(columns) - keys
+            if wanted:
+                for rowId, name, value in conn.execute(
+                        "SELECT rowId, name, value FROM %s WHERE datasetType = ? AND rowId IN (%s)"
+                        % (_quote(EntryTable), latest), (datasetType,)):
+                    if name in wanted and rowId in rows:
+                        rows[rowId][name] = value
+        finally:
+            conn.close()
+        result = {}
+        for name in columns:
+            values = [row.get(name) for row in rows.values()]
+            column = np.array(values, dtype=object)
+            if all(isinstance(v, (int, float)) or v is None for v in values) and \
+                    any(v is not None for v in values):
+                isInt = all(isinstance(v, int) for v in values)
+                column = np.array([np.nan if v is None else v for v in values],
+                                  dtype=np.int64 if isInt else float)
+            result[name] = column
+        return result
+
+
+def writeAggregatedYamlStorage(butlerLocation, obj):
+    """Append a PropertySet to the `MetadataStore` in the repository root,
+    and write it as ``YamlStorage`` does.
+
+    The YAML file is not written if the append fails.
+
+    The data ID stored is given by the ``metadataDataId`` entry (JSON) of
+    the additional data of the location, set by ``TestMapper.map``.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location to write.
+    obj : `lsst.daf.base.PropertySet`
+        Metadata to write.
+    """
+    additionalData = butlerLocation.getAdditionalData()
+    dataId = json.loads(additionalData.getScalar("metadataDataId"))
+    store = MetadataStore(os.path.join(butlerLocation.storage.root, MetadataStoreName))
+    store.append(butlerLocation.datasetType, dataId, obj)
+    dafPersist.PosixStorage.getWriteFormatter("YamlStorage")(butlerLocation, obj)
+
+
+dafPersist.PosixStorage.registerFormatters("AggregatedYamlStorage",
+                                           dafPersist.PosixStorage.getReadFormatter("YamlStorage"),
+                                           writeAggregatedYamlStorage)
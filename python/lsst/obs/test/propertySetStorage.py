@@ -0,0 +1,257 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["packPropertySet", "unpackPropertySet", "readBinaryPropertySetStorage",
+           "writeBinaryPropertySetStorage"]
+
+import os
+import struct
+
+import lsst.daf.base as dafBase
+import lsst.daf.persistence as dafPersist
+from .fitsWriter import _writeAtomic
+
+Magic = b"OTPS"
+"""First bytes of a file written by `packPropertySet`."""
+
+FormatVersion = 1
+"""Version of the format written by `packPropertySet`."""
+
+NumericTypes = {
+    # element type name: (tag, struct format)
+    "Bool": (b"?", "?"),
+    "Short": (b"h", "h"),
+    "Int": (b"i", "i"),
+    "Long": (b"l", "q"),
+    "LongLong": (b"q", "q"),
+    "UnsignedLongLong": (b"Q", "Q"),
+    "Float": (b"f", "f"),
+    "Double": (b"d", "d"),
+}
+"""Tag and packed format of the values of each numeric element type."""
+
+StringTag = b"s"
+DateTimeTag = b"t"
+PropertySetTag = b"p"
+UndefTag = b"u"
+
+_TypeOfTag = {tag: (name, fmt) for name, (tag, fmt) in NumericTypes.items()}
+
+_count = struct.Struct("<I")
+_int64 = struct.Struct("<q")
+
+
+def _packString(pieces, value):
+    data = value.encode()
+    pieces.append(_count.pack(len(data)))
+    pieces.append(data)
+
+
+def _packContainer(pieces, container, isList):
+    if isList:
+        state = dafBase.getPropertyListState(container, asLists=True)
+    else:
+        state = [item + [None] for item in dafBase.getPropertySetState(container, asLists=True)]
+    pieces.append(_count.pack(len(state)))
+    for name, typeName, value, comment in state:
+        _packString(pieces, name)
+        if isList:
+            _packString(pieces, comment)
+        if typeName == "PropertySet":
+            pieces.append(PropertySetTag)
+            _packContainer(pieces, container.getPropertySet(name), isList=False)
+            continue
+        if typeName == "Undef":
+            pieces.append(UndefTag)
+            continue
+        values = container.getArray(name)
+        if typeName in NumericTypes:
+            tag, fmt = NumericTypes[typeName]
+            pieces.append(tag)
+            pieces.append(_count.pack(len(values)))
+            pieces.append(struct.pack("<%d%s" % (len(values), fmt), *values))
+        elif typeName == "String":
+            pieces.append(StringTag)
+            pieces.append(_count.pack(len(values)))
+            for v in values:
+                _packString(pieces, v)
+        elif typeName == "DateTime":
+            pieces.append(DateTimeTag)
+            pieces.append(_count.pack(len(values)))
+            pieces.append(struct.pack("<%dq" % (len(values),),
+                                      *[v.nsecs(dafBase.DateTime.TAI) for v in values]))
+        else:
+            raise TypeError("Cannot pack %r of type %s" % (name, typeName))
+
+
+def packPropertySet(container):
+    """Serialize a PropertySet or PropertyList to a compact binary format.
+
+    Parameters
+    ----------
+    container : `lsst.daf.base.PropertySet` or `lsst.daf.base.PropertyList`
+        Container to pack. Nested PropertySets, arrays, every element
+        type (including `lsst.daf.base.DateTime` and undefined values) and,
+        for a PropertyList, the comments and order of the entries are kept.
+
+    Returns
+    -------
+    data : `bytes`
+        Packed container: `Magic`, the `FormatVersion` and the kind of
+        container, then for each entry its name, type tag and values,
+        numeric arrays being packed as little-endian C values.
+    """
+    isList = isinstance(container, dafBase.PropertyList)
+    pieces = [Magic, bytes([FormatVersion]), b"L" if isList else b"S"]
+    _packContainer(pieces, container, isList)
+    return b"".join(pieces)
+
+
+class _Reader:
+    """Cursor over packed data."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def count(self):
+        value, = _count.unpack_from(self.data, self.offset)
+        self.offset += _count.size
+        return value
+
+    def string(self):
+        size = self.count()
+        value = str(self.data[self.offset:self.offset + size], "utf-8")
+        self.offset += size
+        return value
+
+    def tag(self):
+        value = bytes(self.data[self.offset:self.offset + 1])
+        self.offset += 1
+        return value
+
+    def values(self, fmt, num):
+        packed = struct.Struct("<%d%s" % (num, fmt))
+        values = packed.unpack_from(self.data, self.offset)
+        self.offset += packed.size
+        return list(values)
+
+
+def _unpackContainer(reader, container, isList):
+    for i in range(reader.count()):
+        name = reader.string()
+        args = (reader.string(),) if isList else ()
+        tag = reader.tag()
+        if tag == PropertySetTag:
+            nested = dafBase.PropertySet()
+            _unpackContainer(reader, nested, isList=False)
+            container.setPropertySet(name, nested)
+        elif tag == UndefTag:
+            container.set(name, None, *args)
+        elif tag in _TypeOfTag:
+            typeName, fmt = _TypeOfTag[tag]
+            values = reader.values(fmt, reader.count())
+            getattr(container, "set" + typeName)(name, values, *args)
+        elif tag == StringTag:
+            values = [reader.string() for j in range(reader.count())]
+            container.setString(name, values, *args)
+        elif tag == DateTimeTag:
+            values = [dafBase.DateTime(nsecs, dafBase.DateTime.TAI)
+                      for nsecs in reader.values("q", reader.count())]
+            container.setDateTime(name, values, *args)
+        else:
+            raise ValueError("Unknown type tag %r for %r in packed PropertySet" % (tag, name))
+
+
+def unpackPropertySet(data):
+    """Rebuild a container packed by `packPropertySet`.
+
+    Parameters
+    ----------
+    data : `bytes`
+        Packed container.
+
+    Returns
+    -------
+    container : `lsst.daf.base.PropertySet` or `lsst.daf.base.PropertyList`
+        The container, of the type that was packed.
+
+    Raises
+    ------
+    ValueError
+        Raised if ``data`` is not a packed container of a supported
+        version.
+    """
+    if data[:len(Magic)] != Magic:
+        raise ValueError("Not a packed PropertySet")
+    version = data[len(Magic)]
+    if version != FormatVersion:
+        raise ValueError("Unsupported packed PropertySet version %d" % (version,))
+    isList = data[len(Magic) + 1:len(Magic) + 2] == b"L"
+    reader = _Reader(data)
+    reader.offset = len(Magic) + 2
+    container = dafBase.PropertyList() if isList else dafBase.PropertySet()
+    _unpackContainer(reader, container, isList)
+    return container
+
+
+def readBinaryPropertySetStorage(butlerLocation):
+    """Read PropertySets written by `writeBinaryPropertySetStorage`.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location to read.
+
+    Returns
+    -------
+    results : `list` of `lsst.daf.base.PropertySet`
+        The container at each location.
+    """
+    results = []
+    for locationString in butlerLocation.getLocations():
+        locStringWithRoot = os.path.join(butlerLocation.storage.root, locationString)
+        filename = dafPersist.LogicalLocation(locStringWithRoot, butlerLocation.additionalData).locString()
+        with open(filename, "rb") as f:
+            results.append(unpackPropertySet(f.read()))
+    return results
+
+
+def writeBinaryPropertySetStorage(butlerLocation, obj):
+    """Write a PropertySet or PropertyList with `packPropertySet`.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location to write.
+    obj : `lsst.daf.base.PropertySet` or `lsst.daf.base.PropertyList`
+        Container to write.
+    """
+    data = packPropertySet(obj)
+    for locationString in butlerLocation.getLocations():
+        locStringWithRoot = os.path.join(butlerLocation.storage.root, locationString)
+        filename = dafPersist.LogicalLocation(locStringWithRoot, butlerLocation.additionalData).locString()
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        _writeAtomic(filename, data)
+
+
+dafPersist.PosixStorage.registerFormatters("BinaryPropertySetStorage", readBinaryPropertySetStorage,
+                                           writeBinaryPropertySetStorage)
@@ -0,0 +1,311 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["createRawTables", "makeRawRow", "finalizeRawRegistry", "PooledSqliteRegistry"]
+
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+import lsst.daf.base as dafBase
+import lsst.daf.persistence as dafPersist
+
+RawIndexes = (
+    # Mapping.lookup fast path: filter, taiObs and expTime for a visit.
+    "CREATE INDEX IF NOT EXISTS ix_raw_visit_cover ON raw_visit (visit, filter, taiObs, expTime)",
+    # Lookups and queryMetadata constrained by visit and/or filter.
+    "CREATE INDEX IF NOT EXISTS ix_raw_visit_filter ON raw (visit, filter, taiObs, expTime)",
+    "CREATE INDEX IF NOT EXISTS ix_raw_filter_visit ON raw (filter, visit, taiObs, expTime)",
+    "CREATE INDEX IF NOT EXISTS ix_skyTile_id ON raw_skyTile (id)",
+    "CREATE INDEX IF NOT EXISTS ix_skyTile_tile ON raw_skyTile (skyTile)",
+)
+"""Indexes covering the queries TestMapper issues against an exposure
+registry.
+"""
+
+
+def createRawTables(conn):
+    """Create the exposure registry tables used by TestMapper.
+
+    Parameters
+    ----------
+    conn : `sqlite3.Connection`
+        Connection to a new, empty registry.
+    """
+    conn.execute("""CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        visit INT, filter TEXT, taiObs TEXT, expTime DOUBLE)""")
+    conn.execute("CREATE TABLE raw_skyTile (id INTEGER, skyTile INTEGER)")
+    conn.execute("""CREATE TABLE raw_visit (visit INT, filter TEXT,
+        taiObs TEXT, expTime DOUBLE, UNIQUE(visit))""")
+    conn.commit()
+
+
+def makeRawRow(visit, filterName, metadata):
+    """Make the ``raw`` table row for a raw image.
+
+    Parameters
+    ----------
+    visit : `int`
+        Visit number.
+    filterName : `str`
+        Filter name.
+    metadata : `lsst.daf.base.PropertySet`
+        Header of the raw image; ``EXPTIME`` and ``MJD-OBS`` (TAI) are used.
+
+    Returns
+    -------
+    row : `tuple`
+        ``(visit, filter, taiObs, expTime)``, where ``taiObs`` is ISO-8601
+        UTC, as in the checked-in registry.
+    """
+    expTime = metadata.getScalar("EXPTIME")
+    mjdObs = metadata.getScalar("MJD-OBS")
+    taiObs = dafBase.DateTime(mjdObs, dafBase.DateTime.MJD,
+                              dafBase.DateTime.TAI).toString(dafBase.DateTime.UTC)[:-1]
+    return (visit, filterName, taiObs, expTime)
+
+
+def finalizeRawRegistry(conn, journalMode="wal"):
+    """Fill ``raw_visit``, index an exposure registry and gather statistics
+    for the query planner.
+
+    Parameters
+    ----------
+    conn : `sqlite3.Connection`
+        Connection to a registry created by `createRawTables`.
+    journalMode : `str`, optional
+        SQLite journal mode to leave the registry in, e.g. "wal" or "delete".
+        WAL lets readers proceed while the registry is being updated;
+        "delete" keeps the registry a single file, which is required if it
+        will be read from a read-only directory.
+    """
+    conn.execute("DELETE FROM raw_visit")
+    conn.execute("""INSERT INTO raw_visit
+            SELECT DISTINCT visit, filter, taiObs, expTime FROM raw""")
+    conn.commit()
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_raw ON raw (visit)")
+    for cmd in RawIndexes:
+        conn.execute(cmd)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("PRAGMA journal_mode=%s" % (journalMode,))
+    if journalMode.lower() == "wal":
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class _ConnectionPool:
+    """Read-only SQLite connections, one per (thread, registry file).
+
+    Connections are keyed by process ID as well, so a pool inherited
+    through ``fork`` opens fresh connections in the child. Connections of
+    threads that have exited are closed when new connections are opened,
+    and `close` closes every connection of this process to a file.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = []
+        self._generations = {}
+
+    def get(self, location, cachedStatements):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        pid = os.getpid()
+        generation = self._generations.get(location, 0)
+        entry = connections.get(location)
+        if entry is None or entry[:2] != (pid, generation):
+            uri = "file:%s?mode=ro" % (urllib.parse.quote(os.path.abspath(location)),)
+            # Used by one thread only, but may be closed by another
+            conn = sqlite3.connect(uri, uri=True, cached_statements=cachedStatements,
+                                   check_same_thread=False)
+            conn.text_factory = str
+            entry = (pid, generation, conn)
+            connections[location] = entry
+            with self._lock:
+                self._prune(pid)
+                self._open.append((pid, threading.current_thread(), location, conn))
+        return entry[2]
+
+    def _prune(self, pid):
+        """Close the connections of threads that have exited, and forget
+        connections inherited through ``fork`` (without closing them, as
+        they belong to the parent).
+        """
+        kept = []
+        for item in self._open:
+            itemPid, thread, location, conn = item
+            if itemPid != pid:
+                continue
+            if thread.is_alive():
+                kept.append(item)
+            else:
+                conn.close()
+        self._open = kept
+
+    def close(self, location):
+        """Close the connections of all threads of this process to a file.
+
+        Threads that use the file again get a new connection.
+        """
+        pid = os.getpid()
+        with self._lock:
+            self._generations[location] = self._generations.get(location, 0) + 1
+            self._prune(pid)
+            kept = []
+            for item in self._open:
+                if item[2] == location:
+                    item[3].close()
+                else:
+                    kept.append(item)
+            self._open = kept
+
+    def __len__(self):
+        """Return the number of open connections of this process."""
+        with self._lock:
+            return sum(1 for item in self._open if item[0] == os.getpid())
+
+
+_pool = _ConnectionPool()
+
+
+class PooledSqliteRegistry(dafPersist.Registry):
+    """A read-only SQLite registry that shares one connection per thread
+    and reuses prepared statements.
+
+    This is a drop-in replacement for `lsst.daf.persistence.SqliteRegistry`
+    for registries that are only read, selected with
+    ``TestMapper(registryMode="pooled")``.
+
+    Parameters
+    ----------
+    location : `str`
+        Path to the registry file.
+    cachedStatements : `int`, optional
+        Number of prepared statements to keep per connection.
+
+    Notes
+    -----
+    The SQL text for a given combination of returned columns, tables and
+    constrained keys is built once and memoized, so repeated lookups hit
+    the prepared statement cache of the `sqlite3` connection instead of
+    re-parsing the query.
+    """
+    placeHolder = "?"
+
+    def __init__(self, location, cachedStatements=256):
+        self.root = location
+        self.cachedStatements = cachedStatements
+        self._sqlCache = {}
+
+    def __repr__(self):
+        return "PooledSqliteRegistry(%r)" % (self.root,)
+
+    @property
+    def conn(self):
+        """The read-only connection for the calling thread
+        (`sqlite3.Connection`).
+        """
+        return _pool.get(self.root, self.cachedStatements)
+
+    def close(self):
+        """Close the connections of all threads to the registry file,
+        including those shared with other `PooledSqliteRegistry` instances,
+        which open new ones if used again.
+        """
+        _pool.close(self.root)
+
+    def lookup(self, lookupProperties, reference, dataId, **kwargs):
+        """Perform a lookup in the registry.
+
+        Parameters
+        ----------
+        lookupProperties : `list` of `str`
+            Columns to return.
+        reference : `str` or `list` of `str`
+            Table(s) to query; several tables are natural-joined.
+        dataId : `dict`
+            Constraints. A `tuple` key ``(low, high)`` requests that the
+            value lie between columns ``low`` and ``high``.
+
+        Returns
+        -------
+        rows : `list` of `tuple`
+            Distinct rows of ``lookupProperties`` values.
+        """
+        if isinstance(reference, str):
+            reference = (reference,)
+        keys = tuple(dataId.keys()) if dataId else ()
+        sqlKey = (tuple(lookupProperties), tuple(reference), keys)
+        cmd = self._sqlCache.get(sqlKey)
+        if cmd is None:
+            cmd = self._makeSelect(*sqlKey)
+            self._sqlCache[sqlKey] = cmd
+        values = [dataId[k] for k in keys]
+        return self.conn.execute(cmd, values).fetchall()
+
+    def executeQuery(self, returnFields, joinClause, whereFields, range, values):
+        """Extract metadata from the registry.
+
+        Parameters
+        ----------
+        returnFields : `list` of `str`
+            Columns to return.
+        joinClause : `list` of `str`
+            Tables to natural-join.
+        whereFields : `list` of `tuple`
+            ``(column, value)`` pairs; the value is ignored and taken from
+            ``values`` instead.
+        range : `tuple` or `None`
+            ``(value, lowColumn, highColumn)`` range constraint.
+        values : `list`
+            Values for ``whereFields`` and ``range``, in that order.
+
+        Returns
+        -------
+        rows : `list` of `tuple`
+            Distinct matching rows.
+        """
+        keys = [field[0] for field in whereFields]
+        if range is not None:
+            keys.append((range[1], range[2]))
+        sqlKey = (tuple(returnFields), tuple(joinClause), tuple(keys))
+        cmd = self._sqlCache.get(sqlKey)
+        if cmd is None:
+            cmd = self._makeSelect(*sqlKey)
+            self._sqlCache[sqlKey] = cmd
+        return self.conn.execute(cmd, values).fetchall()
+
+    def _makeSelect(self, columns, tables, keys):
+        cmd = "SELECT DISTINCT " + ", ".join(columns) + " FROM " + " NATURAL JOIN ".join(tables)
+        whereList = []
+        for key in keys:
+            if isinstance(key, tuple):
+                if len(key) != 2:
+                    raise RuntimeError("Wrong number of keys for range: %s" % (key,))
+                whereList.append("(%s BETWEEN %s AND %s)" % (self.placeHolder, key[0], key[1]))
+            else:
+                whereList.append("%s = %s" % (key, self.placeHolder))
+        if whereList:
+            cmd += " WHERE " + " AND ".join(whereList)
+        return cmd
@@ -0,0 +1,394 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["RegistryVersion", "RegistrySnapshot"]
+
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+import lsst.daf.persistence as dafPersist
+from .calibValidity import isoToMjd
+
+_NumericLiteral = re.compile(r"^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$")
+
+
+def _getAffinity(declaredType):
+    """Return the SQLite type affinity of a declared column type."""
+    declaredType = (declaredType or "").upper()
+    if "INT" in declaredType:
+        return "INTEGER"
+    if any(name in declaredType for name in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if not declaredType or "BLOB" in declaredType:
+        return "BLOB"
+    if any(name in declaredType for name in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+def _applyAffinity(value, affinity):
+    """Convert a value compared with a column the way SQLite does.
+
+    A number compared with a TEXT column is compared as text, and text that
+    looks like a number compared with a numeric column is compared as a
+    number, so that e.g. ``visit='3'`` matches ``visit=3``.
+    """
+    if affinity == "TEXT":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+    elif affinity in ("INTEGER", "REAL", "NUMERIC"):
+        if isinstance(value, str) and _NumericLiteral.match(value):
+            number = float(value)
+            if affinity != "REAL" and number.is_integer():
+                return int(number)
+            return number
+    return value
+
+
+class _TableSnapshot:
+    """Columns of one table (or natural join of tables) held as NumPy arrays.
+
+    Parameters
+    ----------
+    names : `list` of `str`
+        Column names.
+    rows : `list` of `tuple`
+        Table rows.
+    affinities : `dict` [`str`, `str`], optional
+        SQLite type affinity of each column; values compared with a column
+        are converted to its affinity.
+    """
+
+    def __init__(self, names, rows, affinities=None):
+        self.names = names
+        self.affinities = affinities or {}
+        self.numRows = len(rows)
+        self.columns = {}
+        for name, values in zip(names, zip(*rows) if rows else [()] * len(names)):
+            column = np.array(values)
+            if column.dtype.kind not in "iufb":
+                column = np.array(values, dtype=object)
+            self.columns[name] = column
+        self._indexes = {}
+        self._distinct = {}
+        self._mjdColumns = {}
+        self._lock = threading.Lock()
+
+    def getMjdColumn(self, name):
+        """Return a text date column converted to MJD, or `None` if the
+        column holds values that are not dates.
+        """
+        if name not in self._mjdColumns:
+            column = self.columns[name]
+            mjd = None
+            if column.dtype == object and all(isinstance(v, str) for v in column):
+                mjd = np.array([isoToMjd(v) for v in column], dtype=float)
+                if np.isnan(mjd).any():
+                    mjd = None
+            self._mjdColumns[name] = mjd
+        return self._mjdColumns[name]
+
+    def getIndex(self, keys):
+        """Return a hash index on the given columns.
+
+        Parameters
+        ----------
+        keys : `tuple` of `str`
+            Column names.
+
+        Returns
+        -------
+        index : `dict`
+            Mapping of a `tuple` of column values to a `numpy.ndarray` of
+            row numbers.
+        """
+        index = self._indexes.get(keys)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(keys)
+                if index is None:
+                    rowLists = {}
+                    columns = [self.columns[key].tolist() for key in keys]
+                    for row, value in enumerate(zip(*columns)):
+                        rowLists.setdefault(value, []).append(row)
+                    index = {value: np.array(rows, dtype=np.int64) for value, rows in rowLists.items()}
+                    self._indexes[keys] = index
+        return index
+
+    def getDistinctIndex(self, properties, keys):
+        """Return the distinct values of some columns for each combination
+        of values of other columns.
+
+        Parameters
+        ----------
+        properties : `tuple` of `str`
+            Columns whose values are returned.
+        keys : `tuple` of `str`
+            Columns that are constrained.
+
+        Returns
+        -------
+        index : `dict`
+            Mapping of a `tuple` of ``keys`` values to a `list` of distinct
+            `tuple` of ``properties`` values, in table order.
+        """
+        cacheKey = (properties, keys)
+        index = self._distinct.get(cacheKey)
+        if index is None:
+            with self._lock:
+                index = self._distinct.get(cacheKey)
+                if index is None:
+                    index = {}
+                    keyColumns = [self.columns[key].tolist() for key in keys]
+                    valueColumns = [self.columns[p].tolist() for p in properties]
+                    for key, value in zip(zip(*keyColumns) if keys else itertools.repeat(()),
+                                          zip(*valueColumns)):
+                        index.setdefault(key, {})[value] = None
+                    index = {key: list(values) for key, values in index.items()}
+                    self._distinct[cacheKey] = index
+        return index
+
+    def select(self, properties, dataId):
+        """Return distinct values of ``properties`` for rows matching
+        ``dataId``, in table order.
+        """
+        dataId = {key: value if isinstance(key, tuple) else _applyAffinity(value, self.affinities.get(key))
+                  for key, value in dataId.items()}
+        if not any(isinstance(key, tuple) for key in dataId):
+            keys = tuple(sorted(dataId))
+            index = self.getDistinctIndex(tuple(properties), keys)
+            return list(index.get(tuple(dataId[key] for key in keys), ()))
+        equalKeys = tuple(sorted(k for k in dataId if not isinstance(k, tuple)))
+        if equalKeys:
+            rows = self.getIndex(equalKeys).get(tuple(dataId[k] for k in equalKeys))
+            if rows is None:
+                return []
+        else:
+            rows = np.arange(self.numRows)
+        for key, value in dataId.items():
+            if not isinstance(key, tuple):
+                continue
+            if len(key) != 2:
+                raise RuntimeError("Wrong number of keys for range: %s" % (key,))
+            lowMjd = self.getMjdColumn(key[0])
+            highMjd = self.getMjdColumn(key[1])
+            valueMjd = isoToMjd(value) if isinstance(value, str) else float("nan")
+            if lowMjd is not None and highMjd is not None and not np.isnan(valueMjd):
+                # Validity ranges: compare as numbers, not text.
+                inRange = (lowMjd[rows] <= valueMjd) & (valueMjd <= highMjd[rows])
+            else:
+                low = self.columns[key[0]][rows]
+                high = self.columns[key[1]][rows]
+                inRange = np.fromiter((lo is not None and hi is not None and lo <= value <= hi
+                                       for lo, hi in zip(low, high)), dtype=bool, count=len(rows))
+            rows = rows[inRange]
+        values = [self.columns[p][rows].tolist() for p in properties]
+        return list(dict.fromkeys(zip(*values)))
+
+
+class RegistryVersion:
+    """Detect changes to an SQLite registry file.
+
+    In WAL mode a commit made while another connection is open goes to the
+    ``-wal`` file and leaves the modification time and size of the
+    registry file alone, so the version combines the ``stat`` of both
+    files with ``PRAGMA data_version`` of a connection kept open for the
+    purpose, which changes whenever another connection commits.
+
+    Parameters
+    ----------
+    location : `str`
+        Path to the registry file.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self._conn = None
+        self._key = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "RegistryVersion(%r)" % (self.location,)
+
+    def get(self):
+        """Return the current version of the registry.
+
+        Returns
+        -------
+        version : `tuple`
+            Value that differs whenever the registry contents may have
+            changed.
+        """
+        st = os.stat(self.location)
+        try:
+            walStat = os.stat(self.location + "-wal")
+            wal = (walStat.st_mtime_ns, walStat.st_size)
+        except FileNotFoundError:
+            wal = None
+        key = (os.getpid(), st.st_dev, st.st_ino)
+        with self._lock:
+            if self._key != key:
+                if self._key is not None and self._key[0] == key[0]:
+                    self._conn.close()
+                # A connection inherited across fork must not be used, or
+                # closed, by the child; it is simply dropped.
+                uri = "file:%s?mode=ro" % (urllib.parse.quote(os.path.abspath(self.location)),)
+                self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                self._key = key
+            dataVersion = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size, wal, dataVersion)
+
+    def close(self):
+        """Close the connection used to read the data version."""
+        with self._lock:
+            if self._key is not None and self._key[0] == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._key = None
+
+
+class RegistrySnapshot(dafPersist.Registry):
+    """A read-only, in-memory copy of an SQLite registry.
+
+    Tables are loaded into NumPy arrays the first time they are queried and
+    lookups are answered from hash indexes on the constrained columns,
+    such as (visit, filter), without going back to SQLite. Selected with
+    ``TestMapper(registryMode="snapshot")``.
+
+    Parameters
+    ----------
+    location : `str`
+        Path to the registry file.
+    checkInterval : `float`, optional
+        Minimum time (sec) between checks of the registry for changes (see
+        `RegistryVersion`); the snapshot is discarded and reloaded when it
+        changes. Use 0 to check on every lookup.
+    """
+
+    def __init__(self, location, checkInterval=1.0):
+        self.root = location
+        self.checkInterval = checkInterval
+        self._tables = {}
+        self._version = RegistryVersion(location)
+        self._stamp = None
+        self._nextCheck = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "RegistrySnapshot(%r)" % (self.root,)
+
+    def _checkStamp(self):
+        """Discard loaded tables if the registry has changed."""
+        now = time.monotonic()
+        if now < self._nextCheck:
+            return
+        self._nextCheck = now + self.checkInterval
+        stamp = self._version.get()
+        if stamp != self._stamp:
+            with self._lock:
+                self._tables = {}
+                self._stamp = stamp
+
+    def close(self):
+        """Discard loaded tables and close the connection used to detect
+        changes to the registry.
+        """
+        with self._lock:
+            self._tables = {}
+            self._stamp = None
+        self._version.close()
+
+    def getTable(self, reference):
+        """Return the snapshot of a table or a natural join of tables.
+
+        Parameters
+        ----------
+        reference : `str` or `list` of `str`
+            Table name(s).
+
+        Returns
+        -------
+        table : `_TableSnapshot`
+            Columnar copy of the table contents.
+        """
+        if isinstance(reference, str):
+            reference = (reference,)
+        reference = tuple(reference)
+        self._checkStamp()
+        table = self._tables.get(reference)
+        if table is None:
+            with self._lock:
+                table = self._tables.get(reference)
+                if table is None:
+                    table = self._loadTable(reference)
+                    self._tables[reference] = table
+        return table
+
+    def _loadTable(self, reference):
+        uri = "file:%s?mode=ro" % (urllib.parse.quote(os.path.abspath(self.root)),)
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            cursor = conn.execute("SELECT * FROM " + " NATURAL JOIN ".join(reference))
+            names = [desc[0] for desc in cursor.description]
+            rows = cursor.fetchall()
+            affinities = {}
+            for table in reference:
+                for column in conn.execute("PRAGMA table_info(%s)" % (table,)):
+                    affinities.setdefault(column[1], _getAffinity(column[2]))
+            return _TableSnapshot(names, rows, affinities)
+        finally:
+            conn.close()
+
+    def lookup(self, lookupProperties, reference, dataId, **kwargs):
+        """Perform a lookup in the snapshot.
+
+        Parameters
+        ----------
+        lookupProperties : `list` of `str`
+            Columns to return.
+        reference : `str` or `list` of `str`
+            Table(s) to query; several tables are natural-joined.
+        dataId : `dict`
+            Constraints. A `tuple` key ``(low, high)`` requests that the
+            value lie between columns ``low`` and ``high``.
+
+        Returns
+        -------
+        rows : `list` of `tuple`
+            Distinct rows of ``lookupProperties`` values.
+        """
+        return self.getTable(reference).select(lookupProperties, dataId or {})
+
+    def executeQuery(self, returnFields, joinClause, whereFields, range, values):
+        """Extract metadata from the snapshot; see
+        `PooledSqliteRegistry.executeQuery`.
+        """
+        dataId = dict(zip([field[0] for field in whereFields], values))
+        if range is not None:
+            dataId[(range[1], range[2])] = values[len(whereFields)]
+        return self.lookup(returnFields, joinClause, dataId)
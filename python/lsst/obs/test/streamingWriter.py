@@ -0,0 +1,312 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["StreamingExposureWriter", "formatFitsHeader"]
+
+import os
+import tempfile
+
+import numpy as np
+
+from .fitsWriter import _setDefaultMode
+
+FitsBlockSize = 2880
+"""Size (bytes) of a FITS block; headers and data are padded to it."""
+
+CardLength = 80
+"""Length (bytes) of a FITS header card."""
+
+ImageTypes = {
+    # dtype: (BITPIX, big-endian dtype, BZERO)
+    np.dtype(np.int16): (16, ">i2", None),
+    np.dtype(np.uint16): (16, ">i2", 32768),
+    np.dtype(np.int32): (32, ">i4", None),
+    np.dtype(np.int64): (64, ">i8", None),
+    np.dtype(np.float32): (-32, ">f4", None),
+    np.dtype(np.float64): (-64, ">f8", None),
+}
+"""FITS representation of each supported image pixel type."""
+
+MaskType = np.dtype(np.int32)
+"""Pixel type of the mask plane, as in `lsst.afw.image.Mask`."""
+
+VarianceType = np.dtype(np.float32)
+"""Pixel type of the variance plane, as in `lsst.afw.image.MaskedImage`."""
+
+StructuralKeys = frozenset(["SIMPLE", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "EXTEND", "XTENSION",
+                            "PCOUNT", "GCOUNT", "BZERO", "BSCALE", "EXTNAME", "EXTTYPE", "INHERIT", "END"])
+"""Keys written by `StreamingExposureWriter` that are not taken from the
+metadata.
+"""
+
+
+def _formatValue(value):
+    """Format the value of a header card, as a fixed-format value where
+    possible.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (bool, np.bool_)):
+        return "%20s" % ("T" if value else "F",)
+    if isinstance(value, (int, np.integer)):
+        return "%20d" % (value,)
+    if isinstance(value, (float, np.floating)):
+        text = repr(float(value)).upper()
+        if text in ("NAN", "INF", "-INF"):
+            raise ValueError("Cannot write non-finite value %s to a FITS header" % (text,))
+        if "." not in text and "E" not in text:
+            text += "."
+        return "%20s" % (text,)
+    text = str(value).replace("'", "''")
+    return "'%-8s'" % (text,)
+
+
+def _formatCard(key, value, comment=None):
+    """Format one header card; long COMMENT and HISTORY cards are split.
+
+    Keys longer than 8 characters or containing characters other than
+    upper-case letters, digits, "-" and "_" use the HIERARCH convention.
+    """
+    if key in ("COMMENT", "HISTORY"):
+        text = "" if value is None else str(value)
+        width = CardLength - 8
+        return ["%-8s%s" % (key, text[i:i + width]) for i in range(0, max(len(text), 1), width)]
+    isStandard = len(key) <= 8 and all(c.isdigit() or c.isupper() or c in "-_" for c in key)
+    prefix = "%-8s= " % (key,) if isStandard else "HIERARCH %s = " % (key,)
+    card = prefix + _formatValue(value)
+    if comment:
+        card += " / " + comment
+    if len(card) > CardLength:
+        if len(prefix + _formatValue(value)) > CardLength:
+            raise ValueError("Value of %s is too long for a FITS header card" % (key,))
+        card = card[:CardLength]
+    return [card]
+
+
+def formatFitsHeader(cards):
+    """Format a FITS header.
+
+    Parameters
+    ----------
+    cards : iterable of `tuple`
+        ``(key, value, comment)`` of each card, in order; ``comment`` may be
+        `None`. The END card and padding are added.
+
+    Returns
+    -------
+    header : `bytes`
+        The header, a whole number of FITS blocks.
+    """
+    lines = []
+    for key, value, comment in cards:
+        lines += _formatCard(key, value, comment)
+    lines.append("END")
+    text = "".join("%-80s" % (line,) for line in lines)
+    text += " " * (-len(text) % FitsBlockSize)
+    return text.encode("ascii")
+
+
+def _metadataCards(metadata):
+    """Return the cards of a PropertyList (or `dict`), without the
+    structural keys.
+    """
+    if metadata is None:
+        return []
+    cards = []
+    if isinstance(metadata, dict):
+        items = [(key, value, None) for key, value in metadata.items()]
+    else:
+        names = metadata.getOrderedNames() if hasattr(metadata, "getOrderedNames") \
+            else metadata.names(False)
+        items = []
+        for name in names:
+            comment = metadata.getComment(name) if hasattr(metadata, "getComment") else None
+            values = [None] if metadata.isUndefined(name) else metadata.getArray(name)
+            items += [(name, value, comment) for value in values]
+    for key, value, comment in items:
+        if key in StructuralKeys:
+            continue
+        if isinstance(value, (list, tuple)):
+            cards += [(key, v, comment) for v in value]
+        else:
+            cards.append((key, value, comment))
+    return cards
+
+
+def _xy0Cards(xy0):
+    """Cards giving the origin of an image, as written by afw."""
+    x0, y0 = xy0
+    return [
+        ("CRPIX1A", 1.0, None), ("CRPIX2A", 1.0, None),
+        ("CRVAL1A", float(x0), None), ("CRVAL2A", float(y0), None),
+        ("CTYPE1A", "LINEAR", None), ("CTYPE2A", "LINEAR", None),
+        ("CUNIT1A", "PIXEL", None), ("CUNIT2A", "PIXEL", None),
+        ("WCSNAMEA", "A", None),
+        ("LTV1", -int(x0), None), ("LTV2", -int(y0), None),
+    ]
+
+
+class StreamingExposureWriter:
+    """Write an Exposure to a FITS file in blocks of rows.
+
+    The file has the layout written by `lsst.afw.image.Exposure.writeFits`
+    for an exposure with no WCS, PSF or other archived components: an
+    empty primary HDU holding the metadata, then the image, mask and
+    variance HDUs. Every header and the offset of every HDU are computed
+    up front, so rows can be written in any order as they are produced,
+    holding only one block in memory. The file is created at its final
+    size, so padding and anything never written (e.g. the mask and
+    variance, if not given) read as zero without being written, and it
+    is written under a temporary name and renamed into place by `close`.
+
+    Parameters
+    ----------
+    path : `str`
+        Path of the file to write; must not be compressed.
+    width, height : `int`
+        Size of the image.
+    dtype : `numpy.dtype`, optional
+        Pixel type of the image; a key of `ImageTypes`. The default,
+        int32, is that of `lsst.afw.image.ExposureI`.
+    metadata : `lsst.daf.base.PropertyList` or `dict`, optional
+        Metadata of the exposure, written to the primary header.
+    xy0 : `tuple` of `int`, optional
+        Origin (x0, y0) of the image.
+    maskPlanes : `dict` [`str`, `int`], optional
+        Bit of each mask plane, e.g. from
+        ``lsst.afw.image.Mask.getMaskPlaneDict()``.
+
+    Examples
+    --------
+    >>> with StreamingExposureWriter(path, 4096, 4096) as writer:
+    ...     for y in range(0, 4096, 256):
+    ...         writer.writeRows(y, makeBlock(y, 256))
+    """
+
+    def __init__(self, path, width, height, dtype=np.int32, metadata=None, xy0=(0, 0), maskPlanes=None):
+        if path.endswith((".gz", ".fz")):
+            raise ValueError("Cannot stream to compressed file %s" % (path,))
+        dtype = np.dtype(dtype)
+        if dtype not in ImageTypes:
+            raise TypeError("Unsupported pixel type %s; must be one of %s" % (dtype, list(ImageTypes)))
+        self.path = path
+        self.width = width
+        self.height = height
+        self.dtype = dtype
+
+        primary = formatFitsHeader([("SIMPLE", True, "conforms to FITS standard"),
+                                    ("BITPIX", 8, None), ("NAXIS", 0, None), ("EXTEND", True, None)]
+                                   + _metadataCards(metadata))
+        maskCards = [("MP_%s" % (name,), bit, None) for name, bit in sorted((maskPlanes or {}).items(),
+                                                                            key=lambda item: item[1])]
+        planes = [("IMAGE", dtype, []), ("MASK", MaskType, maskCards), ("VARIANCE", VarianceType, [])]
+        self._planes = {}
+        self._headers = [(0, primary)]
+        offset = len(primary)
+        for extName, planeType, extraCards in planes:
+            bitpix, fileType, bzero = ImageTypes[planeType]
+            cards = [("XTENSION", "IMAGE", "IMAGE extension"), ("BITPIX", bitpix, None), ("NAXIS", 2, None),
+                     ("NAXIS1", width, None), ("NAXIS2", height, None), ("PCOUNT", 0, None),
+                     ("GCOUNT", 1, None)]
+            if bzero is not None:
+                cards += [("BZERO", bzero, None), ("BSCALE", 1, None)]
+            cards += [("EXTNAME", extName, None), ("EXTTYPE", extName, None), ("INHERIT", True, None)]
+            header = formatFitsHeader(cards + _xy0Cards(xy0) + extraCards)
+            self._headers.append((offset, header))
+            dataOffset = offset + len(header)
+            dataSize = width*height*np.dtype(fileType).itemsize
+            self._planes[extName] = (dataOffset, np.dtype(fileType), bzero)
+            offset = dataOffset + dataSize + (-dataSize % FitsBlockSize)
+        self.size = offset
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tempPath = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".fits")
+        self._file = os.fdopen(fd, "r+b")
+        try:
+            _setDefaultMode(fd)
+            # Truncating up leaves a sparse file of zeros: the padding
+            # (which may be zero for data) is never written.
+            self._file.truncate(self.size)
+            for headerOffset, header in self._headers:
+                self._file.seek(headerOffset)
+                self._file.write(header)
+        except Exception:
+            self.abort()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writeRows(self, y, image, mask=None, variance=None):
+        """Write a block of rows.
+
+        Parameters
+        ----------
+        y : `int`
+            First row of the block, relative to the origin of the image
+            (i.e. 0 for the first row, whatever ``xy0``).
+        image : `numpy.ndarray`
+            Pixels of the block, shape (rows, width).
+        mask, variance : `numpy.ndarray`, optional
+            Mask and variance of the block, same shape; zero if not given.
+        """
+        numRows = len(image)
+        if y < 0 or y + numRows > self.height:
+            raise ValueError("Rows %d-%d are outside the image (height %d)" %
+                             (y, y + numRows - 1, self.height))
+        for extName, data in (("IMAGE", image), ("MASK", mask), ("VARIANCE", variance)):
+            if data is None:
+                continue
+            data = np.asarray(data)
+            if data.shape != (numRows, self.width):
+                raise ValueError("%s block has shape %s, not %s" %
+                                 (extName, data.shape, (numRows, self.width)))
+            dataOffset, fileType, bzero = self._planes[extName]
+            if bzero is not None:
+                data = data.astype(np.int64) - bzero
+            self._file.seek(dataOffset + y*self.width*fileType.itemsize)
+            self._file.write(np.ascontiguousarray(data, dtype=fileType).tobytes())
+
+    def close(self):
+        """Finish the file and move it into place."""
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self._tempPath, self.path)
+
+    def abort(self):
+        """Discard the file."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if os.path.exists(self._tempPath):
+            os.unlink(self._tempPath)
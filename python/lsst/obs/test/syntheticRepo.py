@@ -0,0 +1,284 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["makeSyntheticRepo"]
+
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+
+import lsst.utils
+from lsst.pipe.base import Struct
+from .calibIngest import computeValidity, ValidityUntilSuperseded, _createCalibTable
+from .registry import createRawTables, finalizeRawRegistry
+
+PixelModes = ("none", "link", "tiny")
+"""Supported values of the ``pixels`` argument of `makeSyntheticRepo`."""
+
+ShippedRaws = {"g": "raw_v1_fg.fits.gz", "r": "raw_v3_fr.fits.gz"}
+"""Raw files in ``data/input/raw`` linked for each filter; other filters
+use the g-band file.
+"""
+
+FilterNumbers = {"u": 0, "g": 1, "r": 2, "i": 3, "z": 4, "y": 5}
+
+TinyHeaderKeys = (
+    "SIMPLE", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "EXTEND", "BZERO", "BSCALE",
+    "CTYPE1", "CRPIX1", "CRVAL1", "CTYPE2", "CRPIX2", "CRVAL2", "CD1_1", "CD1_2", "CD2_1", "CD2_2",
+    "RADESYS", "EQUINOX", "OBSID", "TAI", "MJD-OBS", "EXPTIME", "DARKTIME", "FILTNM", "FILTER",
+    "RA_DEG", "DEC_DEG", "AIRMASS", "ROTANG", "ZENITH", "AZIMUTH", "PRESS", "TEMPERA",
+)
+"""Header keywords kept in "tiny" raws: the FITS structure, WCS and what
+`MakeTestRawVisitInfo` reads.
+"""
+
+TinyShape = (8, 8)
+"""Image size (x, y) of "tiny" raws."""
+
+StartMjd = 51195.2035520278
+"""TAI MJD of the first synthetic visit (that of visit 1 in ``data/input``).
+"""
+
+CalibTypes = {"bias": False, "dark": False, "flat": True, "fringe": True}
+"""Synthetic calibration types and whether each is filter dependent."""
+
+
+TaiMinusUtc = 32.0
+"""TAI-UTC (sec) from 1999 to 2005, used for all synthetic dates."""
+
+
+def _mjdToIso(mjd):
+    """Format TAI MJD as a UTC ISO-8601 date with nanoseconds, as
+    ``bin/genInputRegistry.py`` does for ``raw.taiObs``.
+    """
+    mjd -= TaiMinusUtc/86400.0
+    days = int(np.floor(mjd))
+    nsec = int(round((mjd - days)*86400e9))
+    day = np.datetime64("1858-11-17") + np.timedelta64(days, "D") + np.timedelta64(nsec, "ns")
+    return str(day)
+
+
+def _formatCard(key, value, comment=""):
+    """Format a fixed-format FITS header card."""
+    if isinstance(value, bool):
+        valueStr = "%20s" % ("T" if value else "F",)
+    elif isinstance(value, str):
+        valueStr = "%-20s" % ("'%-8s'" % (value.replace("'", "''"),),)
+    else:
+        valueStr = "%20s" % (repr(value),)
+    card = "%-8s= %s" % (key, valueStr)
+    if comment:
+        card += " / " + comment
+    return "%-80s" % (card[:80],)
+
+
+def _readPrimaryCards(path):
+    """Read the primary header of a (gzipped) FITS file.
+
+    Returns
+    -------
+    cards : `dict` [`str`, `str`]
+        80-character cards keyed by keyword, without ``COMMENT``,
+        ``HISTORY`` and ``END``.
+    """
+    cards = {}
+    with gzip.open(path, "rb") as f:
+        while True:
+            block = f.read(2880).decode("ascii")
+            for i in range(0, len(block), 80):
+                card = block[i:i + 80]
+                key = card[:8].strip()
+                if key == "END":
+                    return cards
+                if key and key not in ("COMMENT", "HISTORY"):
+                    cards[key] = card
+
+
+def _writeTinyRaw(path, cards, visit, filterName, mjd, expTime):
+    """Write a small gzipped raw whose header describes one visit."""
+    header = dict((key, cards[key]) for key in TinyHeaderKeys if key in cards)
+    header["NAXIS1"] = _formatCard("NAXIS1", TinyShape[0], "length of data axis 1")
+    header["NAXIS2"] = _formatCard("NAXIS2", TinyShape[1], "length of data axis 2")
+    header["OBSID"] = _formatCard("OBSID", visit, "synthetic visit")
+    header["TAI"] = _formatCard("TAI", mjd, "International Atomic Time scale")
+    header["MJD-OBS"] = _formatCard("MJD-OBS", mjd, "Modified Julian date (also TAI)")
+    header["EXPTIME"] = _formatCard("EXPTIME", expTime, "Exposure time")
+    header["DARKTIME"] = _formatCard("DARKTIME", expTime, "Actual Exposed time")
+    header["FILTNM"] = _formatCard("FILTNM", FilterNumbers.get(filterName, -1), "Filter number")
+    header["FILTER"] = _formatCard("FILTER", filterName, "Filter")
+    text = "".join(header.values()) + "%-80s" % ("END",)
+    text += " "*(-len(text) % 2880)
+    data = np.zeros(TinyShape[0]*TinyShape[1], dtype=">i2").tobytes()
+    data += b"\0"*(-len(data) % 2880)
+    with gzip.GzipFile(path, "wb", compresslevel=6, mtime=0) as f:
+        f.write(text.encode("ascii"))
+        f.write(data)
+
+
+def _linkFile(source, dest):
+    """Hard link ``source`` to ``dest``, falling back to a symbolic link."""
+    try:
+        os.link(source, dest)
+    except OSError:
+        os.symlink(os.path.abspath(source), dest)
+
+
+def makeSyntheticRepo(root, numVisits, filters=("g", "r"), numCalibs=10, pixels="none", seed=0,
+                      journalMode="wal"):
+    """Make an obs_test data repository with many synthetic visits.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory of the new repository; must not contain a registry.
+    numVisits : `int`
+        Number of visits, numbered from 1.
+    filters : sequence of `str`, optional
+        Filters to observe in; each visit uses one, chosen at random.
+    numCalibs : `int`, optional
+        Number of calibrations of each type (and filter, for filter
+        dependent types), spread evenly over the dates of the visits.
+    pixels : `str`, optional
+        Raw files to make:
+
+        - ``"none"``: registries only.
+        - ``"link"``: hard links (or symbolic links, across file systems)
+          to the raws in ``data/input``; pixels and headers are those of the
+          shipped visit.
+        - ``"tiny"``: 8x8 pixel raws whose headers give the visit's
+          date, filter and exposure time.
+    seed : `int`, optional
+        Random seed; the same seed gives the same repository.
+    journalMode : `str`, optional
+        SQLite journal mode of the registries; see `finalizeRawRegistry`.
+
+    Returns
+    -------
+    result : `lsst.pipe.base.Struct`
+        Result struct with components:
+
+        - ``root``: the repository (`str`).
+        - ``numVisits``: number of visits registered (`int`).
+        - ``numCalibs``: number of calibrations registered (`int`).
+        - ``timings``: elapsed time (sec) of each stage: ``registry``,
+          ``calibRegistry`` and ``pixels`` (`dict`).
+
+    Notes
+    -----
+    Visits are 15 or 30 second exposures about a minute apart, in nights
+    of 400 visits, starting at the date of visit 1 in ``data/input``.
+    Calibration files are not made, except for a copy of the shipped
+    defects when ``pixels`` is not "none".
+    """
+    if pixels not in PixelModes:
+        raise ValueError("Unsupported pixels %r; must be one of %s" % (pixels, PixelModes))
+    registryPath = os.path.join(root, "registry.sqlite3")
+    calibRegistryPath = os.path.join(root, "calibRegistry.sqlite3")
+    for path in (registryPath, calibRegistryPath):
+        if os.path.exists(path):
+            raise RuntimeError("Registry %r exists; will not overwrite" % (path,))
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "_mapper"), "w") as f:
+        f.write("lsst.obs.test.testMapper.TestMapper\n")
+
+    filters = list(filters)
+    rng = np.random.default_rng(seed)
+    visits = np.arange(1, numVisits + 1)
+    filterNames = np.asarray(filters)[rng.integers(0, len(filters), size=numVisits)]
+    expTimes = rng.choice([15.0, 30.0], size=numVisits)
+    gaps = (expTimes + rng.uniform(20.0, 60.0, size=numVisits)) / 86400.0
+    gaps[::400] += 0.6
+    gaps[0] = 0.0
+    mjds = StartMjd + np.cumsum(gaps)
+    taiObs = [_mjdToIso(mjd) for mjd in mjds.tolist()]
+    skyTiles = 85932 + rng.integers(0, 1000, size=numVisits)
+    timings = {}
+
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(registryPath)
+    try:
+        conn.execute("PRAGMA synchronous=OFF")
+        createRawTables(conn)
+        with conn:
+            conn.executemany("INSERT INTO raw VALUES (NULL, ?, ?, ?, ?)",
+                             zip(visits.tolist(), filterNames.tolist(), taiObs, expTimes.tolist()))
+            conn.executemany("INSERT INTO raw_skyTile VALUES (?, ?)",
+                             zip(visits.tolist(), skyTiles.tolist()))
+        finalizeRawRegistry(conn, journalMode=journalMode)
+    finally:
+        conn.close()
+    timings["registry"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    numCalibRows = 0
+    firstDay = int(np.floor(mjds[0])) if numVisits else int(StartMjd)
+    lastDay = int(np.floor(mjds[-1])) if numVisits else int(StartMjd)
+    calibDays = np.unique(np.linspace(firstDay, lastDay, num=max(numCalibs, 1)).astype(int))[:numCalibs]
+    calibDates = ["%sT00:00:00" % (np.datetime64("1858-11-17") + np.timedelta64(day, "D"),)
+                  for day in calibDays.tolist()]
+    conn = sqlite3.connect(calibRegistryPath)
+    try:
+        with conn:
+            for calibType, byFilter in CalibTypes.items():
+                _createCalibTable(conn, calibType)
+                rows = []
+                for filterName in (filters if byFilter else ["None"]):
+                    validStart, validEnd = computeValidity(calibDates, calibType in ValidityUntilSuperseded)
+                    rows += zip(calibDates, validStart, validEnd, [filterName]*len(calibDates))
+                conn.executemany("INSERT INTO %s (calibDate, validStart, validEnd, filter, ccd) "
+                                 "VALUES (?, ?, ?, ?, 0)" % (calibType,), rows)
+                conn.executemany("INSERT OR IGNORE INTO %s_visit VALUES (?)" % (calibType,),
+                                 [(date,) for date in calibDates])
+                numCalibRows += len(rows)
+            _createCalibTable(conn, "defects")
+            conn.execute("INSERT INTO defects (calibDate, validStart, validEnd, filter, ccd) "
+                         "VALUES ('1970-01-01T00:00:00', '1970-01-01', '2037-12-31', 'None', 0)")
+            conn.execute("INSERT INTO defects_visit VALUES ('1970-01-01T00:00:00')")
+            numCalibRows += 1
+        conn.execute("PRAGMA journal_mode=%s" % (journalMode,))
+    finally:
+        conn.close()
+    timings["calibRegistry"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if pixels != "none":
+        inputDir = os.path.join(lsst.utils.getPackageDir("obs_test"), "data", "input")
+        os.makedirs(os.path.join(root, "defects"), exist_ok=True)
+        shutil.copyfile(os.path.join(inputDir, "defects", "defects.fits"),
+                        os.path.join(root, "defects", "defects.fits"))
+        rawDir = os.path.join(root, "raw")
+        os.makedirs(rawDir, exist_ok=True)
+        if pixels == "tiny":
+            cards = _readPrimaryCards(os.path.join(inputDir, "raw", ShippedRaws["g"]))
+        for visit, filterName, mjd, expTime in zip(visits.tolist(), filterNames.tolist(), mjds.tolist(),
+                                                   expTimes.tolist()):
+            path = os.path.join(rawDir, "raw_v%d_f%s.fits.gz" % (visit, filterName))
+            if pixels == "link":
+                _linkFile(os.path.join(inputDir, "raw", ShippedRaws.get(filterName, ShippedRaws["g"])), path)
+            else:
+                _writeTinyRaw(path, cards, visit, filterName, mjd, expTime)
+    timings["pixels"] = time.perf_counter() - t0
+
+    return Struct(root=root, numVisits=numVisits, numCalibs=numCalibRows, timings=timings)
@@ -0,0 +1,642 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["StreamingTaskRunner", "WarmButlerTaskRunner", "DynamicTaskRunner", "SpilledResultList",
+           "iterTaskResults"]
+
+import collections.abc
+import copy
+import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+import time
+
+import lsst.daf.persistence as dafPersist
+import lsst.pipe.base as pipeBase
+from lsst.base import disableImplicitThreading
+from lsst.pipe.base.cmdLineTask import profile
+from .listingCache import getButlerRepositories
+
+# State of a pool worker: (task runner, butler), set by _initWorker.
+_workerState = None
+
+
+def _initWorker(runner, butler=None):
+    """Initialize a pool worker with a task runner and a butler.
+
+    With the "fork" start method the arguments are inherited rather than
+    pickled; otherwise they are unpickled once per worker, and the
+    butler's mapper (policy, camera and registry) is built once.
+    """
+    global _workerState
+    _workerState = (runner, butler)
+
+
+def _runTarget(target):
+    """Run a task on one data ID in a pool worker.
+
+    Parameters
+    ----------
+    target : `tuple`
+        ``(index, datasetType, level, dataId, kwargs)``.
+
+    Returns
+    -------
+    index : `int`
+        Index of the target, as given.
+    result : `lsst.pipe.base.Struct`
+        Result of `lsst.pipe.base.TaskRunner.__call__`, without the data
+        reference, which the parent process restores.
+    """
+    index, datasetType, level, dataId, kwargs = target
+    runner, butler = _workerState
+    dataRef = butler.dataRef(datasetType, level=level, dataId=dataId)
+    result = runner((dataRef, kwargs))
+    if getattr(result, "dataRef", None) is not None:
+        result.dataRef = None
+    return index, result
+
+
+def _runTimedTarget(indexedTarget):
+    """Run a task on one target in a pool worker, timing it.
+
+    Parameters
+    ----------
+    indexedTarget : `tuple`
+        ``(index, target)``, where ``target`` is an item of
+        ``TaskRunner.getTargetList``.
+
+    Returns
+    -------
+    index : `int`
+        Index of the target, as given.
+    pid : `int`
+        Process ID of the worker.
+    startTime, endTime : `float`
+        Wall clock time (sec) when the target started and finished.
+    result : `lsst.pipe.base.Struct`
+        Result of `lsst.pipe.base.TaskRunner.__call__`.
+    """
+    index, target = indexedTarget
+    runner = _workerState[0]
+    startTime = time.time()
+    result = runner(target)
+    return index, os.getpid(), startTime, time.time(), result
+
+
+def _iterPool(numProcesses, initargs, func, items, maxInFlight, timeout=None):
+    """Call a function on items in a pool of workers, yielding the return
+    values in completion order.
+
+    At most ``maxInFlight`` items are submitted but not yet consumed, so
+    at most that many return values are held in memory however slowly
+    they are consumed.
+
+    Parameters
+    ----------
+    numProcesses : `int`
+        Number of worker processes.
+    initargs : `tuple`
+        Arguments for `_initWorker`.
+    func : callable
+        Function to call on each item; must be picklable.
+    items : iterable
+        Arguments for ``func``; each must be picklable.
+    maxInFlight : `int`
+        Maximum number of items submitted but not yet consumed.
+    timeout : `float`, optional
+        Maximum time (sec) to wait for each return value.
+    """
+    returned = queue.Queue()
+    items = iter(items)
+    pool = multiprocessing.Pool(processes=numProcesses, initializer=_initWorker, initargs=initargs)
+    completed = False
+    try:
+        numPending = 0
+        exhausted = False
+        while True:
+            while not exhausted and numPending < maxInFlight:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pool.apply_async(func, (item,), callback=lambda value: returned.put((True, value)),
+                                 error_callback=lambda exc: returned.put((False, exc)))
+                numPending += 1
+            if numPending == 0:
+                break
+            try:
+                ok, value = returned.get(timeout=timeout)
+            except queue.Empty:
+                raise multiprocessing.TimeoutError("No result within %s sec" % (timeout,))
+            numPending -= 1
+            if not ok:
+                raise value
+            yield value
+        completed = True
+    finally:
+        if completed:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+
+class SpilledResultList(collections.abc.Sequence):
+    """A fixed-length list of task results that keeps at most a given
+    number in memory and pickles the rest to a temporary file.
+
+    Parameters
+    ----------
+    length : `int`
+        Number of results; unset entries are `None`.
+    maxInMemory : `int`
+        Maximum number of results held in memory; the oldest are spilled
+        to disk first.
+    directory : `str`, optional
+        Directory for the spill file; the default temporary directory if
+        `None`. The file is deleted by `close` or when the list is garbage
+        collected.
+    dataRefs : sequence, optional
+        Data reference of each result, e.g. the first item of each target.
+        A result whose ``dataRef`` is the one given here is spilled
+        without it (pickling a data reference pickles its butler) and
+        gets it back when read.
+    """
+
+    def __init__(self, length, maxInMemory, directory=None, dataRefs=None):
+        self._length = length
+        self.maxInMemory = maxInMemory
+        self.directory = directory
+        self.dataRefs = dataRefs
+        self._inMemory = collections.OrderedDict()
+        self._spilled = {}
+        self._file = None
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        index = self._checkIndex(index)
+        if index in self._inMemory:
+            return self._inMemory[index]
+        if index in self._spilled:
+            offset, size, strippedDataRef = self._spilled[index]
+            self._file.seek(offset)
+            value = pickle.loads(self._file.read(size))
+            if strippedDataRef:
+                value.dataRef = self.dataRefs[index]
+            return value
+        return None
+
+    def __setitem__(self, index, value):
+        index = self._checkIndex(index)
+        self._spilled.pop(index, None)
+        self._inMemory.pop(index, None)
+        self._inMemory[index] = value
+        while len(self._inMemory) > self.maxInMemory:
+            self._spill(*self._inMemory.popitem(last=False))
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def numSpilled(self):
+        """Number of results held on disk (`int`)."""
+        return len(self._spilled)
+
+    def _checkIndex(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("Index %s out of range for %d results" % (index, self._length))
+        return index
+
+    def _spill(self, index, value):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self.directory, prefix="results-")
+        dataRef = getattr(value, "dataRef", None)
+        strippedDataRef = dataRef is not None and self.dataRefs is not None and \
+            dataRef is self.dataRefs[index]
+        if strippedDataRef:
+            value = copy.copy(value)
+            value.dataRef = None
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.seek(0, os.SEEK_END)
+        self._spilled[index] = (self._file.tell(), len(data), strippedDataRef)
+        self._file.write(data)
+
+    def close(self):
+        """Delete the spill file; results on disk are lost."""
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+            self._file = None
+            self._spilled = {}
+
+
+class StreamingTaskRunner(pipeBase.TaskRunner):
+    """Base for task runners that stream results as targets complete.
+
+    `iterResults` yields the result of each target as soon as it is
+    available, in completion order; this base class runs targets serially
+    and subclasses use pools of workers. `run` collects the results in
+    target order, holding at most ``maxResultsInMemory`` of them in memory
+    if that is set (see `SpilledResultList`). Use `iterTaskResults` to
+    consume results as they arrive instead.
+    """
+
+    maxInFlight = None
+    """Maximum number of targets submitted to workers but whose results
+    have not been consumed; twice the number of processes if `None`.
+    """
+
+    maxResultsInMemory = None
+    """Maximum number of results ``run`` holds in memory; more are pickled
+    to a file in ``spillDir``. All are held in memory if `None`.
+    """
+
+    spillDir = None
+    """Directory for results spilled by ``run``; the default temporary
+    directory if `None`.
+    """
+
+    def run(self, parsedCmd):
+        """Run the task on all targets.
+
+        Parameters
+        ----------
+        parsedCmd : `argparse.Namespace`
+            Parsed command line.
+
+        Returns
+        -------
+        resultList : `list` or `SpilledResultList`
+            Result of `lsst.pipe.base.TaskRunner.__call__` for each target,
+            in the order of ``getTargetList``.
+        """
+        resultList = []
+        targetList = self.getTargetList(parsedCmd)
+        log = parsedCmd.log
+        if self.prepareToStream(parsedCmd):
+            profileName = parsedCmd.profile if hasattr(parsedCmd, "profile") else None
+            if len(targetList) > 0:
+                with profile(profileName, log):
+                    dataRefs = [target[0] if isinstance(target, tuple) and target else None
+                                for target in targetList]
+                    resultList = self.makeResultList(len(targetList), dataRefs)
+                    for index, result in self.iterResults(targetList):
+                        resultList[index] = result
+            else:
+                log.warn("Not running the task because there is no data to process; "
+                         "you may preview data using \"--show data\"")
+        return resultList
+
+    def prepareToStream(self, parsedCmd):
+        """Prepare to run targets, as `lsst.pipe.base.TaskRunner.run`
+        does.
+
+        Returns
+        -------
+        ok : `bool`
+            Result of ``precall``; if `False` no targets should be run.
+        """
+        disableImplicitThreading()
+        if self.numProcesses > 1:
+            self.prepareForMultiProcessing()
+        return self.precall(parsedCmd)
+
+    def makeResultList(self, length, dataRefs=None):
+        """Make a container for the results of ``length`` targets, whose
+        data references (the first item of each target) are ``dataRefs``.
+        """
+        if self.maxResultsInMemory is None:
+            return [None]*length
+        return SpilledResultList(length, self.maxResultsInMemory, directory=self.spillDir, dataRefs=dataRefs)
+
+    def getMaxInFlight(self):
+        """Return the maximum number of targets submitted to workers whose
+        results have not been consumed.
+        """
+        return self.maxInFlight if self.maxInFlight is not None else 2*self.numProcesses
+
+    def iterResults(self, targetList):
+        """Run the task on targets, yielding results as they complete.
+
+        Parameters
+        ----------
+        targetList : `list`
+            Targets, as returned by ``getTargetList``.
+
+        Yields
+        ------
+        index : `int`
+            Index of the target in ``targetList``.
+        result : `lsst.pipe.base.Struct`
+            Result for that target.
+        """
+        for index, target in enumerate(targetList):
+            yield index, self(target)
+
+
+class WarmButlerTaskRunner(StreamingTaskRunner):
+    """Task runner whose pool workers each keep one butler.
+
+    With ``-j`` greater than 1, `lsst.pipe.base.TaskRunner` pickles every
+    data reference, and with it the butler, for each call in a worker.
+    This runner starts a pool of long-lived workers that receive the
+    butler once, at startup, and then only compact targets
+    ``(index, datasetType, level, dataId, kwargs)``, from which they make
+    data references with their own butler. Results are streamed back as
+    each one completes (see `iterResults`) and ``run`` returns them in
+    target order, as the base class does.
+
+    Targets that are not `lsst.daf.persistence.ButlerDataRef` (e.g. from a
+    runner that groups data references) are pickled whole, as
+    `lsst.pipe.base.TaskRunner` does, but still streamed.
+    """
+
+    def iterResults(self, targetList):
+        """Run the task on targets in a pool of warm workers, yielding
+        results as they complete.
+
+        Parameters
+        ----------
+        targetList : `list` of `tuple`
+            ``(dataRef, kwargs)`` for each target, as returned by
+            ``getTargetList``; every ``dataRef`` must share one butler to be
+            run by warm workers.
+
+        Yields
+        ------
+        index : `int`
+            Index of the target in ``targetList``.
+        result : `lsst.pipe.base.Struct`
+            Result for that target; its ``dataRef``, if any, is the one in
+            ``targetList``.
+        """
+        if self.numProcesses <= 1:
+            yield from StreamingTaskRunner.iterResults(self, targetList)
+            return
+        if not targetList:
+            return
+        if not all(isinstance(target, tuple) and len(target) == 2
+                   and isinstance(target[0], dafPersist.ButlerDataRef) for target in targetList):
+            for index, _, _, _, result in _iterPool(self.numProcesses, (self,), _runTimedTarget,
+                                                    enumerate(targetList), self.getMaxInFlight(),
+                                                    self.timeout):
+                yield index, result
+            return
+        butler = targetList[0][0].butlerSubset.butler
+        compactTargets = ((index, dataRef.butlerSubset.datasetType, dataRef.butlerSubset.level,
+                           dict(dataRef.dataId), kwargs)
+                          for index, (dataRef, kwargs) in enumerate(targetList))
+        for index, result in _iterPool(self.numProcesses, (self, butler), _runTarget, compactTargets,
+                                       self.getMaxInFlight(), self.timeout):
+            if hasattr(result, "dataRef"):
+                result.dataRef = targetList[index][0]
+            yield index, result
+
+
+class DynamicTaskRunner(StreamingTaskRunner):
+    """Task runner that schedules targets dynamically, most expensive first.
+
+    With ``-j`` greater than 1, `lsst.pipe.base.TaskRunner` hands targets to
+    a pool in fixed chunks, so workers sit idle when some targets take much
+    longer than others. This runner keeps one pool of long-lived workers,
+    each of which takes the next target as soon as it is free, and starts
+    the targets with the highest estimated cost first (see `estimateCost`).
+    At the end it logs the utilization of each worker; the statistics are
+    kept in ``workerStats``.
+
+    It works with any ``getTargetList``, including ones whose targets
+    hold several data references; subclass this runner, or list it first
+    among the bases of an existing runner, to use it. Set ``costMethod``
+    and ``costDatasetType`` in the subclass to change the cost estimate.
+    """
+
+    costMethod = "fileSize"
+    """How to estimate the cost of a target, summed over its data
+    references: "fileSize" (size of the ``costDatasetType`` file),
+    "expTime" (exposure time in the registry) or `None` (keep the order
+    of ``getTargetList``).
+    """
+
+    costDatasetType = "raw"
+    """Dataset type used to estimate the cost of a data reference."""
+
+    def run(self, parsedCmd):
+        """Run the task on all targets.
+
+        Parameters
+        ----------
+        parsedCmd : `argparse.Namespace`
+            Parsed command line.
+
+        Returns
+        -------
+        resultList : `list` or `SpilledResultList`
+            Result of `lsst.pipe.base.TaskRunner.__call__` for each target,
+            in the order of ``getTargetList``.
+        """
+        self.workerStats = []
+        resultList = StreamingTaskRunner.run(self, parsedCmd)
+        for stats in self.workerStats:
+            parsedCmd.log.info("worker %d: %d targets, busy %.2f of %.2f sec (%.0f%%)" %
+                               (stats.pid, stats.numTargets, stats.busyTime, stats.wallTime,
+                                100*stats.utilization))
+        return resultList
+
+    def estimateCost(self, target):
+        """Estimate the relative cost of running the task on a target.
+
+        Parameters
+        ----------
+        target : `tuple`
+            An item of ``getTargetList``; data references in it, or in
+            sequences in it, are costed.
+
+        Returns
+        -------
+        cost : `float`
+            Estimated cost; 0 if it cannot be estimated.
+        """
+        return self.estimateCosts([target])[0]
+
+    def estimateCosts(self, targetList):
+        """Estimate the relative cost of running the task on each target.
+
+        With ``costMethod="fileSize"`` the files of all data references
+        that share a butler are found with one
+        `TestMapper.getUris` call, rather than one ``getUri`` each.
+
+        Parameters
+        ----------
+        targetList : `list`
+            Targets, as returned by ``getTargetList``.
+
+        Returns
+        -------
+        costs : `list` of `float`
+            Estimated cost of each target; see `estimateCost`.
+        """
+        refsByButler = {}
+        for index, target in enumerate(targetList):
+            for item in target:
+                for dataRef in item if isinstance(item, (list, tuple)) else [item]:
+                    if isinstance(dataRef, dafPersist.ButlerDataRef):
+                        butler = dataRef.butlerSubset.butler
+                        refsByButler.setdefault(id(butler), (butler, []))[1].append((index, dataRef))
+        costs = [0.0]*len(targetList)
+        for butler, refs in refsByButler.values():
+            for (index, dataRef), cost in zip(refs, self._estimateRefCosts(butler, [ref for _, ref in refs])):
+                costs[index] += cost
+        return costs
+
+    def _estimateRefCosts(self, butler, dataRefs):
+        """Return the cost of each of some data references that share a
+        butler.
+        """
+        if self.costMethod == "fileSize":
+            mapper, roots = getButlerRepositories(butler)
+            if hasattr(mapper, "getUris"):
+                try:
+                    uris = mapper.getUris(self.costDatasetType, [dataRef.dataId for dataRef in dataRefs],
+                                          roots=roots)
+                except Exception:
+                    uris = [None]*len(dataRefs)
+            else:
+                uris = []
+                for dataRef in dataRefs:
+                    try:
+                        uris.append(butler.getUri(self.costDatasetType, dataRef.dataId))
+                    except Exception:
+                        uris.append(None)
+            costs = []
+            for uri in uris:
+                try:
+                    costs.append(float(os.path.getsize(uri)) if uri is not None else 0.0)
+                except OSError:
+                    costs.append(0.0)
+            return costs
+        costs = []
+        for dataRef in dataRefs:
+            cost = 0.0
+            if self.costMethod == "expTime":
+                try:
+                    rows = butler.queryMetadata(self.costDatasetType, ["expTime"], dataRef.dataId)
+                    cost = sum(row if not isinstance(row, tuple) else row[0] for row in rows)
+                except Exception:
+                    pass
+            costs.append(cost)
+        return costs
+
+    def iterResults(self, targetList):
+        """Run the task on targets in a pool, yielding results as they
+        complete.
+
+        Parameters
+        ----------
+        targetList : `list`
+            Targets, as returned by ``getTargetList``.
+
+        Yields
+        ------
+        index : `int`
+            Index of the target in ``targetList``.
+        result : `lsst.pipe.base.Struct`
+            Result for that target.
+        """
+        self.workerStats = []
+        if self.numProcesses <= 1:
+            yield from StreamingTaskRunner.iterResults(self, targetList)
+            return
+        if not targetList:
+            return
+        order = list(range(len(targetList)))
+        if self.costMethod is not None:
+            costs = self.estimateCosts(targetList)
+            order.sort(key=lambda index: -costs[index])
+        busy = {}
+        startTime = time.time()
+        for index, pid, targetStart, targetEnd, result in _iterPool(
+                self.numProcesses, (self,), _runTimedTarget, ((index, targetList[index]) for index in order),
+                self.getMaxInFlight(), self.timeout):
+            numTargets, busyTime = busy.get(pid, (0, 0.0))
+            busy[pid] = (numTargets + 1, busyTime + targetEnd - targetStart)
+            yield index, result
+        wallTime = time.time() - startTime
+        self.workerStats = [
+            pipeBase.Struct(pid=pid, numTargets=numTargets, busyTime=busyTime, wallTime=wallTime,
+                            utilization=busyTime/wallTime if wallTime > 0 else 0.0)
+            for pid, (numTargets, busyTime) in sorted(busy.items())
+        ]
+
+
+def iterTaskResults(TaskClass, args, config=None, log=None):
+    """Parse a command line and run a command-line task, yielding each
+    target's result as it completes.
+
+    This is a streaming alternative to
+    ``TaskClass.parseAndRun(args, doReturnResults=True)``: results are
+    not accumulated, so memory use does not grow with the number of
+    targets.
+
+    Parameters
+    ----------
+    TaskClass : `type`
+        A `lsst.pipe.base.CmdLineTask` whose ``RunnerClass`` is a
+        `StreamingTaskRunner`.
+    args : `list` of `str`
+        Command-line arguments.
+    config : `lsst.pex.config.Config`, optional
+        Config for the task; the default if `None`.
+    log : `lsst.log.Log`, optional
+        Log for the task.
+
+    Yields
+    ------
+    index : `int`
+        Index of the target in the runner's ``getTargetList``.
+    result : `lsst.pipe.base.Struct`
+        Result for that target, as returned by ``parseAndRun`` with
+        ``doReturnResults=True``.
+
+    Raises
+    ------
+    TypeError
+        Raised if ``TaskClass.RunnerClass`` is not a `StreamingTaskRunner`.
+    """
+    if not issubclass(TaskClass.RunnerClass, StreamingTaskRunner):
+        raise TypeError("%s.RunnerClass must be a StreamingTaskRunner" % (TaskClass.__name__,))
+    argumentParser = TaskClass._makeArgumentParser()
+    if config is None:
+        config = TaskClass.ConfigClass()
+    parsedCmd = argumentParser.parse_args(config=config, args=args, log=log,
+                                          override=TaskClass.applyOverrides)
+    runner = TaskClass.RunnerClass(TaskClass=TaskClass, parsedCmd=parsedCmd, doReturnResults=True)
+    targetList = runner.getTargetList(parsedCmd)
+    if runner.prepareToStream(parsedCmd):
+        yield from runner.iterResults(targetList)
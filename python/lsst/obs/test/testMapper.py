@@ -21,7 +21,10 @@
 #
 __all__ = ["TestMapper", "MapperForTestCalexpMetadataObjects"]
 
+import copy
+import json
 import os
+import re
 
 import lsst.utils
 import lsst.afw.image.utils as afwImageUtils
@@ -29,18 +32,128 @@ import lsst.daf.persistence as dafPersist
 from lsst.obs.base import CameraMapper
 from .testCamera import TestCamera
 from .makeTestRawVisitInfo import MakeTestRawVisitInfo
+from .registry import PooledSqliteRegistry
+from .registrySnapshot import RegistrySnapshot, RegistryVersion
+from .calibValidity import CalibValidityIndex
+from .exposureRecord import expandExposureDataIds
+from .fitsWriter import CompressionTypes
+from .writeBehind import WriteBehindQueue, _stripHdu
+from .figureStorage import FigureRenderingModes, ensureFigures, SpecSuffix
+from .listingCache import DirectoryListingCache, getSearchRoots
+from .metadataStore import MetadataStore, MetadataStoreName
+from .headerCache import getHeaderCache
+from .streamingWriter import StreamingExposureWriter
+
+_warmDefaults = {}
+"""Default ``prebuiltCamera`` and ``prebuiltPolicy`` of `TestMapper`; set
+only in the forked workers of `WarmServer`, for the mappers made by the
+task each worker runs.
+"""
 
 
 class TestMapper(CameraMapper):
     """Camera mapper for the Test camera.
+
+    Parameters
+    ----------
+    inputPolicy : `lsst.daf.persistence.Policy`, optional
+        Policy overrides; ``doFootprints`` is handled here and all other
+        entries are passed to `lsst.obs.base.CameraMapper` as keyword
+        arguments.
+    registryMode : `str`, optional
+        How SQLite registries are read:
+
+        - `None`: use `lsst.daf.persistence.SqliteRegistry`.
+        - ``"pooled"``: use `PooledSqliteRegistry`, which shares one read-only
+          connection per thread and reuses prepared statements.
+        - ``"snapshot"``: use `RegistrySnapshot`, which loads registry tables
+          into memory and answers lookups without SQLite, reloading when
+          the registry file changes.
+    writeBehind : `int`, optional
+        Number of background threads writing datasets; if 0, `put`
+        writes before returning. Otherwise puts are queued on a
+        `WriteBehindQueue`, ``writeQueue``, and written atomically in the
+        background; reads of a dataset wait for its queued writes, so
+        ``datasetExists`` and ``getUri`` stay consistent with ``put``.
+        Use `flush` (or `flushWrites`) to wait for all writes.
+    maxPendingWrites : `int`, optional
+        Maximum number of queued writes with ``writeBehind``; ``put``
+        blocks while the queue is full.
+    figureRendering : `str`, optional
+        If not `None`, figures of ``MatplotlibStorage`` datasets (such as
+        ``test_plot``) are stored as specs with ``FigureSpecStorage`` (see
+        `writeFigureSpecStorage`) and rendered later; one of
+        `FigureRenderingModes`:
+
+        - ``"pool"``: in a pool of processes, right after the put.
+        - ``"lazy"``: when the figure is first read.
+
+        Either way reads of a figure, including ``datasetExists`` and
+        ``getUri``, wait until it is rendered. By default figures are
+        rendered by ``put``.
+    writeOptions : `dict` [`str`, `dict`], optional
+        Write options of each dataset type, overriding the
+        ``writeOptions`` in the policy; see `writeOptionNames`. For
+        instance ``{"raw": {"dedup": True}}`` stores raws with
+        `writeDedupFitsStorage`, which is off by default.
+    fingerprintConfigs : `bool`, optional
+        Persist ``ConfigStorage`` datasets (such as ``test_config``) with
+        ``FingerprintConfigStorage`` (see `writeFingerprintConfigStorage`),
+        which skips rewriting an unchanged config and reads configs from a
+        binary snapshot.
+    prebuiltCamera : `TestCamera`, optional
+        Camera to use instead of building a new `TestCamera`.
+    prebuiltPolicy : `lsst.daf.persistence.Policy`, optional
+        Mapper policy to copy instead of reading ``testMapper.yaml``.
+    **kwargs
+        Additional keyword arguments for `lsst.obs.base.CameraMapper`.
     """
     packageName = 'obs_test'
 
     MakeRawVisitInfoClass = MakeTestRawVisitInfo
 
-    def __init__(self, inputPolicy=None, **kwargs):
+    registryModes = (None, "pooled", "snapshot")
+    """Supported values of the ``registryMode`` constructor argument."""
+
+    writeOptionNames = ("dedup", "compression", "level", "threads")
+    """Supported entries of the ``writeOptions`` of a dataset in the policy:
+
+    - ``dedup``: store each distinct file once (see `writeDedupFitsStorage`);
+      files of the store left unused by overwrites are removed by
+      `pruneDedupStore`.
+    - ``compression``: one of `CompressionTypes`.
+    - ``level``: gzip compression level, 1-9.
+    - ``threads``: number of threads compressing each file; 0 for the
+      number of CPUs.
+    """
+
+    def __init__(self, inputPolicy=None, registryMode=None, writeBehind=0, maxPendingWrites=16,
+                 figureRendering=None, writeOptions=None, fingerprintConfigs=False, prebuiltCamera=None,
+                 prebuiltPolicy=None, **kwargs):
         policyFilePath = dafPersist.Policy.defaultPolicyFile(self.packageName, "testMapper.yaml", "policy")
-        policy = dafPersist.Policy(policyFilePath)
+        if prebuiltPolicy is None:
+            prebuiltPolicy = _warmDefaults.get("policy")
+        # CameraMapper merges defaults into the policy, so use a copy
+        policy = copy.deepcopy(prebuiltPolicy) if prebuiltPolicy is not None \
+            else dafPersist.Policy(policyFilePath)
+        self.prebuiltCamera = prebuiltCamera if prebuiltCamera is not None \
+            else _warmDefaults.get("camera")
+
+        if registryMode not in self.registryModes:
+            raise ValueError("Unsupported registryMode %r; must be one of %s" %
+                             (registryMode, self.registryModes))
+        self.registryMode = registryMode
+        if figureRendering is not None and figureRendering not in FigureRenderingModes:
+            raise ValueError("Unsupported figureRendering %r; must be one of %s" %
+                             (figureRendering, FigureRenderingModes))
+        self.figureRendering = figureRendering
+        self.fingerprintConfigs = fingerprintConfigs
+        self._calibValidityIndex = None
+        self._calibValidityVersion = None
+        self._calibValidityStamp = None
+        self._metadataIndex = None
+        self.listingCache = DirectoryListingCache()
+        self.writeQueue = WriteBehindQueue(writeBehind, maxPendingWrites) if writeBehind else None
 
         self.doFootprints = False
         if inputPolicy is not None:
@@ -51,6 +164,9 @@ class TestMapper(CameraMapper):
                     kwargs[kw] = inputPolicy.get(kw)
 
         CameraMapper.__init__(self, policy, policyFilePath, **kwargs)
+        self.writeOptions = self._readWriteOptions(policy, writeOptions)
+        self.headerCache = getHeaderCache()
+        self._setupHeaderBypasses()
         self.filterIdMap = {
             'u': 0, 'g': 1, 'r': 2, 'i': 3, 'z': 4, 'y': 5, 'i2': 5}
 
@@ -65,6 +181,432 @@ class TestMapper(CameraMapper):
     def _extractDetectorName(self, dataId):
         return "0"
 
+    def _setupHeaderBypasses(self):
+        """Read FITS headers through ``headerCache``.
+
+        This applies to the ``_md`` datasets of FITS exposures and images
+        and to FITS datasets persisted as a PropertyList or PropertySet,
+        so datasets that read the header of the same file, such as
+        ``raw_md`` and ``rawMetadataDirect``, share one parse.
+        """
+        for datasetType, mapping in self.mappings.items():
+            if getattr(mapping, "storage", None) != "FitsStorage":
+                continue
+            if hasattr(self, "bypass_%s_md" % (datasetType,)):
+                setattr(self, "bypass_%s_md" % (datasetType,), self._bypassHeader)
+            if getattr(mapping, "persistable", None) in ("PropertyList", "PropertySet"):
+                setattr(self, "bypass_" + datasetType, self._bypassHeader)
+
+    def _bypassHeader(self, datasetType, pythonType, location, dataId):
+        return self.headerCache.readMetadata(location.getLocationsWithRoot()[0])
+
+    def _readWriteOptions(self, policy, overrides=None):
+        """Read the ``writeOptions`` of each dataset from the policy.
+
+        Parameters
+        ----------
+        policy : `lsst.daf.persistence.Policy`
+            Mapper policy.
+        overrides : `dict` [`str`, `dict`], optional
+            Options of each dataset type that override those in the
+            policy.
+
+        Returns
+        -------
+        writeOptions : `dict` [`str`, `dict`]
+            Write options of each dataset type that has any.
+
+        Raises
+        ------
+        ValueError
+            Raised if an option is not in ``writeOptionNames`` or has an
+            invalid value, including a ``compression`` that does not match
+            the name given by the template (".gz" for "gzip").
+        """
+        overrides = dict(overrides or {})
+        writeOptions = {}
+        for category in ("exposures", "calibrations", "datasets", "images"):
+            if category not in policy:
+                continue
+            datasets = policy[category]
+            for datasetType in datasets.names(True):
+                subPolicy = datasets[datasetType]
+                if not isinstance(subPolicy, dafPersist.Policy):
+                    continue
+                options = {}
+                if "writeOptions" in subPolicy:
+                    options = subPolicy["writeOptions"]
+                    options = {name: options[name] for name in options.names(True)}
+                options.update(overrides.pop(datasetType, {}))
+                if not options:
+                    continue
+                unknown = set(options) - set(self.writeOptionNames)
+                if unknown:
+                    raise ValueError("Unsupported writeOptions %s for dataset type %s; must be in %s" %
+                                     (sorted(unknown), datasetType, self.writeOptionNames))
+                if options.get("compression", "gzip") not in CompressionTypes:
+                    raise ValueError("Unsupported compression %r for dataset type %s; must be one of %s" %
+                                     (options["compression"], datasetType, CompressionTypes))
+                template = _stripHdu(subPolicy["template"]) if "template" in subPolicy else None
+                if "compression" in options and template is not None and \
+                        (options["compression"] == "gzip") != template.endswith(".gz"):
+                    raise ValueError("Compression %r for dataset type %s does not match its template %s" %
+                                     (options["compression"], datasetType, template))
+                if not 1 <= options.get("level", 6) <= 9:
+                    raise ValueError("Compression level %r for dataset type %s not in 1-9" %
+                                     (options["level"], datasetType))
+                if options.get("threads", 0) < 0:
+                    raise ValueError("Negative number of compression threads %r for dataset type %s" %
+                                     (options["threads"], datasetType))
+                writeOptions[datasetType] = options
+        if overrides:
+            raise ValueError("writeOptions given for unknown dataset types %s" % (sorted(overrides),))
+        return writeOptions
+
+    def map(self, datasetType, dataId, write=False):
+        """Map a data ID to a location.
+
+        Locations for writing ``FitsStorage`` datasets that have
+        ``writeOptions`` in the policy use ``DedupFitsStorage`` if
+        ``dedup`` is true, else ``CompressedFitsStorage`` (see
+        `writeCompressedFitsStorage`), with the options passed in the
+        additional data of the location. With ``writeBehind``, writes use
+        ``WriteBehindStorage`` (see `writeWriteBehindStorage`) and reads
+        wait for queued writes to the mapped files. Reads of
+        ``FigureSpecStorage`` datasets wait until the figures are rendered
+        (see `ensureFigures`); with ``figureRendering``, ``MatplotlibStorage``
+        datasets are mapped to ``FigureSpecStorage``, and with
+        ``fingerprintConfigs`` ``ConfigStorage`` datasets to
+        ``FingerprintConfigStorage``. Writes of
+        ``AggregatedYamlStorage`` datasets
+        are given the data ID to record in the `MetadataStore`.
+        """
+        location = CameraMapper.map(self, datasetType, dataId, write=write)
+        if not isinstance(location, dafPersist.ButlerLocation):
+            return location
+        if self.fingerprintConfigs and location.storageName == "ConfigStorage":
+            location.storageName = "FingerprintConfigStorage"
+        options = self.writeOptions.get(datasetType)
+        if write and options and location.storageName == "FitsStorage":
+            location.storageName = "DedupFitsStorage" if options.get("dedup", False) \
+                else "CompressedFitsStorage"
+            additionalData = location.additionalData
+            if "compression" in options:
+                additionalData.set("writeCompression", options["compression"])
+            if "level" in options:
+                additionalData.set("writeLevel", int(options["level"]))
+            if "threads" in options:
+                additionalData.set("writeThreads", int(options["threads"]))
+        if write and location.storageName == "AggregatedYamlStorage":
+            keys = dict.fromkeys(re.findall(r"%\((\w+)\)", self.mappings[datasetType].template))
+            dataIdValues = {key: location.dataId[key] for key in keys if key in location.dataId}
+            location.additionalData.set("metadataDataId",
+                                        json.dumps(dataIdValues, default=lambda value: value.item()))
+        isFigure = self._isFigureSpec(location)
+        if isFigure:
+            location.storageName = "FigureSpecStorage"
+        if self.writeQueue is not None:
+            if not write:
+                self.writeQueue.wait(location.getLocationsWithRoot())
+            elif not isFigure and dafPersist.PosixStorage.getWriteFormatter(location.storageName) is not None:
+                location.additionalData.set("writeBehindStorage", location.storageName)
+                location.storageName = "WriteBehindStorage"
+        if isFigure:
+            if write:
+                if self.figureRendering is not None:
+                    location.additionalData.set("figureRendering", self.figureRendering)
+            else:
+                ensureFigures(location.getLocationsWithRoot())
+        return location
+
+    def _isFigureSpec(self, location):
+        """Return whether a location is of a figure stored as a spec."""
+        return location.storageName == "FigureSpecStorage" or \
+            (self.figureRendering is not None and location.storageName == "MatplotlibStorage")
+
+    def flush(self):
+        """Wait for the writes queued with ``writeBehind`` to finish.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if any write failed.
+        """
+        if self.writeQueue is not None:
+            self.writeQueue.flush()
+
+    def close(self):
+        """Close the SQLite connections held by the registries and indexes
+        of this mapper; called when the mapper is deleted.
+
+        Queued writes are not waited for; use `flush` for that.
+        """
+        for registry in (getattr(self, "registry", None), getattr(self, "calibRegistry", None),
+                         getattr(self, "_metadataIndex", None),
+                         getattr(self, "_calibValidityVersion", None)):
+            if isinstance(registry, (PooledSqliteRegistry, RegistrySnapshot, RegistryVersion)):
+                registry.close()
+
+    def __del__(self):
+        self.close()
+
+    def _setupRegistry(self, *args, **kwargs):
+        """Set up a registry, replacing SQLite registries according to
+        ``registryMode``.
+        """
+        registry = CameraMapper._setupRegistry(self, *args, **kwargs)
+        location = getattr(registry, "root", None)
+        if not isinstance(registry, dafPersist.SqliteRegistry) or location is None:
+            return registry
+        if self.registryMode == "pooled":
+            registry = PooledSqliteRegistry(location)
+        elif self.registryMode == "snapshot":
+            registry = RegistrySnapshot(location)
+        return registry
+
+    def getUris(self, datasetType, dataIds, roots=None):
+        """Find the files of many datasets.
+
+        Files are looked for in ``roots`` and their ``_parent`` chains, as
+        ``datasetExists`` and ``getUri`` do, but through ``listingCache``:
+        each directory the datasets map to costs one ``stat`` per call,
+        plus one ``scandir`` when it has changed, so thousands of data IDs
+        need only a few system calls.
+
+        Parameters
+        ----------
+        datasetType : `str`
+            Dataset type; not a composite.
+        dataIds : iterable of `dict`
+            Data IDs; keys not given are looked up in the registry.
+        roots : `list` of `str`, optional
+            Roots of the repositories to search, in order. By default only
+            this repository is searched, which matches
+            ``Butler.datasetExists`` only if the butler's other
+            repositories are reached through ``_parent`` links; pass the
+            roots from `getButlerRepositories` for a butler made with
+            separate ``inputs`` and ``outputs``.
+
+        Returns
+        -------
+        uris : `list` of `str` or `None`
+            Path of the file of each dataset, or `None` if it does not
+            exist. Datasets with a queued write (see ``writeBehind``) or
+            a figure yet to be rendered exist.
+        """
+        roots = [searchRoot for root in (roots or [self.root]) for searchRoot in getSearchRoots(root)]
+        candidateLists = []
+        pending = []
+        for dataId in dataIds:
+            location = CameraMapper.map(self, datasetType, dataId, write=True)
+            if not isinstance(location, dafPersist.ButlerLocation):
+                raise TypeError("Dataset type %s is not a single file" % (datasetType,))
+            path = _stripHdu(location.getLocations()[0])
+            variants = [path] + [path + ext for ext in (".gz", ".fz") if not path.endswith(ext)]
+            if self._isFigureSpec(location):
+                variants.append(path + SpecSuffix)
+            candidateLists.append([os.path.join(root, variant) for root in roots for variant in variants])
+            pending.append(self.writeQueue is not None and self.writeQueue.isPending(candidateLists[-1][0]))
+        uris = self.listingCache.findFirst(candidateLists)
+        for i, candidates in enumerate(candidateLists):
+            if pending[i]:
+                uris[i] = candidates[0]
+            elif uris[i] is not None and uris[i].endswith(SpecSuffix):
+                uris[i] = uris[i][:-len(SpecSuffix)]
+        return uris
+
+    def datasetsExist(self, datasetType, dataIds, roots=None):
+        """Check whether many datasets exist.
+
+        Parameters
+        ----------
+        datasetType : `str`
+            Dataset type; not a composite.
+        dataIds : iterable of `dict`
+            Data IDs.
+        roots : `list` of `str`, optional
+            Roots of the repositories to search; see `getUris`.
+
+        Returns
+        -------
+        exists : `list` of `bool`
+            Whether each dataset exists; see `getUris`.
+        """
+        return [uri is not None for uri in self.getUris(datasetType, dataIds, roots=roots)]
+
+    def openStreamingWriter(self, datasetType, dataId, width, height, **kwargs):
+        """Open a writer for an exposure too large to build in memory.
+
+        The exposure is written in blocks of rows with
+        `StreamingExposureWriter.writeRows`, and may then be read like any
+        other dataset of ``datasetType``, e.g. ``fcr``.
+
+        Parameters
+        ----------
+        datasetType : `str`
+            Dataset type; must be an uncompressed ``FitsStorage`` exposure.
+        dataId : `dict`
+            Data ID; keys not given are looked up in the registry.
+        width, height : `int`
+            Size of the exposure.
+        **kwargs
+            Other arguments for `StreamingExposureWriter`, e.g. ``dtype``
+            and ``metadata``.
+
+        Returns
+        -------
+        writer : `StreamingExposureWriter`
+            Writer of the file of the dataset, in this repository; use as a
+            context manager, or call ``close``.
+
+        Raises
+        ------
+        ValueError
+            Raised if ``datasetType`` is not an uncompressed FITS exposure.
+        """
+        location = CameraMapper.map(self, datasetType, dataId, write=True)
+        if not isinstance(location, dafPersist.ButlerLocation) or location.storageName != "FitsStorage" \
+                or "Exposure" not in self.mappings[datasetType].persistable:
+            raise ValueError("Dataset type %s is not a FITS exposure" % (datasetType,))
+        if self.writeOptions.get(datasetType, {}).get("compression", "none") != "none":
+            raise ValueError("Dataset type %s is written compressed" % (datasetType,))
+        path = os.path.join(self.root, _stripHdu(location.getLocations()[0]))
+        if self.writeQueue is not None:
+            self.writeQueue.wait([path])
+        return StreamingExposureWriter(path, width, height, **kwargs)
+
+    def getMetadataStore(self):
+        """Return the store of the metadata written to this repository
+        with ``AggregatedYamlStorage``, such as ``test_metadata``.
+
+        Returns
+        -------
+        store : `MetadataStore`
+            Store in the repository root.
+        """
+        return MetadataStore(os.path.join(self.root, MetadataStoreName))
+
+    def getMetadataIndex(self):
+        """Return the in-memory index of the exposure registry used by
+        `queryMetadata`.
+
+        Returns
+        -------
+        index : `RegistrySnapshot` or `None`
+            Index of the exposure registry, which reloads itself when the
+            registry file changes, or `None` if the registry is not an
+            SQLite file.
+        """
+        if isinstance(self.registry, RegistrySnapshot):
+            return self.registry
+        location = getattr(self.registry, "root", None)
+        if location is None or not os.path.isfile(location):
+            return None
+        if self._metadataIndex is None or self._metadataIndex.root != location:
+            self._metadataIndex = RegistrySnapshot(location, checkInterval=0)
+        return self._metadataIndex
+
+    def queryMetadata(self, datasetType, format, dataId):
+        """Return the distinct values of registry columns for a dataset.
+
+        Queries of registry columns constrained by equality on registry
+        columns, such as visit and filter of all raws with filter "g", are
+        answered from an in-memory index of the exposure registry built
+        once for each combination of returned and constrained columns, so
+        the cost is proportional to the size of the result. Other queries
+        (e.g. of calibrations with validity ranges) go to the registry.
+
+        Parameters
+        ----------
+        datasetType : `str`
+            Dataset type.
+        format : `list` of `str`
+            Columns to return.
+        dataId : `dict`
+            Constraints.
+
+        Returns
+        -------
+        rows : `list` of `tuple`
+            Distinct rows of ``format`` values.
+        """
+        dataId = self.validate(dataId if dataId is not None else {})
+        mapping = self.mappings.get(datasetType)
+        index = self.getMetadataIndex()
+        if (index is None or mapping is None or mapping.registry is not self.registry
+                or mapping.range is not None or mapping.columns or not mapping.tables):
+            return CameraMapper.queryMetadata(self, datasetType, format, dataId)
+        columns = index.getTable(mapping.tables).names
+        if not set(format).union(dataId).issubset(columns):
+            return CameraMapper.queryMetadata(self, datasetType, format, dataId)
+        return index.lookup(list(format), mapping.tables, dataId)
+
+    def getCalibValidityIndex(self):
+        """Return an index of the validity ranges in the calibration registry.
+
+        Returns
+        -------
+        index : `CalibValidityIndex`
+            Validity index, rebuilt if the calibration registry has changed.
+
+        Raises
+        ------
+        RuntimeError
+            If there is no calibration registry.
+        """
+        location = getattr(self.calibRegistry, "root", None)
+        if location is None:
+            location = os.path.join(self.root, "calibRegistry.sqlite3")
+        if not os.path.exists(location):
+            raise RuntimeError("No calibration registry found for %s" % (self.root,))
+        if self._calibValidityVersion is None or self._calibValidityVersion.location != location:
+            self._calibValidityVersion = RegistryVersion(location)
+        stamp = (location, self._calibValidityVersion.get())
+        if self._calibValidityStamp != stamp:
+            self._calibValidityIndex = CalibValidityIndex.fromRegistry(location)
+            self._calibValidityStamp = stamp
+        return self._calibValidityIndex
+
+    def findCalibs(self, calibType, dataIdList):
+        """Find the calibration valid for each of many exposures.
+
+        Parameters
+        ----------
+        calibType : `str`
+            Calibration dataset type, e.g. "flat" or "bias".
+        dataIdList : `list` of `dict`
+            Data IDs, each with at least ``visit``.
+
+        Returns
+        -------
+        calibDates : `list` of `str`
+            ``calibDate`` of the calibration valid for each data ID, or `None`
+            if there is no unique valid calibration.
+
+        Notes
+        -----
+        The observation date and filter of every visit are read with one
+        registry query and the calibrations are then found with one
+        vectorized search per filter, rather than one registry query per
+        data ID.
+        """
+        index = self.getCalibValidityIndex()
+        visitInfo = {row[0]: row[1:3] for row in self._lookupVisits()}
+        mapping = self.calibrations[calibType]
+        useFilter = "filter" in (getattr(mapping, "columns", None) or ())
+        byFilter = {}
+        for i, dataId in enumerate(dataIdList):
+            filterName, taiObs = visitInfo.get(int(dataId["visit"]), (None, None))
+            if taiObs is None:
+                continue
+            byFilter.setdefault(filterName if useFilter else None, []).append((i, taiObs))
+        calibDates = [None]*len(dataIdList)
+        for filterName, items in byFilter.items():
+            found = index.lookupMany(calibType, [taiObs for i, taiObs in items], filter=filterName)
+            for (i, taiObs), calibDate in zip(items, found):
+                calibDates[i] = calibDate
+        return calibDates
+
     def _defectLookup(self, dataId):
         """Find the defects for a given CCD.
 
@@ -110,6 +652,47 @@ class TestMapper(CameraMapper):
             dataId["visit"] = int(visit)
         return dataId
 
+    def validateMany(self, dataIdList):
+        """Validate many data IDs at once.
+
+        Parameters
+        ----------
+        dataIdList : `list` of `dict`
+            Data IDs; ``visit`` is converted to `int` in place where needed.
+
+        Returns
+        -------
+        dataIdList : `list` of `dict`
+            The same data IDs.
+        """
+        for dataId in dataIdList:
+            self.validate(dataId)
+        return dataIdList
+
+    def _lookupVisits(self):
+        """Return ``(visit, filter, taiObs, expTime)`` for every visit in
+        the registry.
+        """
+        return self.registry.lookup(["visit", "filter", "taiObs", "expTime"], "raw_visit", {})
+
+    def expandDataIds(self, dataIdList):
+        """Validate and expand many partial data IDs with one registry query.
+
+        Parameters
+        ----------
+        dataIdList : `list` of `dict`
+            Partial data IDs, e.g. ``{"visit": 1}`` or ``{"filter": "g"}``.
+
+        Returns
+        -------
+        records : `list` of `list` of `ExposureRecord`
+            For each data ID, in order, the records of the exposures it
+            matches (empty if none), holding ``visit``, ``filter``,
+            ``taiObs`` and ``expTime``; use `ExposureRecord.toDict` for a
+            full data ID.
+        """
+        return expandExposureDataIds(self._lookupVisits(), self.validateMany(dataIdList))
+
     def _setCcdExposureId(self, propertyList, dataId):
         propertyList.set("Computed_ccdExposureId", self._computeCcdExposureId(dataId))
         return propertyList
@@ -120,8 +703,10 @@ class TestMapper(CameraMapper):
         Returns
         -------
         testCamera : `TestCamera`
-            Test camera.
+            Test camera; ``prebuiltCamera`` if set.
         """
+        if self.prebuiltCamera is not None:
+            return self.prebuiltCamera
         return TestCamera()
 
 
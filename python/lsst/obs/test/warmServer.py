@@ -0,0 +1,210 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["WarmServer", "runWarmTask"]
+
+import array
+import json
+import os
+import socket
+import socketserver
+import sys
+import time
+import traceback
+
+import lsst.daf.persistence as dafPersist
+from lsst.utils import doImport
+from . import testMapper
+from .testCamera import TestCamera
+from .testMapper import TestMapper
+
+MaxRequestSize = 1 << 20
+"""Maximum size (bytes) of a JSON request."""
+
+
+def _sendRequest(sock, payload, fds):
+    """Send a request, passing file descriptors with SCM_RIGHTS."""
+    ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))] if fds else []
+    sock.sendmsg([payload], ancdata)
+
+
+def _receiveRequest(sock):
+    """Receive a request and any file descriptors sent with it.
+
+    Returns
+    -------
+    request : `dict`
+        Decoded JSON request.
+    fds : `list` of `int`
+        Received file descriptors.
+    """
+    fdSize = array.array("i").itemsize
+    msg, ancdata, flags, addr = sock.recvmsg(MaxRequestSize, socket.CMSG_LEN(2*fdSize))
+    fds = array.array("i")
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fdSize)])
+    while not msg.endswith(b"\n"):
+        chunk = sock.recv(MaxRequestSize)
+        if not chunk:
+            break
+        msg += chunk
+    return json.loads(msg.decode()), list(fds)
+
+
+class _WarmRequestHandler(socketserver.StreamRequestHandler):
+    """Run one command-line task in a forked, pre-warmed worker."""
+
+    def handle(self):
+        request, fds = _receiveRequest(self.request)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, target in zip(fds, (1, 2)):
+            os.dup2(fd, target)
+            os.close(fd)
+        t0 = time.perf_counter()
+        response = dict(exitStatus=0, error=None)
+        # This runs in the forked worker, so only the mappers of this job
+        # share the camera and policy.
+        testMapper._warmDefaults.update(camera=self.server.camera, policy=self.server.policy)
+        try:
+            allowedTasks = self.server.allowedTasks
+            if allowedTasks is not None and request["task"] not in allowedTasks:
+                raise RuntimeError("Task %r is not allowed by this server" % (request["task"],))
+            os.chdir(request.get("cwd", os.getcwd()))
+            TaskClass = doImport(request["task"])
+            result = TaskClass.parseAndRun(args=request["args"])
+            exitStatusList = [getattr(res, "exitStatus", 0) or 0 for res in (result.resultList or [])]
+            response["exitStatus"] = max(exitStatusList, default=0)
+        except SystemExit as e:
+            response["exitStatus"] = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            response.update(exitStatus=1, error=traceback.format_exc())
+        sys.stdout.flush()
+        sys.stderr.flush()
+        response.update(elapsed=time.perf_counter() - t0, startupSaved=self.server.startupTime)
+        self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class WarmServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """A server that forks pre-warmed workers to run command-line tasks.
+
+    The server imports the stack, builds the `TestCamera` and reads the
+    TestMapper policy once; each request is then run in a forked child
+    that inherits them, so a series of short jobs pays the startup cost
+    once. Use `runWarmTask` to submit a job.
+
+    Parameters
+    ----------
+    socketPath : `str`
+        Path of the Unix socket to listen on; an existing socket file is
+        replaced. The socket is only accessible to the user running the
+        server.
+    startTime : `float`, optional
+        `time.perf_counter` value when the server process started, so the
+        reported startup time includes the import of the stack.
+    allowedTasks : iterable of `str`, optional
+        Fully qualified names of the task classes that may be run; any
+        task if `None`.
+
+    Notes
+    -----
+    The `TestMapper` instances made by each job get the prebuilt camera
+    and policy (as ``prebuiltCamera`` and ``prebuiltPolicy``); mappers
+    made in the server process itself are unaffected.
+    """
+    def __init__(self, socketPath, startTime=None, allowedTasks=None):
+        if startTime is None:
+            startTime = time.perf_counter()
+        if os.path.exists(socketPath):
+            os.unlink(socketPath)
+        self.socketPath = socketPath
+        self.numJobs = 0
+        self.allowedTasks = frozenset(allowedTasks) if allowedTasks is not None else None
+        socketserver.UnixStreamServer.__init__(self, socketPath, _WarmRequestHandler, bind_and_activate=False)
+        try:
+            self.server_bind()
+            # Restrict the socket before listening, so no other user can
+            # ever connect and run code as this one.
+            os.chmod(socketPath, 0o600)
+            self.server_activate()
+        except Exception:
+            self.server_close()
+            raise
+        self.camera = TestCamera()
+        self.policy = dafPersist.Policy(dafPersist.Policy.defaultPolicyFile(TestMapper.packageName,
+                                                                            "testMapper.yaml", "policy"))
+        # Time (sec) to import the stack, build the camera and read the policy.
+        self.startupTime = time.perf_counter() - startTime
+
+    def process_request(self, request, client_address):
+        self.numJobs += 1
+        socketserver.ForkingMixIn.process_request(self, request, client_address)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        socketserver.ForkingMixIn.server_close(self)
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+
+    @property
+    def startupSaved(self):
+        """Estimated startup time (sec) saved by all jobs run so far
+        (`float`).
+        """
+        return self.numJobs*self.startupTime
+
+
+def runWarmTask(socketPath, taskName, args, forwardOutput=True):
+    """Run a command-line task in a worker forked by a `WarmServer`.
+
+    Parameters
+    ----------
+    socketPath : `str`
+        Socket of the server.
+    taskName : `str`
+        Fully qualified name of the task class, e.g.
+        "lsst.pipe.tasks.processCcd.ProcessCcdTask".
+    args : `list` of `str`
+        Command-line arguments for ``parseAndRun``; relative paths are
+        relative to the current directory.
+    forwardOutput : `bool`, optional
+        If `True` the worker writes its stdout and stderr to those of the
+        calling process; otherwise to those of the server.
+
+    Returns
+    -------
+    response : `dict`
+        ``exitStatus`` (`int`), ``error`` (traceback `str` or `None`),
+        ``elapsed`` (time to run the task, sec) and ``startupSaved``
+        (startup time of the server, which this job did not pay, sec).
+    """
+    payload = json.dumps(dict(task=taskName, args=list(args), cwd=os.getcwd())) + "\n"
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socketPath)
+        _sendRequest(sock, payload.encode(), [1, 2] if forwardOutput else [])
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise RuntimeError("No response from warm server at %r" % (socketPath,))
+    return json.loads(line.decode())
@@ -0,0 +1,336 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__all__ = ["WriteBehindQueue", "writeAtomic", "getFinalPath", "writeWriteBehindStorage", "flushWrites"]
+
+import atexit
+import concurrent.futures
+import copy
+import os
+import re
+import shutil
+import threading
+import uuid
+import weakref
+
+import lsst.daf.persistence as dafPersist
+
+_queues = weakref.WeakSet()
+"""Open `WriteBehindQueue` instances, flushed by `flushWrites` and at exit."""
+
+_TempDirectory = re.compile(r"\.tmp-[0-9a-f]{32}")
+"""Name of the temporary directories written to by `writeAtomic`."""
+
+
+def _stripHdu(path):
+    """Return a path without a trailing cfitsio HDU specifier such as "[1]".
+    """
+    if path.endswith("]") and "[" in path:
+        return path[:path.rindex("[")]
+    return path
+
+
+def getFinalPath(path):
+    """Return the path a file being written by `writeAtomic` will be
+    renamed to.
+
+    Parameters
+    ----------
+    path : `str`
+        Path given to a write formatter.
+
+    Returns
+    -------
+    finalPath : `str`
+        ``path`` outside the temporary directory of `writeAtomic`; ``path``
+        itself if it is not in one.
+    """
+    directory, name = os.path.split(path)
+    parent, tempName = os.path.split(directory)
+    return os.path.join(parent, name) if _TempDirectory.fullmatch(tempName) else path
+
+
+def writeAtomic(butlerLocation, obj, storageName):
+    """Write an object with the formatter of a storage, replacing the files
+    atomically.
+
+    The formatter writes to a new temporary directory in the destination
+    directory, with the same file names, so formatters that choose the
+    format from the extension (such as ``MatplotlibStorage``) are
+    unaffected. The files are then renamed into place; sidecar files the
+    formatter writes next to its output (such as the fingerprint of
+    ``FingerprintConfigStorage``) are renamed first, so readers never see
+    a new file with an old sidecar. Only the temporary directory is
+    listed, so the cost does not grow with the number of files in the
+    destination. Formatters that compare against the existing file find
+    its path with `getFinalPath`.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location to write.
+    obj : `object`
+        Object to write.
+    storageName : `str`
+        Name of the storage whose write formatter is used, e.g.
+        "FitsStorage".
+    """
+    writeFormatter = dafPersist.PosixStorage.getWriteFormatter(storageName)
+    if writeFormatter is None:
+        raise RuntimeError("No write formatter for storage %r" % (storageName,))
+    root = butlerLocation.storage.root
+    tempName = ".tmp-%s" % (uuid.uuid4().hex,)
+    tempDirectories = {}
+    renames = []
+    tempLocationList = []
+    try:
+        for location in butlerLocation.getLocations():
+            directory, name = os.path.split(location)
+            if directory not in tempDirectories:
+                os.makedirs(os.path.join(root, directory), exist_ok=True)
+                os.mkdir(os.path.join(root, directory, tempName))
+                tempDirectories[directory] = os.path.join(root, directory, tempName)
+            tempLocationList.append(os.path.join(directory, tempName, name))
+            renames.append((tempDirectories[directory], os.path.join(root, directory), name))
+        tempLocation = copy.copy(butlerLocation)
+        tempLocation.locationList = tempLocationList
+        writeFormatter(tempLocation, obj)
+        for tempDirectory, directory, name in renames:
+            # Sidecars (longer names) first, the file itself last
+            for entry in sorted(os.listdir(tempDirectory), key=len, reverse=True):
+                if entry.startswith(name):
+                    os.replace(os.path.join(tempDirectory, entry), os.path.join(directory, entry))
+    finally:
+        for tempDirectory in tempDirectories.values():
+            shutil.rmtree(tempDirectory, ignore_errors=True)
+
+
+class WriteBehindQueue:
+    """Write datasets in background threads.
+
+    `submit` returns as soon as a write is queued; a bounded pool of
+    threads serializes and writes each object with `writeAtomic`. At most
+    ``maxPending`` writes are queued or running at a time, and `submit`
+    blocks while the queue is full, which bounds the memory held by
+    objects waiting to be written.
+
+    Parameters
+    ----------
+    numThreads : `int`, optional
+        Number of writer threads (or processes).
+    maxPending : `int`, optional
+        Maximum number of writes queued or running.
+    useProcesses : `bool`, optional
+        Run writes in a pool of processes instead of threads. They are
+        started by a fork server where possible, so they do not inherit
+        the threads and locks of this process; only `submitCall` may then be used, with a function
+        and arguments that can be pickled.
+
+    Notes
+    -----
+    The queue holds a reference to each object until it is written, so an
+    object must not be modified after it is put. Errors raised by writes
+    are collected and raised by the next `flush` (or `close`).
+    Queues are flushed by `flushWrites` and when the interpreter exits.
+    """
+
+    def __init__(self, numThreads=2, maxPending=16, useProcesses=False):
+        if numThreads < 1:
+            raise ValueError("numThreads=%r must be positive" % (numThreads,))
+        if maxPending < 1:
+            raise ValueError("maxPending=%r must be positive" % (maxPending,))
+        self.numThreads = numThreads
+        self.maxPending = maxPending
+        if useProcesses:
+            import multiprocessing
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=numThreads,
+                                                                    mp_context=context)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=numThreads,
+                                                                   thread_name_prefix="writeBehind")
+        self._pending = {}
+        self._numPending = 0
+        self._errors = []
+        self._cond = threading.Condition()
+        self._closed = False
+        _queues.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        """Return the number of writes queued or running."""
+        with self._cond:
+            return self._numPending
+
+    @property
+    def closed(self):
+        """`True` if the queue has been closed (`bool`)."""
+        return self._closed
+
+    def isPending(self, path):
+        """Return `True` if a write to a file is queued or running.
+
+        Parameters
+        ----------
+        path : `str`
+            Path of the file; a cfitsio HDU specifier is ignored.
+        """
+        with self._cond:
+            return os.path.abspath(_stripHdu(path)) in self._pending
+
+    def submit(self, butlerLocation, obj, storageName):
+        """Queue a write of a dataset with `writeAtomic`.
+
+        Parameters
+        ----------
+        butlerLocation : `lsst.daf.persistence.ButlerLocation`
+            Location to write.
+        obj : `object`
+            Object to write.
+        storageName : `str`
+            Name of the storage whose write formatter is used.
+        """
+        self.submitCall(butlerLocation.getLocationsWithRoot(), writeAtomic, butlerLocation, obj, storageName)
+
+    def submitCall(self, paths, func, *args):
+        """Queue a call that writes files.
+
+        Blocks while the queue is full, and until earlier writes to the
+        same files have finished, so writes to a file land in the order
+        they were submitted.
+
+        Parameters
+        ----------
+        paths : iterable of `str`
+            Files written by the call.
+        func : callable
+            Function to call.
+        *args
+            Arguments for ``func``.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot submit a write to a closed WriteBehindQueue")
+        paths = [os.path.abspath(path) for path in paths]
+        with self._cond:
+            self._cond.wait_for(lambda: self._numPending < self.maxPending
+                                and not any(path in self._pending for path in paths))
+            future = self._executor.submit(func, *args)
+            for path in paths:
+                self._pending[path] = future
+            self._numPending += 1
+        future.add_done_callback(lambda f: self._finish(f, paths))
+
+    def _finish(self, future, paths):
+        with self._cond:
+            for path in paths:
+                if self._pending.get(path) is future:
+                    del self._pending[path]
+            self._numPending -= 1
+            if future.exception() is not None:
+                self._errors.append(future.exception())
+            self._cond.notify_all()
+
+    def wait(self, paths):
+        """Wait for queued writes to files to finish.
+
+        Parameters
+        ----------
+        paths : iterable of `str`
+            Paths of the files; cfitsio HDU specifiers are ignored. Errors
+            are not raised here but by `flush`.
+        """
+        paths = [os.path.abspath(_stripHdu(path)) for path in paths]
+        with self._cond:
+            self._cond.wait_for(lambda: not any(path in self._pending for path in paths))
+
+    def flush(self):
+        """Wait for all queued writes to finish.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if any write failed since the last flush; chained to
+            the first error.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._numPending == 0)
+            errors, self._errors = self._errors, []
+        if errors:
+            raise RuntimeError("%d background write(s) failed; first error: %s" %
+                               (len(errors), errors[0])) from errors[0]
+
+    def close(self):
+        """Flush the queue and stop the writer threads.
+        """
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            self._executor.shutdown(wait=True)
+            _queues.discard(self)
+
+
+def writeWriteBehindStorage(butlerLocation, obj):
+    """Queue an object for writing by the `WriteBehindQueue` of the mapper
+    that made the location.
+
+    ``TestMapper.map`` selects this storage for writes when write-behind
+    is enabled, saving the original storage name as ``writeBehindStorage``
+    in the additional data of the location.
+
+    Parameters
+    ----------
+    butlerLocation : `lsst.daf.persistence.ButlerLocation`
+        Location to write.
+    obj : `object`
+        Object to write.
+    """
+    storageName = butlerLocation.getAdditionalData().getScalar("writeBehindStorage")
+    butlerLocation.mapper.writeQueue.submit(butlerLocation, obj, storageName)
+
+
+def flushWrites():
+    """Wait for the writes queued by every open `WriteBehindQueue`.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if any write failed.
+    """
+    for queue in list(_queues):
+        queue.flush()
+
+
+@atexit.register
+def _closeQueues():
+    for queue in list(_queues):
+        queue.close()
+
+
+dafPersist.PosixStorage.registerFormatters("WriteBehindStorage", writeFormatter=writeWriteBehindStorage)
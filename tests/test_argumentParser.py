@@ -26,11 +26,14 @@ import tempfile
 import unittest
 import contextlib
 
+import numpy as np
+
 import lsst.utils
 import lsst.utils.tests
 import lsst.log as lsstLog
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
+import lsst.obs.test
 
 ObsTestDir = lsst.utils.getPackageDir("obs_test")
 DataPath = os.path.realpath(os.path.join(ObsTestDir, "data", "input"))
@@ -149,6 +152,78 @@ class ArgumentParserTestCase(unittest.TestCase):
             self.assertEqual(idVal, predVal)
         self.assertEqual(len(namespace.id.refList), 3)  # only have data for three of these
 
+    def testArrayIdCross(self):
+        """Test that ObsTestArgumentParser finds the same data as the base
+        parser, in the same order, without duplicates
+        """
+        ap = lsst.obs.test.ObsTestArgumentParser(name="argumentParser")
+        ap.add_id_argument("--id", "raw", "help text")
+        args = [DataPath, "--id", "filter=g^r^g", "visit=3^1..2^2"]
+        namespace = ap.parse_args(config=self.config, args=args)
+        self.assertIsInstance(namespace.id, lsst.obs.test.ObsTestDataIdContainer)
+        baseNamespace = self.ap.parse_args(config=self.config, args=args)
+        baseDataIds = []
+        for ref in baseNamespace.id.refList:
+            if ref.dataId not in baseDataIds:
+                baseDataIds.append(ref.dataId)
+        self.assertEqual([ref.dataId for ref in namespace.id.refList], baseDataIds)
+        self.assertEqual(len(namespace.id.refList), 3)
+        self.assertEqual(len(namespace.id.idList), 6)
+
+        namespace = ap.parse_args(config=self.config, args=[DataPath, "--id", "visit=1..1000000"])
+        self.assertEqual(len(namespace.id.refList), 3)
+        self.assertEqual(namespace.id.refList[0].dataId["visit"], 1)
+        self.assertTrue(namespace.id.refList[0].datasetExists("raw"))
+
+    def testArrayIdOrder(self):
+        """Test that data IDs found in bulk and one by one keep the order of
+        the --id arguments
+        """
+        class PartlyBulkDataIdContainer(lsst.obs.test.ObsTestDataIdContainer):
+            def _findDataRefs(self, butler, product):
+                if "filter" in product.keys:
+                    return None
+                return lsst.obs.test.ObsTestDataIdContainer._findDataRefs(self, butler, product)
+
+        ap = lsst.obs.test.ObsTestArgumentParser(name="argumentParser")
+        ap.add_id_argument("--id", "raw", "help text", ContainerClass=PartlyBulkDataIdContainer)
+        args = [DataPath, "--id", "visit=3", "--id", "filter=g", "--id", "visit=2"]
+        namespace = ap.parse_args(config=self.config, args=args)
+        baseNamespace = self.ap.parse_args(config=self.config, args=args)
+        self.assertEqual([ref.dataId["visit"] for ref in namespace.id.refList], [3, 1, 2, 2])
+        self.assertEqual([ref.dataId["visit"] for ref in namespace.id.refList],
+                         [ref.dataId["visit"] for ref in baseNamespace.id.refList])
+
+    def testArrayIdMissingData(self):
+        """Test that ObsTestArgumentParser drops data IDs that are in the
+        registry but whose dataset does not exist, as the base parser does
+        """
+        tempDir = tempfile.mkdtemp()
+        try:
+            lsst.obs.test.makeSyntheticRepo(tempDir, 20, pixels="none")
+            for rawName in ("raw_v1_fg.fits.gz", "raw_v3_fr.fits.gz"):
+                os.makedirs(os.path.join(tempDir, "raw"), exist_ok=True)
+                shutil.copy(os.path.join(DataPath, "raw", rawName), os.path.join(tempDir, "raw"))
+            ap = lsst.obs.test.ObsTestArgumentParser(name="argumentParser")
+            ap.add_id_argument("--id", "raw", "help text")
+            args = [tempDir, "--id", "visit=1..20"]
+            namespace = ap.parse_args(config=self.config, args=args)
+            baseNamespace = self.ap.parse_args(config=self.config, args=args)
+            self.assertEqual([ref.dataId for ref in namespace.id.refList],
+                             [ref.dataId for ref in baseNamespace.id.refList])
+            self.assertLessEqual(len(namespace.id.refList), 2)
+            for ref in namespace.id.refList:
+                self.assertTrue(ref.datasetExists("raw"))
+        finally:
+            shutil.rmtree(tempDir, ignore_errors=True)
+
+    def testRankIn(self):
+        """Test that values of a different type are not cast to match"""
+        from lsst.obs.test.argumentParser import _rankIn
+        values = np.array([1, 2, 3], dtype=np.int64)
+        self.assertEqual(_rankIn(values, np.array([3, 1, 5], dtype=object)).tolist(), [2, 0, -1])
+        self.assertEqual(_rankIn(values, np.array([1.5, 2.9, 3.0], dtype=object)).tolist(), [-1, -1, 2])
+
     def testIdDuplicate(self):
         """Verify that each ID name can only appear once in a given ID argument"""
         with self.assertRaises(SystemExit):
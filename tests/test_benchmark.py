@@ -0,0 +1,125 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import gzip
+import json
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+# we only import lsst.obs.test.TestMapper from lsst.obs.test,
+# but use the namespace to hide it from pytest
+import lsst.obs.test
+import lsst.utils.tests
+
+
+class BenchmarkTestCase(lsst.utils.tests.TestCase):
+    """Test the benchmark helpers."""
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def testTimeOperation(self):
+        calls = []
+        result = lsst.obs.test.timeOperation("append", lambda: calls.append(1), repeat=5, warmup=2)
+        self.assertEqual(len(calls), 7)
+        summary = result.toDict()
+        self.assertEqual(summary["numCalls"], 5)
+        self.assertIsNone(summary["error"])
+        self.assertLessEqual(summary["p50"], summary["p99"])
+        self.assertGreater(summary["peakRss"], 0)
+
+        result = lsst.obs.test.timeOperation("fail", lambda: 1/0, repeat=5)
+        self.assertIn("ZeroDivisionError", result.error)
+
+    def testCompare(self):
+        baseline = dict(
+            fast=lsst.obs.test.BenchmarkResult("fast", [1.0, 1.0], 0).toDict(),
+            slow=lsst.obs.test.BenchmarkResult("slow", [1.0, 1.0], 0).toDict(),
+        )
+        path = os.path.join(self.tempDir, "baseline.json")
+        failed = lsst.obs.test.timeOperation("fail", lambda: 1/0, repeat=1)
+        lsst.obs.test.writeResults(path, dict(fast=lsst.obs.test.BenchmarkResult("fast", [1.0], 0),
+                                              fail=failed))
+        self.assertEqual(lsst.obs.test.readResults(path)["fast"]["p50"], 1.0)
+        # a statistic with no successful calls is written as null, not NaN
+        with open(path) as f:
+            data = json.load(f, parse_constant=lambda name: self.fail("%s in %s" % (name, path)))
+        self.assertIsNone(data["results"]["fail"]["p50"])
+        self.assertTrue(math.isnan(lsst.obs.test.readResults(path)["fail"]["p50"]))
+
+        results = dict(
+            fast=lsst.obs.test.BenchmarkResult("fast", [1.1, 1.1], 0),
+            slow=lsst.obs.test.BenchmarkResult("slow", [1.5, 1.5], 0),
+            new=lsst.obs.test.BenchmarkResult("new", [9.0], 0),
+        )
+        regressions = lsst.obs.test.compareResults(results, baseline, threshold=0.2)
+        self.assertEqual([r[0] for r in regressions], ["slow"])
+        self.assertAlmostEqual(regressions[0][3], 1.5)
+
+    def testButlerOperations(self):
+        operations = lsst.obs.test.makeButlerOperations()
+        results = lsst.obs.test.runBenchmarks(operations, repeat=2, warmup=0,
+                                              names=["raw_md", "ccdExposureId", "queryMetadata"])
+        self.assertEqual(list(results), ["raw_md", "ccdExposureId", "queryMetadata"])
+        for result in results.values():
+            self.assertIsNone(result.error)
+        with self.assertRaises(ValueError):
+            lsst.obs.test.runBenchmarks(operations, names=["nonexistent"])
+
+    def testCompression(self):
+        rawPath = os.path.join(lsst.utils.getPackageDir("obs_test"), "data", "input", "raw",
+                               "raw_v1_fg.fits.gz")
+        with gzip.open(rawPath) as f:
+            data = f.read()
+        operations = lsst.obs.test.makeCompressionOperations(data)
+        self.assertEqual(set(operations), set(lsst.obs.test.CompressionSettings))
+        results = lsst.obs.test.runBenchmarks(operations, repeat=2, warmup=0)
+        for name, result in results.items():
+            with self.subTest(name=name):
+                self.assertIsNone(result.error)
+                self.assertGreater(len(data)*result.toDict()["throughput"], 0)
+                compressed = operations[name]()
+                if lsst.obs.test.CompressionSettings[name]["compression"] == "none":
+                    self.assertEqual(compressed, data)
+                else:
+                    self.assertLess(len(compressed), len(data))
+                    self.assertEqual(gzip.decompress(compressed), data)
+        self.assertEqual(operations["gzip6"](), operations["gzip6_parallel"]())
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
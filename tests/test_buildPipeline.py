@@ -0,0 +1,177 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import lsst.obs.test
+import lsst.utils.tests
+
+
+class BuildPipelineTestCase(lsst.utils.tests.TestCase):
+    """Test running a graph of build stages."""
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.inPath = os.path.join(self.tempDir, "in.txt")
+        with open(self.inPath, "w") as f:
+            f.write("1 2 3\n")
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def record(self, name):
+        with self.lock:
+            self.calls.append(name)
+
+    def makePipeline(self):
+        """Make a pipeline: read -> (double, square) -> total, with only
+        read and total writing files.
+        """
+        pipeline = lsst.obs.test.BuildPipeline(os.path.join(self.tempDir, "state.json"), numThreads=2)
+        readPath = os.path.join(self.tempDir, "read.txt")
+        totalPath = os.path.join(self.tempDir, "total.txt")
+
+        def read():
+            self.record("read")
+            with open(self.inPath) as f:
+                values = [int(v) for v in f.read().split()]
+            with open(readPath, "w") as f:
+                f.write(" ".join(str(v) for v in values))
+            return values
+
+        def loadRead():
+            self.record("loadRead")
+            with open(readPath) as f:
+                return [int(v) for v in f.read().split()]
+
+        def double(values):
+            self.record("double")
+            return [2*v for v in values]
+
+        def square(values):
+            self.record("square")
+            return [v*v for v in values]
+
+        def total(doubled, squared):
+            self.record("total")
+            with open(totalPath, "w") as f:
+                f.write("%d\n" % (sum(doubled) + sum(squared),))
+            return sum(doubled) + sum(squared)
+
+        pipeline.addStage("read", read, inputs=[self.inPath], outputs=[readPath], load=loadRead)
+        pipeline.addStage("double", double, dependencies=["read"])
+        pipeline.addStage("square", square, dependencies=["read"])
+        pipeline.addStage("total", total, dependencies=["double", "square"], outputs=[totalPath])
+        return pipeline
+
+    def testRun(self):
+        """Test that stages run in dependency order and skip when up to date"""
+        result = self.makePipeline().run()
+        self.assertEqual(result.results["total"], 12 + 14)
+        self.assertEqual(self.calls[0], "read")
+        self.assertEqual(self.calls[-1], "total")
+        self.assertEqual(sorted(self.calls), ["double", "read", "square", "total"])
+        self.assertEqual({timing.status for timing in result.timings}, {"run"})
+
+        self.calls = []
+        result = self.makePipeline().run()
+        self.assertEqual(self.calls, [])
+        self.assertEqual({timing.status for timing in result.timings}, {"skipped"})
+        self.assertIn("total", lsst.obs.test.BuildPipeline.formatTimings(result.timings))
+
+        self.calls = []
+        result = self.makePipeline().run(force=True)
+        self.assertEqual(len(self.calls), 4)
+
+    def testInvalidation(self):
+        """Test that changed inputs and outputs rerun the affected stages"""
+        self.makePipeline().run()
+        with open(self.inPath, "w") as f:
+            f.write("4\n")
+        self.calls = []
+        result = self.makePipeline().run()
+        self.assertEqual(result.results["total"], 8 + 16)
+        self.assertEqual(len(self.calls), 4)
+
+        # Only the final output changed: read is loaded from its output
+        os.unlink(os.path.join(self.tempDir, "total.txt"))
+        self.calls = []
+        result = self.makePipeline().run()
+        self.assertEqual(self.calls[0], "loadRead")
+        self.assertEqual(sorted(self.calls[1:]), ["double", "square", "total"])
+        statuses = {timing.name: timing.status for timing in result.timings}
+        self.assertEqual(statuses["read"], "loaded")
+
+    def testErrors(self):
+        """Test cycles, unknown stages and failing stages"""
+        pipeline = lsst.obs.test.BuildPipeline(os.path.join(self.tempDir, "state.json"))
+        pipeline.addStage("a", lambda b: b, dependencies=["b"])
+        pipeline.addStage("b", lambda a: a, dependencies=["a"])
+        with self.assertRaises(ValueError):
+            pipeline.run()
+        with self.assertRaises(ValueError):
+            pipeline.addStage("a", lambda: None)
+
+        pipeline = lsst.obs.test.BuildPipeline(os.path.join(self.tempDir, "state.json"))
+        pipeline.addStage("a", lambda c: c, dependencies=["c"])
+        with self.assertRaises(ValueError):
+            pipeline.run()
+
+        def fail(value):
+            raise RuntimeError("failed on %s" % (value,))
+
+        pipeline = lsst.obs.test.BuildPipeline(os.path.join(self.tempDir, "state.json"))
+        pipeline.addStage("a", lambda: 1)
+        pipeline.addStage("b", fail, dependencies=["a"])
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+
+    def testHashPath(self):
+        """Test hashing files and directories by content"""
+        subDir = os.path.join(self.tempDir, "sub")
+        os.mkdir(subDir)
+        shutil.copy(self.inPath, subDir)
+        digest = lsst.obs.test.hashPath(subDir)
+        self.assertEqual(lsst.obs.test.hashPath(subDir), digest)
+        with open(os.path.join(subDir, "in.txt"), "a") as f:
+            f.write("4\n")
+        self.assertNotEqual(lsst.obs.test.hashPath(subDir), digest)
+        self.assertEqual(lsst.obs.test.hashPath(os.path.join(self.tempDir, "missing")), "missing")
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,108 @@
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+ROOT = getPackageDir('obs_test')
+InputDir = os.path.join(ROOT, "data", "input")
+
+sys.path.insert(0, os.path.join(ROOT, "data", "utils"))
+try:
+    import buildRepo
+    from lsst.ip.isr import Defects
+except ImportError:
+    buildRepo = None
+
+
+def dumpRegistry(path):
+    """Return the schema and the rows of every table of an SQLite file."""
+    conn = sqlite3.connect(path)
+    try:
+        schema = sorted(conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master"))
+        rows = {name: sorted(conn.execute("SELECT * FROM %s" % (name,)))
+                for type_, name, _, _ in schema if type_ == "table"}
+    finally:
+        conn.close()
+    return schema, rows
+
+
+@unittest.skipIf(buildRepo is None or buildRepo.IngestCuratedCalibsTask is None,
+                 "pipe_tasks and ip_isr are not set up")
+class BuildRepoTestCase(lsst.utils.tests.TestCase):
+    """Test the stages of data/utils/buildRepo.py that do not need the
+    lsstSim data.
+    """
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+
+    def tearDown(self):
+        shutil.rmtree(self.testDir, ignore_errors=True)
+
+    def testCalibRegistry(self):
+        """Test that the calibration registry is rebuilt exactly as checked
+        in, from the checked-in defects.
+        """
+        repo = os.path.join(self.testDir, "repo")
+        os.makedirs(repo)
+        shutil.copy(os.path.join(InputDir, "_mapper"), repo)
+        defectsDir = os.path.join(self.testDir, "defects")
+        defects = Defects.readFits(os.path.join(InputDir, "defects", "defects.fits"))
+        md = defects.getMetadata()
+        md["INSTRUME"] = "test"
+        md["DETECTOR"] = "0"
+        md["CALIBDATE"] = "1970-01-01T00:00:00"
+        md["FILTER"] = None
+        path = os.path.join(defectsDir, buildRepo.DefectsFileName)
+        os.makedirs(os.path.dirname(path))
+        defects.writeText(path)
+
+        buildRepo.makeCalibRegistry(repo, defectsDir)
+        schema, rows = dumpRegistry(os.path.join(repo, "calibRegistry.sqlite3"))
+        expectedSchema, expectedRows = dumpRegistry(os.path.join(InputDir, "calibRegistry.sqlite3"))
+        self.assertEqual(schema, expectedSchema)
+        self.assertEqual(rows, expectedRows)
+
+        # Rebuilding replaces the registry rather than adding to it
+        buildRepo.makeCalibRegistry(repo, defectsDir)
+        self.assertEqual(dumpRegistry(os.path.join(repo, "calibRegistry.sqlite3")), (schema, rows))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -25,6 +25,7 @@ import unittest
 import tempfile
 
 import lsst.utils
+import lsst.daf.persistence as dafPersist
 import lsst.pipe.base as pipeBase
 import lsst.obs.test
 from lsst.log import Log
@@ -81,6 +82,11 @@ class LegacyTask(ExampleTask):
         return results
 
 
+class WarmButlerTask(ExampleTask):
+    """Version of ExampleTask run by WarmButlerTaskRunner"""
+    RunnerClass = lsst.obs.test.WarmButlerTaskRunner
+
+
 class CmdLineTaskTestCase(unittest.TestCase):
     """A test case for CmdLineTask
     """
@@ -171,6 +177,51 @@ class CmdLineTaskTestCase(unittest.TestCase):
         self.assertFalse(
             os.path.exists(os.path.join(self.outPath, "config", ExampleTask._DefaultName + ".py~1")))
 
+    def testConfigFingerprint(self):
+        """Test that an unchanged config is not rewritten and is read from its
+        snapshot unless the file has been edited
+        """
+        ExampleTask.parseAndRun(args=[DataPath, "--output", self.outPath, "--id", "visit=3", "filter=r",
+                                      "--config", "floatField=-99.9"])
+        configPath = os.path.join(self.outPath, "config", ExampleTask._DefaultName + ".py")
+        # by default configs are persisted without a fingerprint
+        self.assertTrue(os.path.exists(configPath))
+        self.assertFalse(os.path.exists(configPath + ".sha256"))
+        config = lsst.obs.test.TestConfig()
+        config.floatField = -99.9
+
+        butler = dafPersist.Butler(inputs=DataPath,
+                                   outputs=dafPersist.RepositoryArgs(
+                                       root=self.outPath, mapper=lsst.obs.test.TestMapper,
+                                       mapperArgs=dict(fingerprintConfigs=True)))
+        butler.put(config, "test_config", doBackup=False)
+        self.assertEqual(lsst.obs.test.readConfigFingerprint(configPath),
+                         lsst.obs.test.configFingerprint(config))
+        self.assertTrue(os.path.exists(configPath + ".snapshot"))
+        mtime = os.stat(configPath).st_mtime_ns
+        butler.put(config, "test_config")
+        self.assertEqual(os.stat(configPath).st_mtime_ns, mtime)
+        self.assertTrue(config.compare(butler.get("test_config", immediate=True)))
+
+        with open(configPath, "a") as f:
+            f.write("config.strField = 'edited'\n")
+        self.assertIsNone(lsst.obs.test.readConfigFingerprint(configPath))
+        self.assertEqual(butler.get("test_config", immediate=True).strField, "edited")
+        butler.put(config, "test_config", doBackup=False)
+        self.assertTrue(config.compare(butler.get("test_config", immediate=True)))
+
+        # an unchanged config is not rewritten by a write-behind put either
+        mtime = os.stat(configPath).st_mtime_ns
+        butler = dafPersist.Butler(inputs=DataPath,
+                                   outputs=dafPersist.RepositoryArgs(
+                                       root=self.outPath, mapper=lsst.obs.test.TestMapper,
+                                       mapperArgs=dict(fingerprintConfigs=True, writeBehind=1)))
+        butler.put(config, "test_config", doBackup=False)
+        lsst.obs.test.flushWrites()
+        self.assertEqual(os.stat(configPath).st_mtime_ns, mtime)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(configPath))
+                          if name.startswith(".tmp-")], [])
+
     def testMultiprocess(self):
         """Test multiprocessing at a very minimal level
         """
@@ -179,6 +230,58 @@ class CmdLineTaskTestCase(unittest.TestCase):
                                                  "-j", "5", "--id", "visit=2", "filter=r"])
             self.assertEqual(result.taskRunner.numProcesses, 5 if TaskClass.canMultiprocess else 1)
 
+    def testWarmButlerTaskRunner(self):
+        """Test running in a pool of workers that keep one butler each
+        """
+        retVal = WarmButlerTask.parseAndRun(args=[DataPath, "--output", self.outPath,
+                                                  "-j", "2", "--id", "visit=1..3"], doReturnResults=True)
+        self.assertEqual(retVal.taskRunner.numProcesses, 2)
+        refList = retVal.parsedCmd.id.refList
+        self.assertEqual(len(retVal.resultList), len(refList))
+        for dataRef, result in zip(refList, retVal.resultList):
+            self.assertEqual(result.exitStatus, 0)
+            self.assertIs(result.dataRef, dataRef)
+            self.assertEqual(result.result.numProcessed, 1)
+            metadata = dataRef.get("test_metadata", immediate=True)
+            self.assertEqual(metadata.getScalar("test.numProcessed"), 1)
+
+    def testIterTaskResults(self):
+        """Test streaming results as each target completes
+        """
+        args = [DataPath, "--output", self.outPath, "-j", "2", "--id", "visit=1..3"]
+        results = dict(lsst.obs.test.iterTaskResults(WarmButlerTask, args))
+        self.assertEqual(sorted(results), [0, 1, 2])
+        for result in results.values():
+            self.assertEqual(result.exitStatus, 0)
+            self.assertEqual(result.result.numProcessed, 1)
+        with self.assertRaises(TypeError):
+            list(lsst.obs.test.iterTaskResults(ExampleTask, args))
+
+    def testSpilledResultList(self):
+        """Test a result list that holds one result in memory
+        """
+        resultList = lsst.obs.test.SpilledResultList(4, maxInMemory=1, directory=self.outPath)
+        for index in (2, 0, 1):
+            resultList[index] = pipeBase.Struct(exitStatus=index)
+        self.assertEqual(resultList.numSpilled, 2)
+        self.assertEqual([r.exitStatus if r is not None else None for r in resultList], [0, 1, 2, None])
+        resultList[2] = pipeBase.Struct(exitStatus=5)
+        self.assertEqual(resultList[-2].exitStatus, 5)
+        with self.assertRaises(IndexError):
+            resultList[4]
+        resultList.close()
+
+        # data references are not spilled, but restored from the targets
+        dataRefs = [object(), object()]
+        resultList = lsst.obs.test.SpilledResultList(2, maxInMemory=0, directory=self.outPath,
+                                                     dataRefs=dataRefs)
+        for index in range(2):
+            resultList[index] = pipeBase.Struct(exitStatus=index, dataRef=dataRefs[index])
+        self.assertEqual(resultList.numSpilled, 2)
+        self.assertIs(resultList[0].dataRef, dataRefs[0])
+        self.assertIs(resultList[1].dataRef, dataRefs[1])
+        resultList.close()
+
     def testCannotConstructTask(self):
         """Test error handling when a task cannot be constructed
         """
@@ -234,6 +337,15 @@ class ExampleMultipleIdTask(pipeBase.CmdLineTask):
         return oneRef.get("raw", snap=0, channel="0,0"), twoRef.get("raw", snap=0, channel="0,0")
 
 
+class DynamicMultipleIdTaskRunner(lsst.obs.test.DynamicTaskRunner, EaxmpleMultipleIdTaskRunner):
+    """EaxmpleMultipleIdTaskRunner with dynamic scheduling"""
+    pass
+
+
+class DynamicMultipleIdTask(ExampleMultipleIdTask):
+    RunnerClass = DynamicMultipleIdTaskRunner
+
+
 class MultipleIdTaskTestCase(unittest.TestCase):
     """A test case for CmdLineTask using multiple identifiers
 
@@ -263,6 +375,28 @@ class MultipleIdTaskTestCase(unittest.TestCase):
         retVal = ExampleMultipleIdTask.parseAndRun(args=args)
         self.assertEqual(len(retVal.resultList), 1)
 
+    def testDynamicScheduling(self):
+        """Test dynamic scheduling of targets with multiple identifiers"""
+        args = [DataPath, "--output", self.outPath, "-j", "2",
+                "--one", "visit=1^2", "filter=g",
+                "--two", "visit=2^1", "filter=g",
+                ]
+        retVal = DynamicMultipleIdTask.parseAndRun(args=args)
+        self.assertEqual(len(retVal.resultList), 2)
+        for (oneRef, twoRef), (oneRaw, twoRaw) in zip(retVal.taskRunner.getTargetList(retVal.parsedCmd),
+                                                      retVal.resultList):
+            self.assertEqual(oneRaw.getMetadata().getScalar("OBSID"),
+                             oneRef.get("raw_md").getScalar("OBSID"))
+        workerStats = retVal.taskRunner.workerStats
+        self.assertEqual(sum(stats.numTargets for stats in workerStats), 2)
+        for stats in workerStats:
+            self.assertGreater(stats.busyTime, 0)
+            self.assertLessEqual(stats.utilization, 1)
+        targetList = retVal.taskRunner.getTargetList(retVal.parsedCmd)
+        costs = retVal.taskRunner.estimateCosts(targetList)
+        self.assertGreater(costs[0], 0)
+        self.assertEqual(retVal.taskRunner.estimateCost(targetList[0]), costs[0])
+
 
 class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
     pass
@@ -21,9 +21,11 @@
 #
 
 import filecmp
+import gzip
 import os
 import pickle
 import shutil
+import stat
 import tempfile
 import unittest
 
@@ -113,6 +115,91 @@ class TestCompositeTestCase(lsst.utils.tests.TestCase):
         self.assertTrue(filecmp.cmp(os.path.join(self.compositeOutput, 'flat', 'flat_fg.fits.gz'),
                                     os.path.join(self.nonCompositeOutput, 'flat', 'flat_fg.fits.gz')))
 
+    def testPutDedup(self):
+        """Test that identical components are stored once and hard-linked.
+        """
+        butler = dafPersist.Butler(
+            inputs=dafPersist.RepositoryArgs(root=self.input, mapper='lsst.obs.test.testMapper.TestMapper'),
+            outputs=dafPersist.RepositoryArgs(root=self.compositeOutput, mapperArgs=dict(
+                writeOptions={"raw": dict(dedup=True), "flat": dict(dedup=True)})))
+        bbox = geom.Box2I(geom.Point2I(0, 0), geom.Point2I(10, 10))
+        raw = makeRampDecoratedImage(bbox=bbox, start=100, raw1=5)
+        flat = makeRampDecoratedImage(bbox=bbox, start=-55, flat1="me")
+        rawAndFlat = butler.get('rawAndFlat', dataId=self.dataId)
+        rawAndFlat.raw = raw
+        rawAndFlat.flat = flat
+        butler.put(rawAndFlat, 'rawAndFlat', dataId=self.dataId)
+
+        rawPath = os.path.join(self.compositeOutput, 'raw', 'raw_v1_fg.fits.gz')
+        flatPath = os.path.join(self.compositeOutput, 'flat', 'flat_fg.fits.gz')
+        storeDir = os.path.join(self.compositeOutput, lsst.obs.test.DedupDirName)
+        self.assertEqual(len(os.listdir(storeDir)), 2)
+        self.assertFalse(os.path.samefile(rawPath, flatPath))
+        with gzip.open(rawPath) as f:
+            self.assertEqual(f.read(6), b"SIMPLE")
+        # Files have the usual permissions, not those of a temporary file
+        umask = os.umask(0o022)
+        os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(rawPath).st_mode), 0o666 & ~umask)
+
+        # Writing the same content again, directly or through the composite,
+        # adds nothing to the store
+        rawStat = os.stat(rawPath)
+        butler.put(raw, 'raw', dataId=self.dataId)
+        self.assertEqual(os.stat(rawPath).st_ino, rawStat.st_ino)
+        butler.put(rawAndFlat, 'rawAndFlat', dataId=self.dataId)
+        self.assertEqual(len(os.listdir(storeDir)), 2)
+
+        butler.put(raw, 'flat', dataId=self.dataId)
+        self.assertTrue(os.path.samefile(rawPath, flatPath))
+        self.assertEqual(lsst.obs.test.pruneDedupStore(self.compositeOutput), 1)
+        self.assertEqual(len(os.listdir(storeDir)), 1)
+
+    def testWriteOptions(self):
+        """Test that compression settings reach the writer.
+        """
+        # By default FitsStorage writes the files
+        mapper = lsst.obs.test.TestMapper(root=self.input)
+        self.assertNotIn("raw", mapper.writeOptions)
+        self.assertEqual(mapper.map('raw', self.dataId, write=True).storageName, "FitsStorage")
+
+        # Options are enabled by the mapper arguments
+        mapper = lsst.obs.test.TestMapper(root=self.input, writeOptions={"raw": dict(threads=2)})
+        self.assertEqual(mapper.writeOptions["raw"], dict(threads=2))
+        location = mapper.map('raw', self.dataId, write=True)
+        self.assertEqual(location.storageName, "CompressedFitsStorage")
+        self.assertEqual(location.additionalData.getScalar("writeThreads"), 2)
+        self.assertEqual(mapper.map('raw', self.dataId).storageName, "FitsStorage")
+
+        dedupMapper = lsst.obs.test.TestMapper(root=self.input, writeOptions={"raw": dict(dedup=True)})
+        self.assertEqual(dedupMapper.writeOptions["raw"], dict(dedup=True))
+        self.assertEqual(dedupMapper.map('raw', self.dataId, write=True).storageName, "DedupFitsStorage")
+        with self.assertRaises(ValueError):
+            lsst.obs.test.TestMapper(root=self.input, writeOptions={"noSuchDataset": dict(dedup=True)})
+
+        for options in (dict(compression="bzip2"), dict(compression="none"), dict(level=0), dict(threads=-1),
+                        dict(speed=1)):
+            policy = dafPersist.Policy({"exposures": {"raw": {"writeOptions": options}}})
+            with self.assertRaises(ValueError):
+                mapper._readWriteOptions(policy)
+
+        # Plain FITS cannot be written under a gzip name
+        location.storage = dafPersist.PosixStorage(self.output, create=True)
+        location.additionalData.set("writeCompression", "none")
+        raw = makeRampDecoratedImage(bbox=geom.Box2I(geom.Point2I(0, 0), geom.Point2I(10, 10)), start=100)
+        with self.assertRaises(ValueError):
+            lsst.obs.test.writeCompressedFitsStorage(location, raw)
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'raw', 'raw_v1_fg.fits.gz')))
+
+        location.additionalData.set("writeCompression", "gzip")
+        location.additionalData.set("writeLevel", 1)
+        lsst.obs.test.writeCompressedFitsStorage(location, raw)
+        rawPath = os.path.join(self.output, 'raw', 'raw_v1_fg.fits.gz')
+        with gzip.open(rawPath) as f:
+            self.assertEqual(f.read(6), b"SIMPLE")
+        self.assertImagesEqual(afwImage.DecoratedImageU(rawPath).getImage(), raw.getImage())
+        self.assertFalse(os.path.exists(os.path.join(self.output, lsst.obs.test.DedupDirName)))
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
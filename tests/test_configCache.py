@@ -0,0 +1,142 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.pex.config as pexConfig
+import lsst.obs.test
+import lsst.utils
+import lsst.utils.tests
+
+
+class SubConfig(pexConfig.Config):
+    intItem = pexConfig.Field(doc="sample int field", dtype=int, default=8)
+    listItem = pexConfig.ListField(doc="sample list field", dtype=str, default=["a"])
+
+
+class SampleConfig(pexConfig.Config):
+    floatItem = pexConfig.Field(doc="sample float field", dtype=float, default=3.1)
+    subItem = pexConfig.ConfigField(doc="sample subfield", dtype=SubConfig)
+    choiceItem = pexConfig.ConfigChoiceField(doc="sample choice field", typemap={"one": SubConfig},
+                                             default="one")
+
+
+class ConfigCacheTestCase(lsst.utils.tests.TestCase):
+    """Test caching the result of loading a chain of config files."""
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.cacheDir = os.path.join(self.tempDir, "cache")
+        self.subPath = os.path.join(self.tempDir, "sub.py")
+        self.topPath = os.path.join(self.tempDir, "top.py")
+        self.writeFile(self.subPath, "config.intItem = 5\nconfig.listItem = ['b', 'c']\n")
+        self.writeFile(self.topPath, "config.subItem.load(%r)\n"
+                       "config.choiceItem['one'].intItem = 12\n"
+                       "config.floatItem = 2.5\n" % (self.subPath,))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def writeFile(self, path, text):
+        with open(path, "w") as f:
+            f.write(text)
+
+    def loadDirect(self):
+        config = SampleConfig()
+        config.load(self.topPath)
+        return config
+
+    def testCache(self):
+        """Test that a chain is cached and invalidated by any file in it"""
+        cache = lsst.obs.test.ConfigLoadCache(self.cacheDir)
+        for cached in (False, True):
+            config = SampleConfig()
+            self.assertEqual(cache.load(config, self.topPath), cached)
+            self.assertTrue(config.compare(self.loadDirect()))
+            self.assertEqual(config.subItem.intItem, 5)
+            self.assertEqual(list(config.subItem.listItem), ["b", "c"])
+            self.assertEqual(config.choiceItem["one"].intItem, 12)
+
+        self.writeFile(self.subPath, "config.intItem = 7\n")
+        config = SampleConfig()
+        self.assertFalse(cache.load(config, self.topPath))
+        self.assertEqual(config.subItem.intItem, 7)
+        self.assertTrue(lsst.obs.test.loadConfig(SampleConfig(), self.topPath, cacheDir=self.cacheDir))
+        self.assertEqual((cache.numHits, cache.numMisses), (1, 2))
+
+    def testStartingState(self):
+        """Test that the cache key includes the config before loading"""
+        cache = lsst.obs.test.ConfigLoadCache(self.cacheDir)
+        self.assertFalse(cache.load(SampleConfig(), self.topPath))
+        config = SampleConfig()
+        config.subItem.intItem = 1
+        config.subItem.listItem = ["z"]
+        self.assertFalse(cache.load(config, self.topPath))
+        self.assertEqual(config.subItem.intItem, 5)
+
+    def testHistory(self):
+        """Test that values set from the cache are in the config history"""
+        cache = lsst.obs.test.ConfigLoadCache(self.cacheDir)
+        cache.load(SampleConfig(), self.topPath)
+        config = SampleConfig()
+        self.assertTrue(cache.load(config, self.topPath))
+        self.assertEqual(config.history["floatItem"][-1][2], "load %s (cached)" % (self.topPath,))
+        self.assertEqual(config.subItem.history["intItem"][-1][0], 5)
+
+    def testUnsafeCacheDir(self):
+        """Test that a cache directory others may write to is not used"""
+        os.makedirs(self.cacheDir)
+        os.chmod(self.cacheDir, 0o777)
+        cache = lsst.obs.test.ConfigLoadCache(self.cacheDir)
+        for i in range(2):
+            config = SampleConfig()
+            self.assertFalse(cache.load(config, self.topPath))
+            self.assertTrue(config.compare(self.loadDirect()))
+        self.assertEqual(os.listdir(self.cacheDir), [])
+
+    def testArgumentParser(self):
+        """Test loading --configfile through the cache of the parser"""
+        parser = lsst.obs.test.ObsTestArgumentParser(name="test")
+        parser.configCacheDir = self.cacheDir
+        for i in range(2):
+            config = SampleConfig()
+            parser.parse_args(config=config, args=[os.path.join(lsst.utils.getPackageDir("obs_test"),
+                                                                "data", "input"),
+                                                   "--configfile", self.topPath])
+            self.assertTrue(config.compare(self.loadDirect()))
+        self.assertEqual(parser.configLoadCache.numHits, 1)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -55,6 +55,23 @@ class FitsStorageTestCase(lsst.utils.tests.TestCase):
         md2 = self.butler.get("rawMetadataDirect", visit=1, filter="g")
         self.assertEqual(md1, md2)
 
+    def testHeaderCache(self):
+        """Test that datasets reading the same header share one parse."""
+        cache = lsst.obs.test.getHeaderCache()
+        cache.clear()
+        numMisses = cache.numMisses
+        md1 = self.butler.get("raw_md", visit=2, filter="g")
+        md2 = self.butler.get("rawMetadataDirect", visit=2, filter="g")
+        md3 = self.butler.get("raw_md", visit=2, filter="g")
+        self.assertEqual(cache.numMisses, numMisses + 1)
+        self.assertEqual(md1, md2)
+        self.assertEqual(md1, md3)
+
+        # Each caller gets its own copy
+        md1.set("EXPTIME", -1.0)
+        self.assertNotEqual(self.butler.get("raw_md", visit=2, filter="g").getScalar("EXPTIME"), -1.0)
+        self.assertNotEqual(md2.getScalar("EXPTIME"), -1.0)
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
@@ -0,0 +1,104 @@
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+# we only import lsst.obs.test.TestMapper from lsst.obs.test,
+# but use the namespace to hide it from pytest
+import lsst.daf.persistence as dafPersist
+import lsst.obs.test
+import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+ROOT = getPackageDir('obs_test')
+InputDir = os.path.join(ROOT, "data", "input")
+
+
+class DirectoryListingCacheTestCase(lsst.utils.tests.TestCase):
+    """Test DirectoryListingCache and TestMapper.datasetsExist."""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+
+    def tearDown(self):
+        shutil.rmtree(self.testDir, ignore_errors=True)
+
+    def testCache(self):
+        cache = lsst.obs.test.DirectoryListingCache(racyInterval=0)
+        paths = [os.path.join(self.testDir, "a%d" % (i,)) for i in range(100)]
+        for path in paths[::2]:
+            open(path, "w").close()
+        candidates = [[path] for path in paths] + [[os.path.join(self.testDir, "missing", "b"), paths[1]]]
+        found = cache.findFirst(candidates)
+        self.assertEqual(found[:100], [path if i % 2 == 0 else None for i, path in enumerate(paths)])
+        self.assertIsNone(found[100])
+        self.assertEqual(cache.numScans, 1)
+
+        # The listing is reused until the directory changes
+        self.assertTrue(cache.exists(paths[0]))
+        self.assertEqual(cache.numScans, 1)
+        os.unlink(paths[0])
+        self.assertFalse(cache.exists(paths[0]))
+        self.assertEqual(cache.numScans, 2)
+
+    def testDatasetsExist(self):
+        mapper = lsst.obs.test.TestMapper(root=InputDir)
+        dataIds = [dict(visit=1, filter="g"), dict(visit=3, filter="r"), dict(visit=3, filter="g")]
+        self.assertEqual(mapper.datasetsExist("raw", dataIds), [True, True, False])
+        uris = mapper.getUris("raw", dataIds)
+        self.assertEqual(uris[0], os.path.join(InputDir, "raw", "raw_v1_fg.fits.gz"))
+        self.assertIsNone(uris[2])
+
+        # Datasets in parent repositories are found
+        child = os.path.join(self.testDir, "child")
+        os.makedirs(child)
+        os.symlink(InputDir, os.path.join(child, "_parent"))
+        childMapper = lsst.obs.test.TestMapper(root=child)
+        self.assertEqual(childMapper.datasetsExist("raw", dataIds), [True, True, False])
+        self.assertEqual(lsst.obs.test.getSearchRoots(child), [child, os.path.join(child, "_parent")])
+
+    def testButlerRepositories(self):
+        """Test finding datasets in the repositories of a butler made with
+        separate inputs and outputs, which are not linked by ``_parent``.
+        """
+        butler = dafPersist.Butler(inputs=InputDir, outputs=self.testDir)
+        mapper, roots = lsst.obs.test.getButlerRepositories(butler)
+        dataIds = [dict(visit=1, filter="g"), dict(visit=3, filter="r"), dict(visit=3, filter="g")]
+        expected = [butler.datasetExists("raw", dataId) for dataId in dataIds]
+        self.assertEqual(mapper.datasetsExist("raw", dataIds, roots=roots), expected)
+        self.assertEqual(expected, [True, True, False])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
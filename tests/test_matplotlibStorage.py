@@ -21,6 +21,7 @@
 #
 
 import os
+import stat
 import tempfile
 import unittest
 
@@ -29,7 +30,7 @@ import unittest
 import lsst.obs.test
 import lsst.utils.tests
 from lsst.utils import getPackageDir
-from lsst.daf.persistence import Butler
+from lsst.daf.persistence import Butler, RepositoryArgs
 import shutil
 
 
@@ -57,7 +58,56 @@ class MatplotlibStorageTestCase(lsst.utils.tests.TestCase):
         pyplot.plot([0, 1], [0, 1], "k")
         self.butler.put(fig, "test_plot", visit=1, filter="g")
         self.assertTrue(self.butler.datasetExists("test_plot", visit=1, filter="g"))
-        self.assertTrue(os.path.exists(self.butler.getUri("test_plot", visit=1, filter="g")))
+        path = self.butler.getUri("test_plot", visit=1, filter="g")
+        self.assertTrue(os.path.exists(path))
+        # figures are stored as specs only if the mapper asks for it
+        self.assertFalse(os.path.exists(path + lsst.obs.test.figureStorage.SpecSuffix))
+
+    def makeSpecButler(self, figureRendering):
+        """Make a butler that stores figures as specs."""
+        return Butler(inputs=os.path.join(ROOT, "data", "input"),
+                      outputs=RepositoryArgs(root=os.path.join(self.testDir, figureRendering),
+                                             mapper=lsst.obs.test.TestMapper,
+                                             mapperArgs=dict(figureRendering=figureRendering)))
+
+    def testWriteFigureSpec(self):
+        """Test that figure specs are rendered once per change."""
+        spec = lsst.obs.test.FigureSpec(figsize=(4, 3))
+        axes = spec.addSubplot(1, 1, 1)
+        axes.plot([0, 1], [0, 1], "k")
+        axes.set_xlabel("x")
+        butler = self.makeSpecButler("pool")
+        butler.put(spec, "test_plot", visit=1, filter="g")
+        path = butler.getUri("test_plot", visit=1, filter="g")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(4), b"\x89PNG")
+        self.assertTrue(os.path.exists(path + lsst.obs.test.figureStorage.SpecSuffix))
+        umask = os.umask(0o022)
+        os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o666 & ~umask)
+
+        # An unchanged spec is not rendered again
+        inode = os.stat(path).st_ino
+        butler.put(spec, "test_plot", visit=1, filter="g")
+        lsst.obs.test.flushFigures()
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertFalse(lsst.obs.test.renderFigureSpec(path))
+
+        axes.set_ylabel("y")
+        butler.put(spec, "test_plot", visit=1, filter="g")
+        self.assertTrue(butler.datasetExists("test_plot", visit=1, filter="g"))
+        self.assertNotEqual(os.stat(path).st_ino, inode)
+
+    def testLazyRendering(self):
+        """Test rendering figures when they are first read."""
+        butler = self.makeSpecButler("lazy")
+        spec = lsst.obs.test.FigureSpec()
+        spec.addSubplot(1, 1, 1).plot([0, 1], [1, 0])
+        butler.put(spec, "test_plot", visit=2, filter="g")
+        path = os.path.join(self.testDir, "lazy", "test_plot", "v2_fg.png")
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(butler.datasetExists("test_plot", visit=2, filter="g"))
+        self.assertTrue(os.path.exists(path))
 
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
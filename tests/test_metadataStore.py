@@ -0,0 +1,128 @@
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import lsst.daf.base as dafBase
+import lsst.daf.persistence as dafPersist
+# we only import lsst.obs.test.TestMapper from lsst.obs.test,
+# but use the namespace to hide it from pytest
+import lsst.obs.test
+import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+ROOT = getPackageDir('obs_test')
+
+
+class MetadataStoreTestCase(lsst.utils.tests.TestCase):
+    """Test the aggregated store of test_metadata."""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+
+    def tearDown(self):
+        shutil.rmtree(self.testDir, ignore_errors=True)
+
+    def testPut(self):
+        butler = dafPersist.Butler(inputs=os.path.join(ROOT, "data", "input"),
+                                   outputs={"root": self.testDir, "mode": "rw"})
+        for visit, filterName, numProcessed in [(1, "g", 10), (2, "g", 20), (3, "r", 30), (1, "g", 11)]:
+            metadata = dafBase.PropertySet()
+            metadata.setInt("test.numProcessed", numProcessed)
+            metadata.setDouble("test.timings", [0.5, 1.5])
+            if visit == 3:
+                metadata.setString("test.note", "rerun")
+            butler.put(metadata, "test_metadata", visit=visit, filter=filterName)
+
+        # The per-file YAML view is still written
+        self.assertTrue(os.path.exists(os.path.join(self.testDir, "test", "v1_fg.yaml")))
+        self.assertEqual(butler.get("test_metadata", visit=1, filter="g").getScalar("test.numProcessed"), 11)
+
+        store = lsst.obs.test.MetadataStore(os.path.join(self.testDir, lsst.obs.test.MetadataStoreName))
+        self.assertEqual(set(store.getColumns("test_metadata")),
+                         {"visit", "filter", "test.numProcessed", "test.timings", "test.note"})
+        result = store.query("test_metadata", ["visit", "test.numProcessed", "test.note"])
+        # The latest put of visit 1 replaces the first
+        self.assertEqual(list(result["visit"]), [2, 3, 1])
+        self.assertEqual(list(result["test.numProcessed"]), [20, 30, 11])
+        self.assertEqual(list(result["test.note"]), [None, "rerun", None])
+        result = store.query("test_metadata", ["test.numProcessed"], where=dict(filter="g"))
+        self.assertEqual(result["test.numProcessed"].sum(), 31)
+        self.assertEqual(result["test.numProcessed"].dtype, np.int64)
+        with self.assertRaises(KeyError):
+            store.query("test_metadata", ["test.unknown"])
+
+    def testEntryNames(self):
+        """Entry names that differ only in case, or clash with the data ID,
+        and entries too many to be columns, are all stored.
+        """
+        butler = dafPersist.Butler(inputs=os.path.join(ROOT, "data", "input"),
+                                   outputs={"root": self.testDir, "mode": "rw"})
+        metadata = dafBase.PropertySet()
+        metadata.setInt("visit", 7)
+        metadata.setInt("VISIT", 8)
+        metadata.setInt("Test.value", 1)
+        metadata.setInt("test.value", 2)
+        for i in range(3000):
+            metadata.setInt("many.entry%d" % (i,), i)
+        butler.put(metadata, "test_metadata", visit=1, filter="g")
+
+        store = lsst.obs.test.MetadataStore(os.path.join(self.testDir, lsst.obs.test.MetadataStoreName))
+        result = store.query("test_metadata", ["visit", "metadata.visit", "VISIT", "Test.value",
+                                               "test.value", "many.entry2999"])
+        self.assertEqual({name: list(values) for name, values in result.items()},
+                         {"visit": [1], "metadata.visit": [7], "VISIT": [8], "Test.value": [1],
+                          "test.value": [2], "many.entry2999": [2999]})
+
+    def testFailedAppend(self):
+        """The YAML file is not written if the store cannot be updated."""
+        butler = dafPersist.Butler(inputs=os.path.join(ROOT, "data", "input"),
+                                   outputs={"root": self.testDir, "mode": "rw"})
+        os.makedirs(os.path.join(self.testDir, lsst.obs.test.MetadataStoreName))
+        with self.assertRaises(Exception):
+            butler.put(dafBase.PropertySet(), "test_metadata", visit=1, filter="g")
+        self.assertFalse(os.path.exists(os.path.join(self.testDir, "test", "v1_fg.yaml")))
+
+    def testFlatten(self):
+        metadata = dafBase.PropertySet()
+        metadata.setInt("a.b", 1)
+        metadata.setString("a.c", ["x", "y"])
+        metadata.set("d", None)
+        self.assertEqual(lsst.obs.test.flattenMetadata(metadata), {"a.b": 1, "a.c": '["x", "y"]', "d": None})
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
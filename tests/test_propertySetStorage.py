@@ -0,0 +1,120 @@
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+import lsst.daf.base as dafBase
+import lsst.daf.persistence as dafPersist
+# we only import lsst.obs.test.TestMapper from lsst.obs.test,
+# but use the namespace to hide it from pytest
+import lsst.obs.test
+import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+ROOT = getPackageDir('obs_test')
+
+
+def makePropertySet():
+    """Make a PropertySet with entries of every supported type."""
+    metadata = dafBase.PropertySet()
+    metadata.setBool("bool", [True, False])
+    metadata.setShort("short", -3)
+    metadata.setInt("int", [1, 2, 3])
+    metadata.setLong("long", 2**40)
+    metadata.setLongLong("longLong", -2**50)
+    metadata.setFloat("float", 0.5)
+    metadata.setDouble("double", [1.25, float("inf")])
+    metadata.setString("string", ["a", "été", ""])
+    metadata.setDateTime("dateTime", dafBase.DateTime("2020-01-02T03:04:05.123456789Z",
+                                                      dafBase.DateTime.UTC))
+    metadata.set("undef", None)
+    metadata.setInt("nested.task.count", 7)
+    metadata.setString("nested.name", "calibrate")
+    return metadata
+
+
+class PropertySetStorageTestCase(lsst.utils.tests.TestCase):
+    """Test the binary PropertySet format and BinaryPropertySetStorage."""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+
+    def tearDown(self):
+        shutil.rmtree(self.testDir, ignore_errors=True)
+
+    def assertSameContainer(self, container1, container2):
+        self.assertIs(type(container1), type(container2))
+        self.assertEqual(container1.names(False), container2.names(False))
+        for name in container1.names(False):
+            self.assertEqual(container1.typeOf(name), container2.typeOf(name), msg=name)
+            if container1.isPropertySetPtr(name) or container1.isUndefined(name):
+                continue
+            self.assertEqual(container1.getArray(name), container2.getArray(name), msg=name)
+        if isinstance(container1, dafBase.PropertyList):
+            self.assertEqual(container1.getOrderedNames(), container2.getOrderedNames())
+            for name in container1.getOrderedNames():
+                self.assertEqual(container1.getComment(name), container2.getComment(name))
+
+    def testRoundTrip(self):
+        metadata = makePropertySet()
+        data = lsst.obs.test.packPropertySet(metadata)
+        self.assertSameContainer(lsst.obs.test.unpackPropertySet(data), metadata)
+        self.assertLess(len(data), len(yaml.dump(metadata)))
+
+        header = dafBase.PropertyList()
+        header.set("NAXIS", 2, "number of axes")
+        header.set("EXPTIME", 15.0, "")
+        header.set("OBJECT", "field", "object name")
+        header.set("BLANK", None, "no value")
+        header.set("NAXIS1", 100, "length of axis 1")
+        self.assertSameContainer(lsst.obs.test.unpackPropertySet(lsst.obs.test.packPropertySet(header)),
+                                 header)
+
+        with self.assertRaises(ValueError):
+            lsst.obs.test.unpackPropertySet(yaml.dump(metadata).encode())
+
+    def testButler(self):
+        butler = dafPersist.Butler(inputs=os.path.join(ROOT, "data", "input"),
+                                   outputs={"root": self.testDir, "mode": "rw"})
+        metadata = makePropertySet()
+        butler.put(metadata, "test_metadata_bin", visit=1, filter="g")
+        self.assertTrue(os.path.exists(os.path.join(self.testDir, "test", "v1_fg.psbin")))
+        self.assertSameContainer(butler.get("test_metadata_bin", visit=1, filter="g", immediate=True),
+                                 metadata)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,413 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import datetime
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import lsst.afw.image as afwImage
+import lsst.daf.base as dafBase
+import lsst.daf.persistence as dafPersist
+from lsst.obs.base import CameraMapper
+# we only import lsst.obs.test.TestMapper from lsst.obs.test,
+# but use the namespace to hide it from pytest
+import lsst.obs.test
+import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+
+ROOT = getPackageDir('obs_test')
+InputDir = os.path.join(ROOT, "data", "input")
+RegistryPath = os.path.join(InputDir, "registry.sqlite3")
+
+
+class PooledSqliteRegistryTestCase(lsst.utils.tests.TestCase):
+    """Compare PooledSqliteRegistry with SqliteRegistry."""
+
+    def setUp(self):
+        self.registry = lsst.obs.test.PooledSqliteRegistry(RegistryPath)
+        self.sqliteRegistry = dafPersist.SqliteRegistry(RegistryPath)
+
+    def tearDown(self):
+        del self.registry
+        del self.sqliteRegistry
+
+    def testLookup(self):
+        for properties, reference, dataId in (
+            (["filter", "taiObs", "expTime"], "raw_visit", {"visit": 1}),
+            (["visit", "filter"], ["raw"], {"filter": "g"}),
+            (["visit"], ["raw"], {"visit": 3, "filter": "r"}),
+            (["visit"], ["raw"], {"visit": 3, "filter": "g"}),
+            (["visit", "skyTile"], ["raw", "raw_skyTile"], {}),
+        ):
+            for i in range(2):  # second pass uses the cached statement
+                self.assertEqual(self.registry.lookup(properties, reference, dataId),
+                                 self.sqliteRegistry.lookup(properties, reference, dataId))
+
+    def testConnectionPerThread(self):
+        conn = self.registry.conn
+        self.assertIs(self.registry.conn, conn)
+        self.assertIs(lsst.obs.test.PooledSqliteRegistry(RegistryPath).conn, conn)
+        threadConns = []
+        thread = threading.Thread(target=lambda: threadConns.append(self.registry.conn))
+        thread.start()
+        thread.join()
+        self.assertIsNot(threadConns[0], conn)
+
+    def testClose(self):
+        conn = self.registry.conn
+        threadConns = []
+        thread = threading.Thread(target=lambda: threadConns.append(self.registry.conn))
+        thread.start()
+        thread.join()
+        self.registry.close()
+        for closedConn in [conn] + threadConns:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                closedConn.execute("SELECT 1")
+        # a new connection is opened if the registry is used again
+        self.assertIsNot(self.registry.conn, conn)
+        self.assertEqual(self.registry.lookup(["visit"], ["raw"], {"visit": 3}), [(3,)])
+
+    def testMapperClose(self):
+        mapper = lsst.obs.test.TestMapper(root=InputDir, registryMode="pooled")
+        conn = mapper.registry.conn
+        mapper.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+    def testReadOnly(self):
+        with self.assertRaises(Exception):
+            self.registry.conn.execute("DELETE FROM raw")
+
+    def testMapper(self):
+        mapper = lsst.obs.test.TestMapper(root=InputDir, registryMode="pooled")
+        self.assertIsInstance(mapper.registry, lsst.obs.test.PooledSqliteRegistry)
+        self.assertEqual(mapper.queryMetadata("raw", ["visit", "filter"], {"filter": "g"}),
+                         [(1, "g"), (2, "g")])
+        with self.assertRaises(ValueError):
+            lsst.obs.test.TestMapper(root=InputDir, registryMode="unknown")
+
+
+class RegistrySnapshotTestCase(lsst.utils.tests.TestCase):
+    """Compare RegistrySnapshot with SqliteRegistry."""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+        self.registryPath = os.path.join(self.testDir, "registry.sqlite3")
+        shutil.copy(RegistryPath, self.registryPath)
+        self.snapshot = lsst.obs.test.RegistrySnapshot(self.registryPath, checkInterval=0)
+        self.sqliteRegistry = dafPersist.SqliteRegistry(RegistryPath)
+
+    def tearDown(self):
+        del self.snapshot
+        del self.sqliteRegistry
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def testLookup(self):
+        for properties, reference, dataId in (
+            (["filter", "taiObs", "expTime"], "raw_visit", {"visit": 1}),
+            (["visit", "filter"], ["raw"], {"filter": "g"}),
+            (["visit"], ["raw"], {"visit": 3, "filter": "r"}),
+            (["visit"], ["raw"], {"visit": 3, "filter": "g"}),
+            (["filter"], ["raw"], {"visit": "3"}),
+            (["visit"], ["raw"], {"visit": "3.0", "filter": "r"}),
+            (["filter"], ["raw"], {}),
+            (["visit", "skyTile"], ["raw", "raw_skyTile"], {}),
+            (["visit"], ["raw"], {("taiObs", "taiObs"): "1999-01-17T05:22:08.687202048"}),
+        ):
+            self.assertEqual(self.snapshot.lookup(properties, reference, dataId),
+                             self.sqliteRegistry.lookup(properties, reference, dataId))
+
+    def testReload(self):
+        """The snapshot is reloaded when the registry file changes."""
+        self.assertEqual(self.snapshot.lookup(["visit"], ["raw"], {"filter": "r"}), [(3,)])
+        conn = sqlite3.connect(self.registryPath)
+        conn.execute("INSERT INTO raw VALUES (NULL, 4, 'r', '1999-02-20T01:17:24.0', 15.0)")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.snapshot.lookup(["visit"], ["raw"], {"filter": "r"}), [(3,), (4,)])
+
+    def testReloadWal(self):
+        """The snapshot is reloaded when a commit is still in the WAL."""
+        reader = sqlite3.connect(self.registryPath)
+        reader.execute("PRAGMA journal_mode=WAL")
+        self.assertEqual(self.snapshot.lookup(["visit"], ["raw"], {"filter": "r"}), [(3,)])
+        st = os.stat(self.registryPath)
+        writer = sqlite3.connect(self.registryPath)
+        writer.execute("INSERT INTO raw VALUES (NULL, 4, 'r', '1999-02-20T01:17:24.0', 15.0)")
+        writer.commit()
+        writer.close()
+        # the open reader keeps the commit out of the registry file
+        self.assertEqual((os.stat(self.registryPath).st_mtime_ns, os.stat(self.registryPath).st_size),
+                         (st.st_mtime_ns, st.st_size))
+        self.assertEqual(self.snapshot.lookup(["visit"], ["raw"], {"filter": "r"}), [(3,), (4,)])
+        reader.close()
+        self.snapshot.close()
+
+    def testMapper(self):
+        mapper = lsst.obs.test.TestMapper(root=InputDir, registryMode="snapshot")
+        self.assertIsInstance(mapper.registry, lsst.obs.test.RegistrySnapshot)
+        self.assertEqual(mapper.queryMetadata("raw", ["visit", "filter"], {"filter": "g"}),
+                         [(1, "g"), (2, "g")])
+
+
+class QueryMetadataTestCase(lsst.utils.tests.TestCase):
+    """Compare TestMapper.queryMetadata with the registry queries of
+    CameraMapper.queryMetadata.
+    """
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+        shutil.copy(RegistryPath, os.path.join(self.testDir, "registry.sqlite3"))
+        self.mapper = lsst.obs.test.TestMapper(root=self.testDir)
+
+    def tearDown(self):
+        del self.mapper
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def testQueryMetadata(self):
+        for datasetType, format, dataId in (
+            ("raw", ["visit"], {}),
+            ("raw", ["visit", "filter"], {"filter": "g"}),
+            ("raw", ["filter"], {"visit": "3"}),
+            ("raw", ["visit"], {"visit": 3, "filter": "g"}),
+            ("postISRCCD", ["visit", "filter"], {}),
+        ):
+            self.assertEqual(sorted(self.mapper.queryMetadata(datasetType, format, dataId)),
+                             sorted(CameraMapper.queryMetadata(self.mapper, datasetType, format, dataId)))
+        self.assertIsNotNone(self.mapper.getMetadataIndex())
+
+    def testRebuild(self):
+        """The index is rebuilt when the registry changes."""
+        self.assertEqual(self.mapper.queryMetadata("raw", ["visit"], {"filter": "r"}), [(3,)])
+        conn = sqlite3.connect(os.path.join(self.testDir, "registry.sqlite3"))
+        conn.execute("INSERT INTO raw VALUES (NULL, 4, 'r', '1999-02-20T01:17:24.0', 15.0)")
+        conn.execute("INSERT INTO raw_skyTile VALUES (last_insert_rowid(), 86653)")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.mapper.queryMetadata("raw", ["visit"], {"filter": "r"}), [(3,), (4,)])
+
+    def testRebuildWal(self):
+        """The index is rebuilt when a registry commit is still in the WAL."""
+        registryPath = os.path.join(self.testDir, "registry.sqlite3")
+        reader = sqlite3.connect(registryPath)
+        reader.execute("PRAGMA journal_mode=WAL")
+        self.assertEqual(self.mapper.queryMetadata("raw", ["visit"], {"filter": "r"}), [(3,)])
+        writer = sqlite3.connect(registryPath)
+        writer.execute("INSERT INTO raw VALUES (NULL, 4, 'r', '1999-02-20T01:17:24.0', 15.0)")
+        writer.execute("INSERT INTO raw_skyTile VALUES (last_insert_rowid(), 86653)")
+        writer.commit()
+        writer.close()
+        self.assertEqual(self.mapper.queryMetadata("raw", ["visit"], {"filter": "r"}), [(3,), (4,)])
+        reader.close()
+
+
+class CalibValidityIndexTestCase(lsst.utils.tests.TestCase):
+    """Test CalibValidityIndex against registry range lookups."""
+
+    def setUp(self):
+        self.index = lsst.obs.test.CalibValidityIndex({"flat": [
+            ("2000-01-01T00:00:00", "2000-01-01", "2000-01-10", "g"),
+            ("2000-01-11T00:00:00", "2000-01-11", "2037-12-31", "g"),
+            ("2000-01-05T00:00:00", "2000-01-05", "2037-12-31", "r"),
+        ]})
+
+    def testIsoToMjd(self):
+        self.assertEqual(lsst.obs.test.isoToMjd("1858-11-17"), 0.0)
+        self.assertEqual(lsst.obs.test.isoToMjd("1970-01-01T00:00:00"), 40587.0)
+        self.assertAlmostEqual(lsst.obs.test.isoToMjd("1999-01-17T04:52:34.895201920"),
+                               51195.20318165743, places=9)
+        self.assertTrue(math.isnan(lsst.obs.test.isoToMjd("None")))
+
+    def testLookup(self):
+        obsDates = ["1999-12-31T23:00:00", "2000-01-03T04:52:34.8952", "2000-01-10T12:00:00",
+                    "2000-01-15T00:00:00", "2000-01-15T00:00:00"]
+        self.assertEqual(list(self.index.lookupMany("flat", obsDates, filter="g")),
+                         [None, "2000-01-01T00:00:00", None, "2000-01-11T00:00:00", "2000-01-11T00:00:00"])
+        self.assertEqual(self.index.lookup("flat", "2000-01-06", filter="r"), "2000-01-05T00:00:00")
+        # without a filter the g and r flats overlap
+        self.assertEqual(self.index.lookup("flat", "2000-01-06"), None)
+        self.assertEqual(self.index.lookup("flat", "2000-01-03"), "2000-01-01T00:00:00")
+
+    def testTouchingRanges(self):
+        """Ranges that touch, as made by ingest with untilSuperseded, are
+        searched without comparing every date with every range.
+        """
+        numCalibs = 5000
+        dates = [(datetime.date(2000, 1, 1) + datetime.timedelta(days=i)).isoformat()
+                 for i in range(numCalibs + 1)]
+        rows = [(dates[i] + "T00:00:00", dates[i], dates[i + 1], "g") for i in range(numCalibs)]
+        # a range nested in another one
+        rows.append(("nested", "2000-01-03T06:00:00", "2000-01-03T18:00:00", "g"))
+        index = lsst.obs.test.CalibValidityIndex({"flat": rows})
+        obsDates = [date + "T12:00:00" for date in dates[:numCalibs]]
+        expected = [row[0] for row in rows[:numCalibs]]
+        expected[2] = None
+        self.assertEqual(list(index.lookupMany("flat", obsDates, filter="g")), expected)
+        # boundaries shared by two ranges are ambiguous, as in the registry
+        self.assertEqual(list(index.lookupMany("flat", dates[1:4] + [dates[0], dates[-1]])),
+                         [None, None, None, rows[0][0], rows[-2][0]])
+        self.assertEqual(index.lookup("flat", "2000-01-03T03:00:00"), rows[2][0])
+
+    def testRegistry(self):
+        index = lsst.obs.test.CalibValidityIndex.fromRegistry(os.path.join(InputDir, "calibRegistry.sqlite3"))
+        self.assertIn("defects", index.calibTypes)
+        self.assertEqual(index.lookup("defects", "1999-01-17T04:52:34.895201920"), "1970-01-01T00:00:00")
+        self.assertIsNone(index.lookup("bias", "1999-01-17T04:52:34.895201920"))
+
+        mapper = lsst.obs.test.TestMapper(root=InputDir)
+        self.assertEqual(mapper.findCalibs("defects", [{"visit": 1}, {"visit": 3}, {"visit": 99}]),
+                         ["1970-01-01T00:00:00", "1970-01-01T00:00:00", None])
+
+
+class ExpandDataIdsTestCase(lsst.utils.tests.TestCase):
+    """Test batched validation and expansion of data IDs."""
+
+    def setUp(self):
+        self.mapper = lsst.obs.test.TestMapper(root=InputDir)
+
+    def tearDown(self):
+        del self.mapper
+
+    def testExpand(self):
+        records = self.mapper.expandDataIds([{"visit": "1"}, {"visit": 99}, {"visit": 3, "filter": "g"},
+                                             {"filter": "g"}])
+        self.assertEqual([[record.toDict() for record in matches] for matches in records],
+                         [[{"visit": 1, "filter": "g"}], [], [],
+                          [{"visit": 1, "filter": "g"}, {"visit": 2, "filter": "g"}]])
+        self.assertEqual(records[0][0].taiObs, "1999-01-17T04:52:34.895201920")
+        # records are hashable, and equal records hash equal
+        self.assertEqual(len({records[0][0], records[3][0], records[3][1]}), 2)
+        self.assertEqual([len(matches) for matches in self.mapper.expandDataIds([{}])], [3])
+        # extra data ID values need not be hashable
+        record, = self.mapper.expandDataIds([{"visit": 1, "tags": ["a"]}])[0]
+        self.assertEqual(record.toDict()["tags"], ["a"])
+        self.assertIsInstance(hash(record), int)
+
+    def testValidateMany(self):
+        dataIdList = self.mapper.validateMany([{"visit": "2"}, {"filter": "r"}])
+        self.assertEqual(dataIdList, [{"visit": 2}, {"filter": "r"}])
+
+
+class CalibIngestTestCase(lsst.utils.tests.TestCase):
+    """Test computing calibration validity ranges in one pass."""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+
+    def tearDown(self):
+        shutil.rmtree(self.testDir, ignore_errors=True)
+
+    def writeFlat(self, filterName, calibDate, ccd=0):
+        path = os.path.join(self.testDir, "flat_%s_%s_%d.fits" % (filterName, calibDate, ccd))
+        md = dafBase.PropertyList()
+        md.set("OBSTYPE", "flat")
+        md.set("FILTER", filterName)
+        md.set("CALIBDATE", calibDate)
+        md.set("DETECTOR", ccd)
+        afwImage.ImageF(1, 1).writeFits(path, md)
+        return path
+
+    def testUntilSuperseded(self):
+        validStart, validEnd = lsst.obs.test.computeValidity(
+            ["2000-02-01", "2000-01-01T12:00:00", "2000-03-01", "2000-02-01"], untilSuperseded=True)
+        self.assertEqual(validStart, ["2000-02-01", "2000-01-01", "2000-03-01", "2000-02-01"])
+        self.assertEqual(validEnd, ["2000-03-01", "2000-02-01", "2037-12-31", "2000-03-01"])
+
+    def testValidity(self):
+        validStart, validEnd = lsst.obs.test.computeValidity(
+            ["2000-01-10", "2000-01-01", "2000-03-01"], untilSuperseded=False, validity=5)
+        self.assertEqual(validStart, ["2000-01-06", "1999-12-27", "2000-02-25"])
+        self.assertEqual(validEnd, ["2000-01-15", "2000-01-06", "2000-03-06"])
+        validStart, validEnd = lsst.obs.test.computeValidity(
+            ["2000-01-10", "2000-01-01", "2000-03-01"], untilSuperseded=False, validity=5,
+            incrementValidEnd=False)
+        self.assertEqual(validStart, ["2000-01-06", "1999-12-27", "2000-02-25"])
+        self.assertEqual(validEnd, ["2000-01-15", "2000-01-05", "2000-03-06"])
+
+    def testIngestFilters(self):
+        """Test registering flats of two filters with the same date"""
+        pathList = [self.writeFlat("g", "2000-01-01"), self.writeFlat("r", "2000-01-01")]
+        registryPath = os.path.join(self.testDir, "calibRegistry.sqlite3")
+        self.assertEqual(lsst.obs.test.ingestCalibs(registryPath, pathList).numIngested, 2)
+        conn = sqlite3.connect(registryPath)
+        self.assertEqual(sorted(conn.execute("SELECT filter FROM flat")), [("g",), ("r",)])
+        conn.close()
+
+        # A table unique on calibDate alone, as made by
+        # IngestCuratedCalibsTask, cannot hold both
+        registryPath = os.path.join(self.testDir, "curated.sqlite3")
+        conn = sqlite3.connect(registryPath)
+        conn.execute("""CREATE TABLE flat (id integer primary key autoincrement, calibDate text,
+            validStart text, validEnd text, filter text, ccd int, unique(calibDate))""")
+        conn.commit()
+        conn.close()
+        with self.assertRaises(RuntimeError):
+            lsst.obs.test.ingestCalibs(registryPath, pathList)
+        conn = sqlite3.connect(registryPath)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM flat").fetchone()[0], 0)
+        conn.close()
+        lsst.obs.test.ingestCalibs(registryPath, pathList[:1])
+
+    def testIngestDetectors(self):
+        """Test registering flats of two detectors with the same date"""
+        pathList = [self.writeFlat("g", "2000-01-01", ccd) for ccd in (0, 1)] + \
+            [self.writeFlat("g", "2000-02-01", 1)]
+        registryPath = os.path.join(self.testDir, "calibRegistry.sqlite3")
+        lsst.obs.test.ingestCalibs(registryPath, pathList)
+        # registering a calibration again changes nothing
+        lsst.obs.test.ingestCalibs(registryPath, pathList[:1])
+        conn = sqlite3.connect(registryPath)
+        self.assertEqual(sorted(conn.execute("SELECT ccd, calibDate, validEnd FROM flat")),
+                         [(0, "2000-01-01", "2037-12-31"), (1, "2000-01-01", "2000-02-01"),
+                          (1, "2000-02-01", "2037-12-31")])
+        conn.close()
+
+        # A table unique on (filter, calibDate) cannot hold both
+        registryPath = os.path.join(self.testDir, "noDetector.sqlite3")
+        conn = sqlite3.connect(registryPath)
+        conn.execute("""CREATE TABLE flat (id integer primary key autoincrement, calibDate text,
+            validStart text, validEnd text, filter text, ccd int, unique(filter, calibDate))""")
+        conn.commit()
+        conn.close()
+        with self.assertRaises(RuntimeError):
+            lsst.obs.test.ingestCalibs(registryPath, pathList[:2])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,150 @@
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.daf.base as dafBase
+import lsst.geom
+# we only import lsst.obs.test.TestMapper from lsst.obs.test,
+# but use the namespace to hide it from pytest
+import lsst.obs.test
+import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+ROOT = getPackageDir('obs_test')
+InputDir = os.path.join(ROOT, "data", "input")
+
+
+class StreamingExposureWriterTestCase(lsst.utils.tests.TestCase):
+    """Test StreamingExposureWriter and TestMapper.openStreamingWriter."""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+        self.width, self.height, self.blockRows = 100, 37, 8
+        rng = np.random.RandomState(5)
+        self.image = rng.randint(-2**31, 2**31 - 1, size=(self.height, self.width)).astype(np.int32)
+        self.mask = rng.randint(0, 16, size=self.image.shape).astype(np.int32)
+        self.variance = rng.uniform(0, 100, size=self.image.shape).astype(np.float32)
+        self.metadata = dafBase.PropertyList()
+        self.metadata.set("EXPTIME", 15.0, "exposure time")
+        self.metadata.set("OBJECT", "O'Brien field")
+        self.metadata.set("ESO DET CHIPS", 4)
+        self.metadata.set("FLAG", True)
+
+    def tearDown(self):
+        shutil.rmtree(self.testDir, ignore_errors=True)
+
+    def writeBlocks(self, writer, withPlanes=True):
+        # write the blocks out of order, as a parallel producer might
+        for y in reversed(range(0, self.height, self.blockRows)):
+            rows = slice(y, y + self.blockRows)
+            if withPlanes:
+                writer.writeRows(y, self.image[rows], self.mask[rows], self.variance[rows])
+            else:
+                writer.writeRows(y, self.image[rows])
+
+    def testRoundTrip(self):
+        path = os.path.join(self.testDir, "sub", "exp.fits")
+        planes = afwImage.Mask().getMaskPlaneDict()
+        with lsst.obs.test.StreamingExposureWriter(path, self.width, self.height, metadata=self.metadata,
+                                                   xy0=(3, -4), maskPlanes=planes) as writer:
+            self.writeBlocks(writer)
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.path.getsize(path) % 2880, 0)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["exp.fits"])
+        umask = os.umask(0o022)
+        os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o666 & ~umask)
+
+        exposure = afwImage.ExposureI(path)
+        self.assertEqual(exposure.getXY0(), lsst.geom.Point2I(3, -4))
+        np.testing.assert_array_equal(exposure.image.array, self.image)
+        np.testing.assert_array_equal(exposure.mask.array, self.mask)
+        np.testing.assert_array_equal(exposure.variance.array, self.variance)
+        metadata = exposure.getMetadata()
+        self.assertEqual(metadata.getScalar("EXPTIME"), 15.0)
+        self.assertEqual(metadata.getScalar("OBJECT"), "O'Brien field")
+        self.assertEqual(metadata.getScalar("ESO DET CHIPS"), 4)
+        self.assertTrue(metadata.getScalar("FLAG"))
+
+    def testUnsignedImage(self):
+        path = os.path.join(self.testDir, "exp.fits")
+        image = (self.image.astype(np.int64) % 65536).astype(np.uint16)
+        with lsst.obs.test.StreamingExposureWriter(path, self.width, self.height, dtype=np.uint16) as writer:
+            writer.writeRows(0, image)
+        exposure = afwImage.ExposureU(path)
+        np.testing.assert_array_equal(exposure.image.array, image)
+        np.testing.assert_array_equal(exposure.mask.array, 0)
+
+    def testErrors(self):
+        path = os.path.join(self.testDir, "exp.fits")
+        with self.assertRaises(ValueError):
+            lsst.obs.test.StreamingExposureWriter(path + ".fz", self.width, self.height)
+        with self.assertRaises(TypeError):
+            lsst.obs.test.StreamingExposureWriter(path, self.width, self.height, dtype=np.complex64)
+        with self.assertRaises(ValueError):
+            with lsst.obs.test.StreamingExposureWriter(path, self.width, self.height) as writer:
+                writer.writeRows(self.height - 1, self.image[:2])
+        # an aborted file is discarded
+        self.assertEqual(os.listdir(self.testDir), [])
+
+    def testMapper(self):
+        """Test streaming an fcr exposure into a repository and finding
+        and reading it.
+        """
+        os.symlink(InputDir, os.path.join(self.testDir, "_parent"))
+        mapper = lsst.obs.test.TestMapper(root=self.testDir)
+        dataId = dict(visit=1, filter="g")
+        with mapper.openStreamingWriter("fcr", dataId, self.width, self.height,
+                                        metadata=self.metadata) as writer:
+            self.writeBlocks(writer, withPlanes=False)
+        self.assertEqual(mapper.getUris("fcr", [dataId]), [os.path.join(self.testDir, "fcr",
+                                                                        "v1_fg.fcr.fits")])
+        exposure = mapper.map("fcr", dataId).getLocationsWithRoot()[0]
+        exposure = afwImage.ExposureI(exposure)
+        np.testing.assert_array_equal(exposure.image.array, self.image)
+        np.testing.assert_array_equal(exposure.variance.array, 0)
+
+        with self.assertRaises(ValueError):
+            mapper.openStreamingWriter("raw", dataId, self.width, self.height)
+        with self.assertRaises(ValueError):
+            mapper.openStreamingWriter("test_metadata", dataId, self.width, self.height)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
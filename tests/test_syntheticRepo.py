@@ -0,0 +1,95 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from lsst.afw.fits import readMetadata
+# we only import lsst.obs.test.TestMapper from lsst.obs.test,
+# but use the namespace to hide it from pytest
+import lsst.obs.test
+import lsst.utils.tests
+
+
+class SyntheticRepoTestCase(lsst.utils.tests.TestCase):
+    """Test making synthetic obs_test repositories."""
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def readRaw(self, root):
+        conn = sqlite3.connect(os.path.join(root, "registry.sqlite3"))
+        try:
+            return conn.execute("SELECT visit, filter, taiObs, expTime FROM raw ORDER BY visit").fetchall()
+        finally:
+            conn.close()
+
+    def testRegistries(self):
+        root1 = os.path.join(self.tempDir, "repo1")
+        root2 = os.path.join(self.tempDir, "repo2")
+        result = lsst.obs.test.makeSyntheticRepo(root1, 50, filters=("g", "r", "i"), numCalibs=3, seed=5)
+        self.assertEqual(result.numVisits, 50)
+        lsst.obs.test.makeSyntheticRepo(root2, 50, filters=("g", "r", "i"), numCalibs=3, seed=5)
+        rows = self.readRaw(root1)
+        self.assertEqual(len(rows), 50)
+        self.assertEqual(rows, self.readRaw(root2))
+        self.assertEqual(rows[0][2][:19], "1999-01-17T04:52:34")
+        self.assertLessEqual({row[1] for row in rows}, {"g", "r", "i"})
+        with self.assertRaises(RuntimeError):
+            lsst.obs.test.makeSyntheticRepo(root1, 10)
+
+        mapper = lsst.obs.test.TestMapper(root=root1)
+        self.assertEqual(len(mapper.expandDataIds([{}])[0]), 50)
+        self.assertEqual(mapper.findCalibs("defects", [{"visit": 1}]), ["1970-01-01T00:00:00"])
+        self.assertEqual(mapper.findCalibs("bias", [{"visit": 1}]), ["1999-01-17T00:00:00"])
+
+    def testTinyPixels(self):
+        root = os.path.join(self.tempDir, "repo")
+        lsst.obs.test.makeSyntheticRepo(root, 3, filters=("z",), pixels="tiny")
+        md = readMetadata(os.path.join(root, "raw", "raw_v2_fz.fits.gz"))
+        self.assertEqual(md.getScalar("NAXIS1"), 8)
+        self.assertEqual(md.getScalar("FILTER").strip(), "z")
+        self.assertEqual(md.getScalar("OBSID"), 2)
+        self.assertTrue(os.path.exists(os.path.join(root, "defects", "defects.fits")))
+
+    def testBadPixels(self):
+        with self.assertRaises(ValueError):
+            lsst.obs.test.makeSyntheticRepo(os.path.join(self.tempDir, "repo"), 3, pixels="large")
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,138 @@
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import importlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+import lsst.utils
+import lsst.utils.tests
+import lsst.pipe.base as pipeBase
+import lsst.obs.test
+
+ObsTestDir = lsst.utils.getPackageDir("obs_test")
+DataPath = os.path.join(ObsTestDir, "data", "input")
+
+
+class WarmExampleTask(pipeBase.CmdLineTask):
+    ConfigClass = lsst.obs.test.TestConfig
+    _DefaultName = "test"
+
+    def runDataRef(self, dataRef):
+        if self.config.doFail:
+            raise pipeBase.TaskError("Failed by request: config.doFail is true")
+        mapper, _ = lsst.obs.test.getButlerRepositories(dataRef.getButler())
+        if mapper.prebuiltCamera is None:
+            raise RuntimeError("The mapper of a warm job did not get the prebuilt camera")
+        return pipeBase.Struct(camera=dataRef.get("camera"))
+
+
+class WarmServerTestCase(unittest.TestCase):
+    """Test running command-line tasks through a WarmServer."""
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.socketPath = os.path.join(self.tempDir, "warm.sock")
+        self.server = lsst.obs.test.WarmServer(self.socketPath,
+                                               allowedTasks=[__name__ + ".WarmExampleTask"])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        del self.server
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+    def testRun(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socketPath).st_mode), 0o600)
+        # the prebuilt camera is only for the mappers of jobs
+        self.assertIsNone(lsst.obs.test.TestMapper(root=DataPath).prebuiltCamera)
+        taskName = __name__ + ".WarmExampleTask"
+        outPath = os.path.join(self.tempDir, "output")
+        response = lsst.obs.test.runWarmTask(self.socketPath, taskName,
+                                             [DataPath, "--output", outPath, "--id", "visit=1"],
+                                             forwardOutput=False)
+        self.assertEqual(response["exitStatus"], 0)
+        self.assertIsNone(response["error"])
+        self.assertGreater(response["startupSaved"], 0)
+        self.assertTrue(os.path.exists(os.path.join(outPath, "config", "test.py")))
+
+        response = lsst.obs.test.runWarmTask(self.socketPath, taskName,
+                                             [DataPath, "--output", outPath, "--id", "visit=1",
+                                              "--config", "doFail=True", "--clobber-config"],
+                                             forwardOutput=False)
+        self.assertNotEqual(response["exitStatus"], 0)
+        self.assertEqual(self.server.numJobs, 2)
+
+    def testAllowedTasks(self):
+        response = lsst.obs.test.runWarmTask(self.socketPath, "lsst.pipe.base.CmdLineTask", [DataPath],
+                                             forwardOutput=False)
+        self.assertNotEqual(response["exitStatus"], 0)
+        self.assertIn("not allowed", response["error"])
+
+    def testServerClose(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.assertFalse(os.path.exists(self.socketPath))
+
+
+class LazyImportTestCase(unittest.TestCase):
+    """Test that the optional subsystems are imported on first use."""
+
+    def testNotImported(self):
+        code = ("import sys, lsst.obs.test; "
+                "print(sorted(name for name in sys.modules if name.startswith('lsst.obs.test.')))")
+        modules = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+        for moduleName in lsst.obs.test._lazyModules:
+            self.assertNotIn("'lsst.obs.test.%s'" % (moduleName,), modules)
+        self.assertIn("'lsst.obs.test.testMapper'", modules)
+
+    def testNames(self):
+        for moduleName, names in lsst.obs.test._lazyModules.items():
+            module = importlib.import_module("lsst.obs.test." + moduleName)
+            self.assertEqual(sorted(names), sorted(module.__all__))
+            for name in names:
+                self.assertIs(getattr(lsst.obs.test, name), getattr(module, name))
+                self.assertIn(name, dir(lsst.obs.test))
+        with self.assertRaises(AttributeError):
+            lsst.obs.test.noSuchName
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,125 @@
+#
+# This file is part of obs_test.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import lsst.daf.base as dafBase
+import lsst.daf.persistence as dafPersist
+# we only import lsst.obs.test.TestMapper from lsst.obs.test,
+# but use the namespace to hide it from pytest
+import lsst.obs.test
+import lsst.utils.tests
+from lsst.utils import getPackageDir
+
+ROOT = getPackageDir('obs_test')
+
+
+class WriteBehindTestCase(lsst.utils.tests.TestCase):
+    """Test puts queued with TestMapper(writeBehind=...)."""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=os.path.join(ROOT, 'tests'), prefix=type(self).__name__+'-')
+        self.butler = dafPersist.Butler(
+            inputs=os.path.join(ROOT, "data", "input"),
+            outputs=dafPersist.RepositoryArgs(root=self.testDir, mapper=lsst.obs.test.TestMapper,
+                                              mapperArgs=dict(writeBehind=2, maxPendingWrites=2)))
+
+    def tearDown(self):
+        lsst.obs.test.flushWrites()
+        del self.butler
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def testPut(self):
+        for visit in (1, 2, 3):
+            metadata = dafBase.PropertySet()
+            metadata.set("visit", visit)
+            self.butler.put(metadata, "test_metadata", visit=visit, filter="g")
+        # Reads wait for the queued write of the dataset
+        self.assertTrue(self.butler.datasetExists("test_metadata", visit=3, filter="g"))
+        self.assertTrue(os.path.exists(self.butler.getUri("test_metadata", visit=2, filter="g")))
+        lsst.obs.test.flushWrites()
+        for visit in (1, 2, 3):
+            metadata = self.butler.get("test_metadata", visit=visit, filter="g", immediate=True)
+            self.assertEqual(metadata.getScalar("visit"), visit)
+        # No temporary files are left behind
+        self.assertEqual([name for name in os.listdir(os.path.join(self.testDir, "test"))
+                          if name.startswith(".tmp-")], [])
+
+    def testListing(self):
+        """Writes list their own temporary directory, not the destination."""
+        listed = []
+        listdir = os.listdir
+
+        def recordListdir(path="."):
+            listed.append(os.path.abspath(path))
+            return listdir(path)
+
+        with unittest.mock.patch("os.listdir", recordListdir):
+            for visit in (1, 2):
+                self.butler.put(dafBase.PropertySet(), "test_metadata", visit=visit, filter="g")
+            lsst.obs.test.flushWrites()
+        destination = os.path.abspath(os.path.join(self.testDir, "test"))
+        self.assertNotIn(destination, listed)
+        self.assertEqual(len([path for path in listed if os.path.dirname(path) == destination]), 2)
+
+    def testFinalPath(self):
+        tempName = ".tmp-%s" % ("0" * 32,)
+        self.assertEqual(lsst.obs.test.getFinalPath(os.path.join("a", "b", tempName, "c.fits")),
+                         os.path.join("a", "b", "c.fits"))
+        self.assertEqual(lsst.obs.test.getFinalPath(os.path.join("a", "b", "c.fits")),
+                         os.path.join("a", "b", "c.fits"))
+
+    def testError(self):
+        # A lock cannot be serialized
+        self.butler.put(threading.Lock(), "test_metadata", visit=1, filter="g")
+        with self.assertRaises(RuntimeError):
+            lsst.obs.test.flushWrites()
+        self.assertFalse(os.path.exists(os.path.join(self.testDir, "test", "v1_fg.yaml")))
+        # Errors are raised once
+        lsst.obs.test.flushWrites()
+
+    def testQueue(self):
+        with lsst.obs.test.WriteBehindQueue(numThreads=1, maxPending=1) as queue:
+            self.assertEqual(len(queue), 0)
+        with self.assertRaises(RuntimeError):
+            queue.submitCall([], print)
+        with self.assertRaises(ValueError):
+            lsst.obs.test.WriteBehindQueue(numThreads=0)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()